@@ -0,0 +1,219 @@
+"""
+Benchmark for the device control hot path.
+
+Measures `apply_preset` and `turn_off_bulbs` against simulated Tapo bulbs for
+a range of lamp counts and reports latency percentiles and device round trips
+per operation as JSON.
+
+Usage:
+    python benchmarks/device_control.py --lamps 1 10 100 --iterations 20
+    python benchmarks/device_control.py --compare benchmarks/results/old.json
+"""
+
+import argparse
+import json
+import logging
+import os
+import sys
+import time
+
+from fakes import DeviceProfile, install_fake_devices
+from harness import (
+    compare_results,
+    populate_lamps,
+    run_metadata,
+    sandbox,
+    summarize_latencies,
+    write_results,
+)
+
+DEFAULT_OUTPUT = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "results", "device_control.json"
+)
+
+PRESETS = {
+    "temp": {"type": "temp", "setting": 3500, "brightness": 80},
+    "color": None,  # Built per lamp count, one color setting per lamp
+}
+
+
+def color_preset(lamp_count):
+    palette = ["#ff8800", "#3366ff", "#22aa44", "#aa22aa", "#ffee00"]
+    return [
+        {"type": "color", "setting": palette[i % len(palette)], "brightness": 70}
+        for i in range(lamp_count)
+    ]
+
+
+def load_lamps():
+    # pylint: disable=import-outside-toplevel
+    from db.models import Lamp
+    from db.session import get_session
+
+    session = get_session()
+    try:
+        return session.query(Lamp).all()
+    finally:
+        session.close()
+
+
+def run_scenario(factory, operation, preset_kind, lamp_count, iterations, warmup):
+    """
+    Runs one operation repeatedly and collects latency and round-trip counts.
+    """
+    # pylint: disable=import-outside-toplevel
+    from services.preset_service import apply_preset, turn_off_bulbs
+
+    populate_lamps(lamp_count)
+    lamps = load_lamps()
+    value = PRESETS[preset_kind] if preset_kind == "temp" else color_preset(lamp_count)
+
+    def invoke():
+        if operation == "apply_preset":
+            apply_preset(value, lamps)
+        else:
+            turn_off_bulbs()
+
+    for _ in range(warmup):
+        try:
+            invoke()
+        except Exception:  # pylint: disable=broad-except
+            pass
+
+    factory.stats.reset()
+    latencies = []
+    errors = 0
+    for _ in range(iterations):
+        start = time.perf_counter()
+        try:
+            invoke()
+        except Exception:  # pylint: disable=broad-except
+            errors += 1
+        latencies.append(time.perf_counter() - start)
+
+    calls, failures = factory.stats.snapshot()
+    total_calls = sum(calls.values())
+    return {
+        "operation": operation,
+        "preset": preset_kind if operation == "apply_preset" else "-",
+        "lamps": lamp_count,
+        "iterations": iterations,
+        "errors": errors,
+        "error_rate": round(errors / iterations, 4) if iterations else 0.0,
+        "latency_ms": summarize_latencies(latencies),
+        "round_trips": {
+            "per_operation": round(total_calls / iterations, 2) if iterations else 0,
+            "per_lamp": (
+                round(total_calls / iterations / lamp_count, 2) if iterations else 0
+            ),
+            "by_method": dict(sorted(calls.items())),
+            "failed": dict(sorted(failures.items())),
+        },
+    }
+
+
+def parse_args(argv=None):
+    defaults = DeviceProfile()
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument(
+        "--lamps", type=int, nargs="+", default=[1, 2, 5, 10, 25, 50, 100]
+    )
+    parser.add_argument("--iterations", type=int, default=10)
+    parser.add_argument("--warmup", type=int, default=1)
+    parser.add_argument(
+        "--operations",
+        nargs="+",
+        choices=["apply_preset", "turn_off_bulbs"],
+        default=["apply_preset", "turn_off_bulbs"],
+    )
+    parser.add_argument(
+        "--presets", nargs="+", choices=list(PRESETS), default=list(PRESETS)
+    )
+    parser.add_argument("--handshake-ms", type=float, default=defaults.handshake_ms)
+    parser.add_argument("--command-ms", type=float, default=defaults.command_ms)
+    parser.add_argument("--jitter", type=float, default=defaults.jitter)
+    parser.add_argument(
+        "--handshake-failure-rate",
+        type=float,
+        default=defaults.handshake_failure_rate,
+    )
+    parser.add_argument(
+        "--command-failure-rate", type=float, default=defaults.command_failure_rate
+    )
+    parser.add_argument(
+        "--time-scale",
+        type=float,
+        default=0.1,
+        help="Multiplier for simulated latency; 1.0 is real time.",
+    )
+    parser.add_argument("--seed", type=int, default=defaults.seed)
+    parser.add_argument("--output", default=DEFAULT_OUTPUT)
+    parser.add_argument(
+        "--compare", help="Previous results file to compare this run against."
+    )
+    parser.add_argument(
+        "--threshold",
+        type=float,
+        default=10.0,
+        help="Allowed p50/p95 slowdown in percent when comparing.",
+    )
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    profile = DeviceProfile(
+        handshake_ms=args.handshake_ms,
+        command_ms=args.command_ms,
+        jitter=args.jitter,
+        handshake_failure_rate=args.handshake_failure_rate,
+        command_failure_rate=args.command_failure_rate,
+        time_scale=args.time_scale,
+        seed=args.seed,
+    )
+    os.environ.setdefault("TAPO_USERNAME", "bench@example.com")
+    os.environ.setdefault("TAPO_PASSWORD", "bench")
+    logging.getLogger("LuminaSync").setLevel(logging.CRITICAL)
+
+    results = []
+    with sandbox():
+        factory = install_fake_devices(profile)
+        for lamp_count in args.lamps:
+            for operation in args.operations:
+                kinds = args.presets if operation == "apply_preset" else ["-"]
+                for kind in kinds:
+                    result = run_scenario(
+                        factory, operation, kind, lamp_count, args.iterations, args.warmup
+                    )
+                    latency = result["latency_ms"]
+                    print(
+                        f"{operation:<15} {result['preset']:<6} lamps={lamp_count:<4}"
+                        f" p50={latency['p50']:>9.1f}ms p95={latency['p95']:>9.1f}ms"
+                        f" p99={latency['p99']:>9.1f}ms"
+                        f" trips/op={result['round_trips']['per_operation']:<7}"
+                        f" errors={result['errors']}",
+                        file=sys.stderr,
+                    )
+                    results.append(result)
+
+    payload = {"meta": run_metadata("device_control", vars(args)), "results": results}
+    write_results(args.output, payload)
+    print(f"Results written to {args.output}", file=sys.stderr)
+
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as handle:
+            baseline = json.load(handle)
+        lines, regressions = compare_results(
+            baseline,
+            payload,
+            key_fields=("operation", "preset", "lamps"),
+            metrics=("p50", "p95"),
+            threshold=args.threshold,
+        )
+        print("\n".join(lines))
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
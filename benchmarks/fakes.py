@@ -0,0 +1,673 @@
+"""
+In-process fakes for the hardware and upstream services the application
+talks to.
+
+`FakeL530` mimics the public surface of `PyP100.PyL530.L530` that
+`TapoLampInterface` relies on. It sleeps for a configurable handshake and
+per-command latency, fails a configurable fraction of calls and counts every
+device round trip so benchmarks can report how chatty an operation is. Its
+session is a `FakeAuthProtocol`, which carries the same attributes as the KLAP
+protocol of PyP100, so stored sessions can be restored into it.
+
+`FakeKlapServer` serves the same bulbs over KLAP for the asyncio driver, as
+an `httpx.MockTransport`. It runs the real handshake and encryption, so the
+driver's protocol code is exercised, and shares the state, latency model and
+stats of the factory.
+
+`install_fake_upstreams` replaces the open-meteo, newsdata and OpenAI clients
+with canned responses that take a configurable amount of time. The weather and
+news APIs are faked behind the transport adapter of the shared upstream
+client, so its retries and revalidation still run.
+"""
+
+import asyncio
+import base64
+import hashlib
+import json
+import random
+import threading
+import time
+from collections import Counter
+from dataclasses import dataclass, field
+from types import SimpleNamespace
+from urllib.parse import parse_qs, urlsplit
+
+import httpx
+import requests
+from Crypto.Cipher import AES
+from Crypto.Util.Padding import pad, unpad
+from requests.adapters import BaseAdapter
+
+
+@dataclass
+class DeviceProfile:
+    """
+    Latency and failure model for a simulated bulb.
+    Attributes:
+        handshake_ms (float): Median duration of the session handshake.
+        command_ms (float): Median duration of a single request.
+        jitter (float): Log-normal sigma applied to every latency sample.
+        handshake_failure_rate (float): Probability that a handshake fails.
+        command_failure_rate (float): Probability that a request fails.
+        time_scale (float): Multiplier applied to every sleep, so long runs
+            can be shortened while keeping relative costs intact.
+        seed (int): Seed for the random generator driving latency and failures.
+    """
+
+    handshake_ms: float = 250.0
+    command_ms: float = 60.0
+    jitter: float = 0.3
+    handshake_failure_rate: float = 0.01
+    command_failure_rate: float = 0.005
+    time_scale: float = 1.0
+    seed: int = 1234
+
+
+@dataclass
+class DeviceStats:
+    """
+    Thread-safe counters shared by every fake bulb of a run.
+    """
+
+    calls: Counter = field(default_factory=Counter)
+    failures: Counter = field(default_factory=Counter)
+    lock: threading.Lock = field(default_factory=threading.Lock)
+
+    def record(self, method, failed):
+        with self.lock:
+            self.calls[method] += 1
+            if failed:
+                self.failures[method] += 1
+
+    def snapshot(self):
+        with self.lock:
+            return Counter(self.calls), Counter(self.failures)
+
+    def reset(self):
+        with self.lock:
+            self.calls.clear()
+            self.failures.clear()
+
+
+class FakeDeviceError(Exception):
+    pass
+
+
+class FakeDeviceFactory:
+    """
+    Callable standing in for the `PyL530.L530` class.
+    Every bulb it creates shares the same profile, random generator and stats.
+    Bulb state survives across instances, just like a physical lamp does
+    between two requests.
+    """
+
+    def __init__(self, profile: DeviceProfile | None = None) -> None:
+        self.profile = profile or DeviceProfile()
+        self.stats = DeviceStats()
+        self._random = random.Random(self.profile.seed)
+        self._random_lock = threading.Lock()
+        self._states: dict[str, dict] = {}
+        self._states_lock = threading.Lock()
+        # The session keys each lamp accepts
+        self._sessions: dict[str, set] = {}
+        # KLAP sessions by session cookie, see `FakeKlapServer`
+        self.klap_sessions: dict[str, dict] = {}
+
+    def __call__(self, ip, email, password):
+        return FakeL530(self, ip, email, password)
+
+    # The attribute lookup `PyL530.L530(...)` ends up here when the factory is
+    # installed through `install_fake_devices`.
+    @property
+    def L530(self):  # pylint: disable=invalid-name
+        return self
+
+    def state_for(self, ip):
+        with self._states_lock:
+            return self._states.setdefault(
+                ip,
+                {
+                    "device_on": False,
+                    "brightness": 100,
+                    "color_temp": 2700,
+                    "hue": 0,
+                    "saturation": 0,
+                    "nickname": f"Fake lamp {ip}",
+                },
+            )
+
+    def open_session(self, ip, protocol):
+        with self._states_lock:
+            self._sessions.setdefault(ip, set()).add(protocol.key)
+
+    def knows_session(self, ip, protocol):
+        with self._states_lock:
+            return protocol.key in self._sessions.get(ip, set())
+
+    def forget_sessions(self):
+        """
+        Drops every session, like lamps do after a power cycle.
+        """
+        with self._states_lock:
+            self._sessions.clear()
+            self.klap_sessions.clear()
+
+    def sample(self, median_ms):
+        with self._random_lock:
+            factor = self._random.lognormvariate(0, self.profile.jitter)
+        return median_ms * factor / 1000 * self.profile.time_scale
+
+    def should_fail(self, rate):
+        with self._random_lock:
+            return self._random.random() < rate
+
+
+class FakeCookieJar(dict):
+    def get_dict(self):
+        return dict(self)
+
+
+class FakeAuthProtocol:
+    """
+    Stands in for `PyP100.auth_protocol.AuthProtocol`: the session material
+    set by the handshake, or restored from a stored session.
+    """
+
+    def __init__(self, address, username, password) -> None:
+        self.address = address
+        self.username = username
+        self.password = password
+        self.session = SimpleNamespace(cookies=FakeCookieJar())
+        self.key = None
+        self.iv = None
+        self.seq = None
+        self.sig = None
+
+    def initialize(self):
+        self.key = random.randbytes(16)
+        self.iv = random.randbytes(12)
+        self.seq = random.randint(0, 2**31 - 1)
+        self.sig = random.randbytes(28)
+        self.session.cookies.update(
+            {"TP_SESSIONID": random.randbytes(16).hex(), "TIMEOUT": "86400"}
+        )
+
+
+class FakeL530:
+    """
+    A simulated Tapo L530 bulb. Like the real client, the session handshake
+    happens lazily on the first request and is repeated after a failure.
+    A session restored into `protocol` is used without a handshake, as long
+    as the lamp still knows it.
+    """
+
+    def __init__(self, factory: FakeDeviceFactory, ip, email, password) -> None:
+        self.factory = factory
+        self.ipAddress = ip  # pylint: disable=invalid-name
+        self.email = email
+        self.password = password
+        self.protocol = None
+
+    def _handshake(self):
+        time.sleep(self.factory.sample(self.factory.profile.handshake_ms))
+        failed = self.factory.should_fail(self.factory.profile.handshake_failure_rate)
+        self.factory.stats.record("handshake", failed)
+        if failed:
+            raise FakeDeviceError(f"Handshake with {self.ipAddress} failed")
+        protocol = FakeAuthProtocol(self.ipAddress, self.email, self.password)
+        protocol.initialize()
+        self.factory.open_session(self.ipAddress, protocol)
+        self.protocol = protocol
+
+    def _request(self, method, params=None):
+        if self.protocol is None or not self.protocol.key:
+            self._handshake()
+        time.sleep(self.factory.sample(self.factory.profile.command_ms))
+        if not self.factory.knows_session(self.ipAddress, self.protocol):
+            self.factory.stats.record(method, True)
+            self.protocol.key = None
+            raise FakeDeviceError(f"{self.ipAddress} rejected the session")
+        self.protocol.seq += 1
+        failed = self.factory.should_fail(self.factory.profile.command_failure_rate)
+        self.factory.stats.record(method, failed)
+        if failed:
+            self.protocol = None
+            raise FakeDeviceError(f"Request {method} to {self.ipAddress} failed")
+        state = self.factory.state_for(self.ipAddress)
+        if params:
+            state.update(params)
+        return dict(state)
+
+    def getDeviceInfo(self):
+        return self._request("get_device_info")
+
+    def getDeviceName(self):
+        return self._request("get_device_info")["nickname"]
+
+    def turnOn(self):
+        self._request("set_device_info", {"device_on": True})
+
+    def turnOff(self):
+        self._request("set_device_info", {"device_on": False})
+
+    def setBrightness(self, brightness):
+        self._request("set_device_info", {"device_on": True, "brightness": brightness})
+
+    def setColorTemp(self, colortemp):
+        self._request("set_device_info", {"device_on": True, "color_temp": colortemp})
+
+    def setColor(self, hue, saturation):
+        self._request(
+            "set_device_info",
+            {"device_on": True, "color_temp": 0, "hue": hue, "saturation": saturation},
+        )
+
+
+def _sha256(data):
+    return hashlib.sha256(data).digest()
+
+
+class FakeKlapServer:
+    """
+    The HTTP side of the fake bulbs, for the asyncio driver. Any credentials
+    are accepted, the lamp takes the ones of the settings as its account.
+    """
+
+    def __init__(self, factory: FakeDeviceFactory, username, password) -> None:
+        self.factory = factory
+        self.auth = _sha256(
+            hashlib.sha1((username or "").encode()).digest()
+            + hashlib.sha1((password or "").encode()).digest()
+        )
+        self._pending: dict[str, tuple] = {}
+
+    def transport(self) -> httpx.MockTransport:
+        return httpx.MockTransport(self.handle)
+
+    async def handle(self, request: httpx.Request) -> httpx.Response:
+        body = await request.aread()
+        cookie = request.headers.get("cookie", "").partition("TP_SESSIONID=")[2]
+        path = request.url.path
+        if path == "/app/handshake1":
+            return await self._handshake1(request.url.host, body)
+        if path == "/app/handshake2":
+            return await self._handshake2(cookie, body)
+        if path == "/app/request":
+            seq = int(request.url.params["seq"])
+            return await self._request(request.url.host, cookie, seq, body)
+        return httpx.Response(404)
+
+    async def _handshake1(self, ip, local_seed):
+        profile = self.factory.profile
+        await asyncio.sleep(self.factory.sample(profile.handshake_ms) / 2)
+        failed = self.factory.should_fail(profile.handshake_failure_rate)
+        self.factory.stats.record("handshake", failed)
+        if failed:
+            return httpx.Response(500)
+        remote_seed = random.randbytes(16)
+        cookie = random.randbytes(16).hex()
+        self._pending[cookie] = (ip, local_seed, remote_seed)
+        return httpx.Response(
+            200,
+            content=remote_seed + _sha256(local_seed + remote_seed + self.auth),
+            headers={"Set-Cookie": f"TP_SESSIONID={cookie};TIMEOUT=86400"},
+        )
+
+    async def _handshake2(self, cookie, client_hash):
+        await asyncio.sleep(
+            self.factory.sample(self.factory.profile.handshake_ms) / 2
+        )
+        if cookie not in self._pending:
+            return httpx.Response(403)
+        ip, local_seed, remote_seed = self._pending.pop(cookie)
+        if client_hash != _sha256(remote_seed + local_seed + self.auth):
+            return httpx.Response(403)
+        seeds = local_seed + remote_seed + self.auth
+        iv = _sha256(b"iv" + seeds)
+        with self.factory._states_lock:  # pylint: disable=protected-access
+            self.factory.klap_sessions[cookie] = {
+                "ip": ip,
+                "key": _sha256(b"lsk" + seeds)[:16],
+                "iv": iv[:12],
+                "sig": _sha256(b"ldk" + seeds)[:28],
+            }
+        return httpx.Response(200)
+
+    async def _request(self, ip, cookie, seq, body):
+        await asyncio.sleep(self.factory.sample(self.factory.profile.command_ms))
+        session = self.factory.klap_sessions.get(cookie)
+        if session is None or session["ip"] != ip:
+            self.factory.stats.record("request", True)
+            return httpx.Response(403)
+        seq_bytes = seq.to_bytes(4, "big", signed=True)
+        ciphertext = body[32:]
+        if body[:32] != _sha256(session["sig"] + seq_bytes + ciphertext):
+            self.factory.stats.record("request", True)
+            return httpx.Response(400)
+        iv = session["iv"] + seq_bytes
+        cipher = AES.new(session["key"], AES.MODE_CBC, iv)
+        payload = json.loads(unpad(cipher.decrypt(ciphertext), AES.block_size))
+        method = payload["method"]
+        failed = self.factory.should_fail(self.factory.profile.command_failure_rate)
+        self.factory.stats.record(method, failed)
+        if failed:
+            response = {"error_code": -1}
+        else:
+            state = self.factory.state_for(ip)
+            params = payload.get("params")
+            if params:
+                state.update(params)
+            result = dict(state)
+            result["nickname"] = base64.b64encode(
+                result["nickname"].encode()
+            ).decode()
+            response = {"error_code": 0, "result": result}
+        cipher = AES.new(session["key"], AES.MODE_CBC, iv)
+        encrypted = cipher.encrypt(pad(json.dumps(response).encode(), AES.block_size))
+        return httpx.Response(
+            200, content=_sha256(session["sig"] + seq_bytes + encrypted) + encrypted
+        )
+
+
+def install_fake_devices(profile: DeviceProfile | None = None) -> FakeDeviceFactory:
+    """
+    Replaces the PyP100 client used by `TapoLampInterface`, and the transport
+    of the asyncio driver, with fake bulbs.
+    Must be called from inside `harness.sandbox()`.
+    Returns:
+        FakeDeviceFactory: The factory, giving access to the shared stats.
+    """
+    # pylint: disable=import-outside-toplevel
+    from interfaces import tapo_async_interface, tapo_lamp_interface
+    from settings import get_settings
+
+    factory = FakeDeviceFactory(profile)
+    tapo_lamp_interface.PyL530 = factory
+    tapo_lamp_interface.auth_protocol = SimpleNamespace(AuthProtocol=FakeAuthProtocol)
+    tapo_lamp_interface.session_store.cache_clear()
+    settings = get_settings()
+    server = FakeKlapServer(factory, settings.tapo_username, settings.tapo_password)
+    tapo_async_interface.transport = server.transport()
+    # Clients created before keep the previous transport
+    tapo_async_interface._clients.clear()  # pylint: disable=protected-access
+    return factory
+
+
+@dataclass
+class UpstreamProfile:
+    """
+    Latency model for the upstream APIs used by `update_presets`.
+    Attributes:
+        weather_ms (float): Duration of an open-meteo request.
+        news_ms (float): Duration of a newsdata request.
+        llm_ms (float): Duration of the emotional response completion.
+        llm_presets_ms (float): Duration of the preset generation completion.
+        llm_validation_ms (float): Duration of the validation completion.
+        error_rate (float): Probability that a weather or news request gets
+            a 503.
+        time_scale (float): Multiplier applied to every sleep.
+        seed (int): Seed for the random generator driving the errors.
+    """
+
+    weather_ms: float = 150.0
+    news_ms: float = 400.0
+    llm_ms: float = 3000.0
+    llm_presets_ms: float = 8000.0
+    llm_validation_ms: float = 1500.0
+    error_rate: float = 0.0
+    time_scale: float = 1.0
+    seed: int = 1234
+
+
+class FakeUpstreamAdapter(BaseAdapter):
+    """
+    A `requests` transport adapter answering the open-meteo and newsdata
+    calls of the shared upstream client, which keeps its retries, host
+    limits and revalidation in the loop. The weather comes with an ETag and
+    a revalidation with a matching `If-None-Match` gets a 304.
+    """
+
+    def __init__(self, profile: UpstreamProfile) -> None:
+        super().__init__()
+        self.profile = profile
+        self.calls = Counter()
+        self._random = random.Random(profile.seed)
+        self._lock = threading.Lock()
+
+    def _failed(self):
+        with self._lock:
+            return self._random.random() < self.profile.error_rate
+
+    @staticmethod
+    def _response(request, status_code, payload=None, headers=None):
+        response = requests.Response()
+        response.status_code = status_code
+        response._content = b"" if payload is None else json.dumps(payload).encode()
+        response.headers.update(headers or {})
+        response.encoding = "utf-8"
+        response.url = request.url
+        response.request = request
+        return response
+
+    def send(self, request, **kwargs):  # pylint: disable=arguments-differ
+        url = urlsplit(request.url)
+        params = {name: values[-1] for name, values in parse_qs(url.query).items()}
+        upstream = "weather" if "open-meteo" in url.netloc else "news"
+        self.calls[upstream] += 1
+        if upstream == "weather":
+            duration = self.profile.weather_ms
+        else:
+            duration = self.profile.news_ms
+        time.sleep(duration / 1000 * self.profile.time_scale)
+        if self._failed():
+            self.calls[f"{upstream}.error"] += 1
+            return self._response(request, 503, {"message": "Unavailable"})
+        if upstream == "weather":
+            etag = f'"{params.get("start_date", "")}"'
+            if request.headers.get("If-None-Match") == etag:
+                self.calls["weather.not_modified"] += 1
+                return self._response(request, 304, headers={"ETag": etag})
+            return self._response(
+                request,
+                200,
+                {
+                    "hourly": {
+                        "temperature_2m": [12.0 + hour / 4 for hour in range(24)],
+                        "cloudcover": [40 + hour for hour in range(24)],
+                        "rain": [0.1 if hour % 6 == 0 else 0.0 for hour in range(24)],
+                    }
+                },
+                {"ETag": etag},
+            )
+        return self._response(
+            request,
+            200,
+            {
+                "results": [
+                    {
+                        "title": f"Headline {i} for {params.get('country', 'world')}",
+                        "description": "A fairly long article description. " * 8,
+                        "link": f"https://news.example.com/{i}",
+                        "source_name": "Example News",
+                        "pubDate": "2024-09-15 08:00:00",
+                    }
+                    for i in range(int(params.get("size", 10)))
+                ]
+            },
+        )
+
+    def close(self):
+        pass
+
+
+class FakeCompletions:
+    """
+    Implements `client.beta.chat.completions.parse` and `.stream` with canned
+    structured output for each response model the application asks for.
+    """
+
+    def __init__(self, profile: UpstreamProfile) -> None:
+        self.profile = profile
+        self.calls = Counter()
+
+    def _canned(self, response_format, user_message):
+        """
+        Returns the simulated latency in ms and the output for a model.
+        """
+        name = response_format.__name__
+        if name == "EmotionalResponses":
+            return self.profile.llm_ms, response_format(
+                emotional_responses=[f"Feeling number {i}" for i in range(10)]
+            )
+        if name == "LightPresetModel":
+            request = json.loads(user_message)
+            lamp_count = request.get("lamp_count", 1)
+            # Split requests ask for one preset per description or a count
+            count = len(request.get("descriptions", [])) or request.get(
+                "preset_count", 13
+            )
+            return self.profile.llm_presets_ms, response_format.model_validate(
+                {
+                    "presets": [
+                        {
+                            "type": "color" if i % 2 else "temp",
+                            "name": f"Mood{i}",
+                            "value_color": [
+                                {"setting": "#ff8800", "brightness": 60}
+                                for _ in range(lamp_count)
+                            ]
+                            if i % 2
+                            else None,
+                            "value_temp": None
+                            if i % 2
+                            else {"setting": 3000 + i * 200, "brightness": 70},
+                        }
+                        for i in range(count)
+                    ]
+                }
+            )
+        return self.profile.llm_validation_ms, response_format(
+            validation="VALID", explanation=""
+        )
+
+    @staticmethod
+    def _completion(model, messages, parsed):
+        prompt_tokens = sum(len(message["content"]) for message in messages) // 4
+        return SimpleNamespace(
+            model=model,
+            choices=[SimpleNamespace(message=SimpleNamespace(parsed=parsed))],
+            usage=SimpleNamespace(
+                prompt_tokens=prompt_tokens,
+                completion_tokens=200,
+                total_tokens=prompt_tokens + 200,
+            ),
+        )
+
+    def parse(self, model, messages, response_format):
+        self.calls[response_format.__name__] += 1
+        delay, parsed = self._canned(response_format, messages[-1]["content"])
+        time.sleep(delay / 1000 * self.profile.time_scale)
+        return self._completion(model, messages, parsed)
+
+    def stream(self, model, messages, response_format, **kwargs):
+        self.calls[f"{response_format.__name__}.stream"] += 1
+        delay, parsed = self._canned(response_format, messages[-1]["content"])
+        return FakeCompletionStream(
+            self._completion(model, messages, parsed),
+            delay / 1000 * self.profile.time_scale,
+        )
+
+
+class FakeAsyncCompletions:
+    """
+    The `AsyncOpenAI` counterpart of `FakeCompletions`, sharing its counters.
+    """
+
+    def __init__(self, completions: FakeCompletions) -> None:
+        self.completions = completions
+
+    async def parse(self, model, messages, response_format):
+        self.completions.calls[f"{response_format.__name__}.async"] += 1
+        delay, parsed = self.completions._canned(
+            response_format, messages[-1]["content"]
+        )
+        await asyncio.sleep(delay / 1000 * self.completions.profile.time_scale)
+        return self.completions._completion(model, messages, parsed)
+
+
+class FakeCompletionStream:
+    """
+    Emits partially parsed output the way the streaming helper does: the
+    list in the output grows one item at a time, and the last item of every
+    partial snapshot is still being written.
+    """
+
+    def __init__(self, completion, duration: float) -> None:
+        self.completion = completion
+        self.duration = duration
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+    def __iter__(self):
+        parsed = self.completion.choices[0].message.parsed
+        data = parsed.model_dump()
+        key, items = next(
+            ((key, value) for key, value in data.items() if isinstance(value, list)),
+            (None, []),
+        )
+        for index in range(len(items)):
+            time.sleep(self.duration / max(1, len(items)))
+            partial = dict(data)
+            partial[key] = items[:index] + [{"name": items[index].get("name")}]
+            yield SimpleNamespace(type="content.delta", parsed=partial)
+        yield SimpleNamespace(type="content.done", parsed=parsed)
+
+    def get_final_completion(self):
+        return self.completion
+
+
+class FakeOpenAI:
+    def __init__(self, completions: FakeCompletions) -> None:
+        self.beta = SimpleNamespace(chat=SimpleNamespace(completions=completions))
+
+
+class FakeAsyncOpenAI:
+    def __init__(self, completions: FakeCompletions) -> None:
+        self.beta = SimpleNamespace(
+            chat=SimpleNamespace(completions=FakeAsyncCompletions(completions))
+        )
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        return False
+
+    async def close(self):
+        pass
+
+
+def install_fake_upstreams(profile: UpstreamProfile | None = None) -> SimpleNamespace:
+    """
+    Replaces the open-meteo, newsdata and OpenAI clients with fakes.
+    Must be called from inside `harness.sandbox()`.
+    Returns:
+        SimpleNamespace: The installed `requests` adapter and `completions`
+            fakes, exposing per-upstream call counters.
+    """
+    # pylint: disable=import-outside-toplevel
+    from interfaces import openai_interface
+    from utils.upstream_client import upstream_client
+
+    profile = profile or UpstreamProfile()
+    fake_requests = FakeUpstreamAdapter(profile)
+    completions = FakeCompletions(profile)
+    upstream_client.cache_clear()
+    upstream_client().session.mount("https://", fake_requests)
+    openai_interface.OpenAI = lambda api_key: FakeOpenAI(completions)
+    openai_interface.AsyncOpenAI = lambda api_key: FakeAsyncOpenAI(completions)
+    return SimpleNamespace(requests=fake_requests, completions=completions)
@@ -0,0 +1,196 @@
+"""
+Shared helpers for the benchmark scripts.
+
+The application resolves its SQLite database, log directory and static files
+relative to the working directory, so every benchmark runs inside a throwaway
+sandbox directory that mirrors that layout.
+"""
+
+import json
+import math
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+from contextlib import contextmanager
+from datetime import datetime, timezone
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SRC_DIR = os.path.join(REPO_ROOT, "src")
+
+
+@contextmanager
+def sandbox():
+    """
+    Run the enclosed block from a temporary working directory containing
+    empty `db/` and `logs/` folders and a link to the real `public/` folder.
+    The `src` directory is put on `sys.path` so the application modules can
+    be imported the same way `src/main.py` imports them.
+    """
+    previous_cwd = os.getcwd()
+    with tempfile.TemporaryDirectory(prefix="luminasync-bench-") as workdir:
+        os.makedirs(os.path.join(workdir, "db"))
+        os.makedirs(os.path.join(workdir, "logs"))
+        os.symlink(os.path.join(REPO_ROOT, "public"), os.path.join(workdir, "public"))
+        if SRC_DIR not in sys.path:
+            sys.path.insert(0, SRC_DIR)
+        os.chdir(workdir)
+        try:
+            yield workdir
+        finally:
+            os.chdir(previous_cwd)
+
+
+def populate_lamps(lamp_count):
+    """
+    Replaces the lamps table with `lamp_count` lamps on fake IP addresses.
+    Must be called from inside `sandbox()`.
+    """
+    # pylint: disable=import-outside-toplevel
+    from db.models import Lamp
+    from db.session import get_session, init_db
+
+    init_db()
+    session = get_session()
+    try:
+        session.query(Lamp).delete()
+        session.add_all(
+            Lamp(ip=f"10.0.{i // 250}.{i % 250 + 1}", name=f"Lamp {i + 1}")
+            for i in range(lamp_count)
+        )
+        session.commit()
+    finally:
+        session.close()
+
+
+def percentile(sorted_values, pct):
+    """
+    Nearest-rank percentile of an already sorted list.
+    Args:
+        sorted_values (list): The sorted samples.
+        pct (float): The percentile between 0 and 100.
+    Returns:
+        float: The percentile value, or 0.0 for an empty list.
+    """
+    if not sorted_values:
+        return 0.0
+    rank = max(1, math.ceil(pct / 100 * len(sorted_values)))
+    return sorted_values[rank - 1]
+
+
+def summarize_latencies(samples):
+    """
+    Summarizes latency samples given in seconds.
+    Args:
+        samples (list): Latency samples in seconds.
+    Returns:
+        dict: min/mean/max and p50/p90/p95/p99, all in milliseconds.
+    """
+    ordered = sorted(samples)
+
+    def to_ms(value):
+        return round(value * 1000, 3)
+
+    return {
+        "min": to_ms(ordered[0]) if ordered else 0.0,
+        "mean": to_ms(sum(ordered) / len(ordered)) if ordered else 0.0,
+        "p50": to_ms(percentile(ordered, 50)),
+        "p90": to_ms(percentile(ordered, 90)),
+        "p95": to_ms(percentile(ordered, 95)),
+        "p99": to_ms(percentile(ordered, 99)),
+        "max": to_ms(ordered[-1]) if ordered else 0.0,
+    }
+
+
+def git_revision():
+    """
+    Returns the short hash of the checked out commit, with a `-dirty` suffix
+    when the working tree has local changes.
+    """
+    try:
+        revision = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=REPO_ROOT,
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+        dirty = subprocess.run(
+            ["git", "status", "--porcelain", "--untracked-files=no"],
+            cwd=REPO_ROOT,
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+        return f"{revision}-dirty" if dirty else revision
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def run_metadata(benchmark, parameters):
+    """
+    Builds the metadata block stored alongside benchmark results.
+    """
+    return {
+        "benchmark": benchmark,
+        "revision": git_revision(),
+        "timestamp": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "parameters": parameters,
+    }
+
+
+def write_results(path, payload):
+    """
+    Writes benchmark results as JSON, creating the parent directory if needed.
+    """
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+    with open(path, "w", encoding="utf-8") as handle:
+        json.dump(payload, handle, indent=2, sort_keys=True)
+        handle.write("\n")
+
+
+def compare_results(baseline, current, key_fields, metrics, threshold):
+    """
+    Compares two result files produced by the same benchmark.
+
+    Args:
+        baseline (dict): The previously stored results.
+        current (dict): The results of this run.
+        key_fields (tuple): Fields identifying a scenario in `results`.
+        metrics (tuple): Latency percentiles to compare, e.g. ("p50", "p95").
+        threshold (float): Allowed slowdown in percent before a scenario
+            counts as a regression.
+
+    Returns:
+        tuple: (lines, regressions) where lines is a printable report and
+            regressions the number of scenarios slower than the threshold.
+    """
+    index = {
+        tuple(result[field] for field in key_fields): result
+        for result in baseline["results"]
+    }
+    lines = [
+        f"Comparing {baseline['meta']['revision']} -> {current['meta']['revision']}"
+    ]
+    regressions = 0
+    for result in current["results"]:
+        key = tuple(result[field] for field in key_fields)
+        previous = index.get(key)
+        if previous is None:
+            continue
+        parts = []
+        regressed = False
+        for metric in metrics:
+            old = previous["latency_ms"][metric]
+            new = result["latency_ms"][metric]
+            change = ((new - old) / old * 100) if old else 0.0
+            regressed = regressed or change > threshold
+            parts.append(f"{metric} {old:.1f} -> {new:.1f} ms ({change:+.1f}%)")
+        regressions += int(regressed)
+        label = " ".join(str(part) for part in key)
+        lines.append(f"{'!' if regressed else ' '} {label}: " + ", ".join(parts))
+    return lines, regressions
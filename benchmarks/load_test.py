@@ -0,0 +1,329 @@
+"""
+HTTP load generator for the LuminaSync web app.
+
+Drives `/`, `/apply`, `/turn-off` and `/update-presets` with a configurable
+concurrency and route mix and reports throughput, latency percentiles and
+error rates per route as JSON.
+
+Modes:
+    inprocess  The app is called through its ASGI interface, no sockets.
+    uvicorn    The app is served by uvicorn on a local port inside this
+               process, so the fakes still apply.
+    url        Requests go to an already running server given with --url.
+               Nothing is faked in this mode.
+
+In the first two modes the bulbs and the open-meteo, newsdata and OpenAI
+backends are replaced by the fakes from `fakes.py`.
+
+Usage:
+    python benchmarks/load_test.py --concurrency 8 --duration 30
+    python benchmarks/load_test.py --mix /=80 /apply=15 /turn-off=5
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import os
+import random
+import sys
+import threading
+import time
+from collections import defaultdict
+
+import httpx
+
+from fakes import DeviceProfile, UpstreamProfile, install_fake_devices, install_fake_upstreams
+from harness import (
+    compare_results,
+    populate_lamps,
+    run_metadata,
+    sandbox,
+    summarize_latencies,
+    write_results,
+)
+
+DEFAULT_OUTPUT = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "results", "load_test.json"
+)
+DEFAULT_MIX = ["/=70", "/apply=20", "/turn-off=8", "/update-presets=2"]
+POST_ROUTES = {"/apply", "/turn-off", "/update-presets"}
+
+
+def parse_mix(entries):
+    """
+    Parses `route=weight` pairs into a list of routes and a list of weights.
+    """
+    routes, weights = [], []
+    for entry in entries:
+        route, _, weight = entry.partition("=")
+        if route not in POST_ROUTES | {"/"}:
+            raise argparse.ArgumentTypeError(f"Unknown route in mix: {route}")
+        routes.append(route)
+        weights.append(float(weight or 1))
+    return routes, weights
+
+
+def preset_ids():
+    """
+    Returns the ids of the protected presets, which survive `/update-presets`
+    and therefore stay valid for the whole run.
+    """
+    # pylint: disable=import-outside-toplevel
+    from db.models import Preset
+    from db.session import get_session
+
+    session = get_session()
+    try:
+        return [str(preset.id) for preset in session.query(Preset).filter_by(protected=1)]
+    finally:
+        session.close()
+
+
+class RouteStats:
+    def __init__(self) -> None:
+        self.latencies = defaultdict(list)
+        self.errors = defaultdict(int)
+        self.statuses = defaultdict(lambda: defaultdict(int))
+
+    def record(self, route, elapsed, status):
+        self.latencies[route].append(elapsed)
+        self.statuses[route][str(status)] += 1
+        if not isinstance(status, int) or status >= 400:
+            self.errors[route] += 1
+
+    def summary(self, wall_time):
+        results = []
+        for route in sorted(self.latencies):
+            samples = self.latencies[route]
+            results.append(
+                {
+                    "route": route,
+                    "requests": len(samples),
+                    "throughput_rps": round(len(samples) / wall_time, 3),
+                    "errors": self.errors[route],
+                    "error_rate": round(self.errors[route] / len(samples), 4),
+                    "statuses": dict(self.statuses[route]),
+                    "latency_ms": summarize_latencies(samples),
+                }
+            )
+        everything = [sample for samples in self.latencies.values() for sample in samples]
+        total_errors = sum(self.errors.values())
+        results.append(
+            {
+                "route": "*",
+                "requests": len(everything),
+                "throughput_rps": round(len(everything) / wall_time, 3),
+                "errors": total_errors,
+                "error_rate": round(total_errors / len(everything), 4)
+                if everything
+                else 0.0,
+                "statuses": {},
+                "latency_ms": summarize_latencies(everything),
+            }
+        )
+        return results
+
+
+async def worker(client, routes, weights, ids, deadline, budget, stats, rng):
+    while time.perf_counter() < deadline:
+        if budget is not None:
+            if budget["remaining"] <= 0:
+                return
+            budget["remaining"] -= 1
+        route = rng.choices(routes, weights)[0]
+        start = time.perf_counter()
+        try:
+            if route == "/":
+                response = await client.get("/")
+            elif route == "/apply":
+                response = await client.post(
+                    "/apply", json={"preset_id": rng.choice(ids)}
+                )
+            else:
+                response = await client.post(route, json={})
+            status = response.status_code
+        except httpx.HTTPError as e:
+            status = type(e).__name__
+        stats.record(route, time.perf_counter() - start, status)
+
+
+async def run_load(client, args, ids):
+    routes, weights = parse_mix(args.mix)
+    stats = RouteStats()
+    rng = random.Random(args.seed)
+    budget = {"remaining": args.requests} if args.requests else None
+    start = time.perf_counter()
+    deadline = start + args.duration
+    await asyncio.gather(
+        *(
+            worker(
+                client,
+                routes,
+                weights,
+                ids,
+                deadline,
+                budget,
+                stats,
+                random.Random(rng.random()),
+            )
+            for _ in range(args.concurrency)
+        )
+    )
+    return stats.summary(time.perf_counter() - start)
+
+
+def start_uvicorn(app, port):
+    """
+    Serves the app with uvicorn from a background thread and waits until
+    it accepts connections.
+    """
+    # pylint: disable=import-outside-toplevel
+    import uvicorn
+
+    server = uvicorn.Server(
+        uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning")
+    )
+    thread = threading.Thread(target=server.run, daemon=True)
+    thread.start()
+    while not server.started:
+        time.sleep(0.05)
+    return server, thread
+
+
+async def run_faked(args):
+    device_profile = DeviceProfile(time_scale=args.time_scale, seed=args.seed)
+    upstream_profile = UpstreamProfile(time_scale=args.time_scale)
+    install_fake_devices(device_profile)
+    install_fake_upstreams(upstream_profile)
+
+    # pylint: disable=import-outside-toplevel
+    import main as luminasync
+
+    logging.getLogger("LuminaSync").setLevel(
+        logging.INFO if args.verbose else logging.CRITICAL
+    )
+    populate_lamps(args.lamps)
+    ids = preset_ids()
+
+    if args.mode == "inprocess":
+        transport = httpx.ASGITransport(app=luminasync.app)
+        async with httpx.AsyncClient(
+            transport=transport, base_url="http://loadtest", timeout=args.timeout
+        ) as client:
+            return await run_load(client, args, ids)
+
+    server, thread = start_uvicorn(luminasync.app, args.port)
+    try:
+        async with httpx.AsyncClient(
+            base_url=f"http://127.0.0.1:{args.port}",
+            timeout=args.timeout,
+            limits=httpx.Limits(max_connections=args.concurrency),
+        ) as client:
+            return await run_load(client, args, ids)
+    finally:
+        server.should_exit = True
+        thread.join(timeout=10)
+
+
+async def run_remote(args):
+    async with httpx.AsyncClient(
+        base_url=args.url,
+        timeout=args.timeout,
+        limits=httpx.Limits(max_connections=args.concurrency),
+    ) as client:
+        return await run_load(client, args, args.preset_ids)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument(
+        "--mode", choices=["inprocess", "uvicorn", "url"], default="inprocess"
+    )
+    parser.add_argument("--url", help="Base URL of a running server (url mode).")
+    parser.add_argument("--port", type=int, default=5174)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument(
+        "--duration", type=float, default=20.0, help="Run time in seconds."
+    )
+    parser.add_argument(
+        "--requests",
+        type=int,
+        help="Stop after this many requests instead of waiting for --duration.",
+    )
+    parser.add_argument(
+        "--mix",
+        nargs="+",
+        default=DEFAULT_MIX,
+        help="Route weights as route=weight pairs.",
+    )
+    parser.add_argument("--lamps", type=int, default=2)
+    parser.add_argument(
+        "--preset-ids",
+        nargs="+",
+        default=["1", "2"],
+        help="Preset ids to apply in url mode.",
+    )
+    parser.add_argument(
+        "--time-scale",
+        type=float,
+        default=0.1,
+        help="Multiplier for simulated device and upstream latency.",
+    )
+    parser.add_argument("--timeout", type=float, default=120.0)
+    parser.add_argument("--seed", type=int, default=1234)
+    parser.add_argument("--verbose", action="store_true")
+    parser.add_argument("--output", default=DEFAULT_OUTPUT)
+    parser.add_argument("--compare", help="Previous results file to compare against.")
+    parser.add_argument("--threshold", type=float, default=10.0)
+    args = parser.parse_args(argv)
+    if args.mode == "url" and not args.url:
+        parser.error("--url is required in url mode")
+    parse_mix(args.mix)
+    return args
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    os.environ.setdefault("TAPO_USERNAME", "bench@example.com")
+    os.environ.setdefault("TAPO_PASSWORD", "bench")
+    os.environ.setdefault("OPENAI_API_KEY", "bench")
+    os.environ.setdefault("NEWSDATA_API_KEY", "bench")
+
+    if args.mode == "url":
+        results = asyncio.run(run_remote(args))
+    else:
+        with sandbox():
+            results = asyncio.run(run_faked(args))
+
+    for result in results:
+        latency = result["latency_ms"]
+        print(
+            f"{result['route']:<16} n={result['requests']:<6}"
+            f" rps={result['throughput_rps']:<9} p50={latency['p50']:>9.1f}ms"
+            f" p95={latency['p95']:>9.1f}ms p99={latency['p99']:>9.1f}ms"
+            f" errors={result['error_rate']:.2%}",
+            file=sys.stderr,
+        )
+
+    payload = {"meta": run_metadata("load_test", vars(args)), "results": results}
+    write_results(args.output, payload)
+    print(f"Results written to {args.output}", file=sys.stderr)
+
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as handle:
+            baseline = json.load(handle)
+        lines, regressions = compare_results(
+            baseline,
+            payload,
+            key_fields=("route",),
+            metrics=("p50", "p95", "p99"),
+            threshold=args.threshold,
+        )
+        print("\n".join(lines))
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,252 @@
+"""
+Builds the static assets served from public/dist.
+
+The MaterializeCSS stylesheet and script and the Material Icons font are
+vendored into the vendor folder, so the dashboard doesn't depend on any CDN.
+They are downloaded once when missing and checked against the SHA-256 sums
+pinned in vendor.sha256, the build fails on a mismatched sum. Until every file
+has a pinned sum, nothing is downloaded or built and the app serves the unbuilt
+assets and the CDNs. After changing a version, run
+`python build_assets.py --fetch --pin` on a trusted machine, review the files
+and commit vendor.sha256.
+
+The compiled public/css/main.css and the icon stylesheet are minified, the
+Materialize files come minified. public/js/main.js is left as it is, as no
+safe minifier is at hand and the compressed variants make up for most of the
+difference. Every asset is written with a content hash in its name and text
+assets are precompressed with gzip, and with brotli when the brotli module is
+installed. The mapping from asset name to hashed file is written to
+public/dist/manifest.json, which the app reads at startup.
+
+Run `python sass_compile.py` first when the SCSS changed, then:
+
+    python build_assets.py
+"""
+
+import argparse
+import gzip
+import hashlib
+import json
+import re
+import shutil
+import urllib.request
+from pathlib import Path
+
+try:
+    import brotli
+except ImportError:  # Optional, only gzip variants are built without it
+    brotli = None
+
+ROOT = Path(__file__).parent
+VENDOR_DIR = ROOT / "vendor"
+# The pinned SHA-256 sums of the vendored files, in `sha256sum` format
+CHECKSUMS_FILE = ROOT / "vendor.sha256"
+PUBLIC_DIR = ROOT / "public"
+DIST_DIR = PUBLIC_DIR / "dist"
+
+MATERIALIZE_URL = "https://cdnjs.cloudflare.com/ajax/libs/materialize/1.0.0"
+VENDOR_FILES = {
+    "materialize.min.css": f"{MATERIALIZE_URL}/css/materialize.min.css",
+    "materialize.min.js": f"{MATERIALIZE_URL}/js/materialize.min.js",
+}
+MATERIAL_ICONS_URL = "https://fonts.googleapis.com/icon?family=Material+Icons"
+# Google Fonts picks the font format by user agent; this one gets woff2
+FONT_USER_AGENT = (
+    "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 "
+    "(KHTML, like Gecko) Chrome/120.0 Safari/537.36"
+)
+
+HASH_LENGTH = 10
+# Fonts and images are already compressed
+COMPRESSIBLE = {".css", ".js", ".json", ".svg"}
+
+
+class VendorNotPinned(Exception):
+    pass
+
+
+def _download(url: str, headers: dict | None = None) -> bytes:
+    request = urllib.request.Request(url, headers=headers or {})
+    with urllib.request.urlopen(request, timeout=30) as response:
+        return response.read()
+
+
+def load_checksums() -> dict:
+    """
+    Reads the pinned sums, by file name.
+    """
+    if not CHECKSUMS_FILE.exists():
+        return {}
+    checksums = {}
+    for line in CHECKSUMS_FILE.read_text().splitlines():
+        if line.strip():
+            digest, name = line.split(maxsplit=1)
+            checksums[name.lstrip("*")] = digest
+    return checksums
+
+
+def _verify(name: str, content: bytes, checksums: dict) -> None:
+    expected = checksums.get(name)
+    if expected is None:
+        raise VendorNotPinned(
+            f"No pinned checksum for vendor/{name} in {CHECKSUMS_FILE.name}."
+        )
+    actual = hashlib.sha256(content).hexdigest()
+    if actual != expected:
+        raise SystemExit(
+            f"Checksum mismatch for vendor/{name}: expected {expected}, "
+            f"got {actual}."
+        )
+
+
+def fetch_vendor(force: bool = False, pin: bool = False) -> None:
+    """
+    Downloads the vendored files that are missing, or all of them with force,
+    and checks every vendored file against its pinned sum.
+    Args:
+        force (bool): Download the files again.
+        pin (bool): Pin the sums of the files instead of checking them.
+    Raises:
+        VendorNotPinned: When a sum is missing, before downloading anything
+            when none are pinned.
+        SystemExit: When a sum doesn't match.
+    """
+    if not pin and not load_checksums():
+        raise VendorNotPinned(f"No checksums are pinned in {CHECKSUMS_FILE.name}.")
+    VENDOR_DIR.mkdir(exist_ok=True)
+    for name, url in VENDOR_FILES.items():
+        target = VENDOR_DIR / name
+        if force or not target.exists():
+            print(f"Downloading {url}")
+            target.write_bytes(_download(url))
+
+    icons_css = VENDOR_DIR / "material-icons.css"
+    if force or not icons_css.exists():
+        print(f"Downloading {MATERIAL_ICONS_URL}")
+        headers = {"User-Agent": FONT_USER_AGENT}
+        css = _download(MATERIAL_ICONS_URL, headers).decode()
+        urls = re.findall(r"url\(([^)]+)\)", css)
+        for index, url in enumerate(urls):
+            extension = Path(url.split("?")[0]).suffix or ".woff2"
+            font_name = f"material-icons-{index}{extension}"
+            (VENDOR_DIR / font_name).write_bytes(_download(url, headers))
+            css = css.replace(url, font_name)
+        icons_css.write_text(css)
+
+    files = sorted(path for path in VENDOR_DIR.iterdir() if path.is_file())
+    if pin:
+        CHECKSUMS_FILE.write_text(
+            "".join(
+                f"{hashlib.sha256(path.read_bytes()).hexdigest()}  {path.name}\n"
+                for path in files
+            )
+        )
+        print(f"Pinned {len(files)} files in {CHECKSUMS_FILE.name}")
+        return
+    checksums = load_checksums()
+    for path in files:
+        _verify(path.name, path.read_bytes(), checksums)
+
+
+def minify_css(css: str) -> str:
+    """
+    Removes comments and redundant whitespace. Whitespace before a colon is
+    kept, as it is significant in selectors like `a :hover`.
+    """
+    css = re.sub(r"/\*.*?\*/", "", css, flags=re.S)
+    css = re.sub(r"\s+", " ", css)
+    css = re.sub(r"\s*([{};,>])\s*", r"\1", css)
+    css = re.sub(r":\s+", ":", css)
+    return css.replace(";}", "}").strip()
+
+
+def _hashed_name(name: str, content: bytes) -> str:
+    digest = hashlib.sha256(content).hexdigest()[:HASH_LENGTH]
+    path = Path(name)
+    return f"{path.stem}.{digest}{path.suffix}"
+
+
+def _write(name: str, content: bytes, manifest: dict) -> str:
+    """
+    Writes an asset under its hashed name with its compressed variants and
+    records it in the manifest.
+    """
+    hashed = _hashed_name(name, content)
+    target = DIST_DIR / hashed
+    target.write_bytes(content)
+    if target.suffix in COMPRESSIBLE:
+        variants = {".gz": gzip.compress(content, compresslevel=9, mtime=0)}
+        if brotli is not None:
+            variants[".br"] = brotli.compress(content, quality=11)
+        for suffix, compressed in variants.items():
+            # A variant that isn't smaller isn't worth serving
+            if len(compressed) < len(content):
+                target.with_name(target.name + suffix).write_bytes(compressed)
+    manifest[name] = f"dist/{hashed}"
+    return hashed
+
+
+def build(force: bool = False) -> dict:
+    """
+    Rebuilds public/dist and returns the manifest. Without pinned sums for the
+    vendored files, public/dist is removed and the manifest is empty, so the
+    app serves the unbuilt assets.
+    Args:
+        force (bool): Download the vendored files again.
+    """
+    shutil.rmtree(DIST_DIR, ignore_errors=True)
+    try:
+        fetch_vendor(force=force)
+    except VendorNotPinned as e:
+        print(
+            f"{e} Skipping the build, the app serves the unbuilt assets. Run "
+            "`python build_assets.py --fetch --pin` on a trusted machine, "
+            "review the files and commit the checksums."
+        )
+        return {}
+    DIST_DIR.mkdir(parents=True)
+    manifest = {}
+
+    # The fonts first, so the icon stylesheet can point at their hashed names
+    icons_css = (VENDOR_DIR / "material-icons.css").read_text()
+    for font in sorted(VENDOR_DIR.glob("material-icons-*")):
+        hashed = _write(font.name, font.read_bytes(), manifest)
+        icons_css = icons_css.replace(font.name, hashed)
+    _write("material-icons.css", minify_css(icons_css).encode(), manifest)
+
+    # The Materialize files are distributed minified
+    _write(
+        "materialize.css", (VENDOR_DIR / "materialize.min.css").read_bytes(), manifest
+    )
+    _write(
+        "materialize.js", (VENDOR_DIR / "materialize.min.js").read_bytes(), manifest
+    )
+    _write(
+        "main.css",
+        minify_css((PUBLIC_DIR / "css" / "main.css").read_text()).encode(),
+        manifest,
+    )
+    _write("main.js", (PUBLIC_DIR / "js" / "main.js").read_bytes(), manifest)
+
+    (DIST_DIR / "manifest.json").write_text(json.dumps(manifest, indent=2) + "\n")
+    return manifest
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument(
+        "--fetch",
+        action="store_true",
+        help="Download the vendored files again, e.g. after changing a version.",
+    )
+    parser.add_argument(
+        "--pin",
+        action="store_true",
+        help="Write the sums of the vendored files to vendor.sha256 and exit.",
+    )
+    args = parser.parse_args()
+    if args.pin:
+        fetch_vendor(force=args.fetch, pin=True)
+        raise SystemExit(0)
+    for name, path in build(force=args.fetch).items():
+        print(f"{name} -> public/{path}")
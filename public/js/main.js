@@ -17,7 +17,9 @@ document.addEventListener('DOMContentLoaded', function () {
                 .then(response => response.json())
                 .then(data => {
                     console.log('Response:', data);
-                    if (data.success) {
+                    if (data.queued) {
+                        M.toast({ html: data.message, classes: 'orange' });
+                    } else if (data.success) {
                         console.log('Preset applied successfully:', data.message);
                         M.toast({ html: data.message, classes: 'green' });
                         // Loop through the data.lamp_data object and update the lamp icons
@@ -64,7 +66,9 @@ document.addEventListener('DOMContentLoaded', function () {
             .then(response => response.json())
             .then(data => {
                 console.log('Response:', data);
-                if (data.success) {
+                if (data.queued) {
+                    M.toast({ html: data.message, classes: 'orange' });
+                } else if (data.success) {
                     console.log('Lights turned off succesfully', data.message);
                     M.toast({ html: data.message, classes: 'green' });
                     // We need to construct a data object to update the lamp icons, based on the amount of lamp-icons we have.
@@ -106,7 +110,13 @@ document.addEventListener('DOMContentLoaded', function () {
             .then(response => response.json())
             .then(data => {
                 console.log('Response:', data)
-                if (data.success) {
+                if (data.success && data.updated === false) {
+                    // Nothing changed, the current presets stay
+                    console.log('Presets kept:', data.reasons);
+                    document.getElementById('loader').style.display = 'none';
+                    M.toast({ html: data.message, classes: 'blue' });
+                }
+                else if (data.success) {
                     console.log('Presets updated successfully', data.message);
                     M.toast({ html: data.message, classes: 'green' });
                     // Force reload the page, invalidating the cache
@@ -127,6 +137,27 @@ document.addEventListener('DOMContentLoaded', function () {
 });
 
 if ('serviceWorker' in navigator) {
+    // Messages from the service worker about the cached page and the
+    // commands that were queued while offline
+    navigator.serviceWorker.addEventListener('message', event => {
+        if (event.data.type === 'page-updated') {
+            // The cached page was outdated, show the current lamp states
+            // unless a preset update is running
+            if (document.getElementById('loader').style.display !== 'flex') {
+                location.reload();
+            }
+        } else if (event.data.type === 'commands-replayed') {
+            M.toast({ html: 'Sent ' + event.data.count + ' queued command(s)', classes: 'green' });
+        }
+    });
+
+    // Browsers without Background Sync replay the queue when back online
+    window.addEventListener('online', () => {
+        navigator.serviceWorker.ready.then(registration => {
+            registration.active.postMessage({ type: 'replay-commands' });
+        });
+    });
+
     window.addEventListener('load', () => {
         navigator.serviceWorker.register('service-worker.js')
             .then(registration => {
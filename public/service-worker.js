@@ -1,64 +1,208 @@
-// public/js/service-worker.js
-
-const CACHE_NAME = 'luminasync-cache-v1';
-const urlsToCache = [
-    './',
-    './public/css/main.css',
-    './public/js/main.js',
-    './public/logo192.png',
-    './public/logo512.png',
-    './public/favicon.ico',
-    './manifest.webmanifest',
-    './service-worker.js',
-];
+// public/service-worker.js
+// Served by the /service-worker.js route, which fills in the placeholders
+
+const ASSET_VERSION = '__ASSET_VERSION__';
+const PRECACHE_URLS = __PRECACHE_URLS__;
+
+// Both caches are tied to the asset build: a cached page refers to the
+// hashed assets of its build, so the two are dropped together.
+const STATIC_CACHE = `luminasync-static-${ASSET_VERSION}`;
+const PAGE_CACHE = `luminasync-pages-${ASSET_VERSION}`;
+
+// Commands sent while offline are queued in IndexedDB and replayed in order
+const QUEUE_DB = 'luminasync';
+const QUEUE_STORE = 'commands';
+const SYNC_TAG = 'luminasync-commands';
+const QUEUED_PATHS = ['/apply', '/turn-off'];
+// Replaying a command much later would surprise whoever is in the room
+const QUEUE_MAX_AGE_MS = 15 * 60 * 1000;
 
 self.addEventListener('install', event => {
     event.waitUntil(
-        caches.open(CACHE_NAME)
-            .then(cache => {
-                return cache.addAll(urlsToCache);
-            })
+        caches.open(STATIC_CACHE)
+            .then(cache => cache.addAll(PRECACHE_URLS))
+            .then(() => caches.open(PAGE_CACHE))
+            .then(cache => cache.add('./'))
+            .then(() => self.skipWaiting())
+    );
+});
+
+self.addEventListener('activate', event => {
+    const cacheWhitelist = [STATIC_CACHE, PAGE_CACHE];
+    event.waitUntil(
+        caches.keys()
+            .then(cacheNames => Promise.all(
+                cacheNames
+                    .filter(cacheName => !cacheWhitelist.includes(cacheName))
+                    .map(cacheName => caches.delete(cacheName))
+            ))
+            .then(() => self.clients.claim())
+            .then(() => replayCommands().catch(() => undefined))
     );
 });
 
 self.addEventListener('fetch', event => {
     const url = new URL(event.request.url);
+    if (url.origin !== self.location.origin) {
+        return;
+    }
+    const path = url.pathname.replace(new URL(self.registration.scope).pathname, '/');
 
-    // Handle HTML files with a Network-First strategy
-    if (event.request.mode === 'navigate') {
-        event.respondWith(
-            fetch(event.request)
-                .then(async response => {
-                    const cache = await caches.open(CACHE_NAME);
-                    cache.put(event.request, response.clone());
-                    return response;
-                })
-                .catch(() => caches.match(event.request))
-        );
+    if (event.request.method === 'POST' && QUEUED_PATHS.includes(path)) {
+        event.respondWith(sendOrQueue(event.request));
+        return;
+    }
+    if (event.request.method !== 'GET') {
+        return;
+    }
+    if (event.request.mode === 'navigate' || path === '/') {
+        event.respondWith(staleWhileRevalidate(event));
         return;
     }
 
-    // Handle other assets with a Cache-First strategy
+    // Other assets are cache first; the built ones never change under their name
     event.respondWith(
         caches.match(event.request)
-            .then(response => {
-                return response || fetch(event.request);
-            })
+            .then(response => response || fetch(event.request))
     );
 });
 
+self.addEventListener('sync', event => {
+    if (event.tag === SYNC_TAG) {
+        event.waitUntil(replayCommands());
+    }
+});
 
-self.addEventListener('activate', event => {
-    const cacheWhitelist = [CACHE_NAME];
-    event.waitUntil(
-        caches.keys().then(cacheNames => {
-            return Promise.all(
-                cacheNames.map(cacheName => {
-                    if (!cacheWhitelist.includes(cacheName)) {
-                        return caches.delete(cacheName);
-                    }
-                })
-            );
-        })
-    );
+// Browsers without Background Sync ask for a replay when they come online
+self.addEventListener('message', event => {
+    if (event.data && event.data.type === 'replay-commands') {
+        event.waitUntil(replayCommands().catch(() => undefined));
+    }
 });
+
+// Serves the cached dashboard right away and refreshes it in the background.
+// The request revalidates with the server's ETag, so an unchanged page costs
+// a 304. Open pages are told when the page did change.
+async function staleWhileRevalidate(event) {
+    const cache = await caches.open(PAGE_CACHE);
+    const cached = await cache.match('./');
+    const refresh = fetch('./', { cache: 'no-cache' })
+        .then(async response => {
+            if (response.ok) {
+                const changed = !cached
+                    || cached.headers.get('ETag') !== response.headers.get('ETag');
+                await cache.put('./', response.clone());
+                if (changed && cached) {
+                    await notifyClients({ type: 'page-updated' });
+                }
+            }
+            return response;
+        });
+
+    if (cached) {
+        event.waitUntil(refresh.catch(() => undefined));
+        return cached;
+    }
+    return refresh;
+}
+
+async function sendOrQueue(request) {
+    const body = await request.clone().text();
+    // Earlier queued commands go first, so the newest command wins. A replay
+    // that fails, e.g. on an IndexedDB error, doesn't keep this command from
+    // being sent; the queue is retried on the next sync.
+    await replayCommands().catch(() => undefined);
+    try {
+        return await fetch(request);
+    } catch (error) {
+        await enqueueCommand({
+            url: request.url,
+            headers: { 'Content-Type': request.headers.get('Content-Type') || 'application/json' },
+            body: body,
+            queuedAt: Date.now(),
+        });
+        if (self.registration.sync) {
+            await self.registration.sync.register(SYNC_TAG).catch(() => undefined);
+        }
+        return new Response(
+            JSON.stringify({
+                success: false,
+                queued: true,
+                message: 'You are offline, the command will be sent when the connection returns.',
+            }),
+            { status: 202, headers: { 'Content-Type': 'application/json' } }
+        );
+    }
+}
+
+function openQueue() {
+    return new Promise((resolve, reject) => {
+        const open = indexedDB.open(QUEUE_DB, 1);
+        open.onupgradeneeded = () => {
+            open.result.createObjectStore(QUEUE_STORE, { keyPath: 'id', autoIncrement: true });
+        };
+        open.onsuccess = () => resolve(open.result);
+        open.onerror = () => reject(open.error);
+    });
+}
+
+async function queueTransaction(mode, operation) {
+    const db = await openQueue();
+    return new Promise((resolve, reject) => {
+        const transaction = db.transaction(QUEUE_STORE, mode);
+        const result = operation(transaction.objectStore(QUEUE_STORE));
+        transaction.oncomplete = () => resolve(result && result.result);
+        transaction.onerror = () => reject(transaction.error);
+    });
+}
+
+function enqueueCommand(command) {
+    return queueTransaction('readwrite', store => store.add(command));
+}
+
+// Sends the queued commands in the order they were issued. A command that
+// reaches the server is removed whatever the answer; the replay stops at the
+// first one that can't be sent and rejects, so the browser retries the sync.
+let replaying = null;
+
+function replayCommands() {
+    if (!replaying) {
+        replaying = replayQueue().finally(() => {
+            replaying = null;
+        });
+    }
+    return replaying;
+}
+
+async function replayQueue() {
+    const commands = await queueTransaction('readonly', store => store.getAll());
+    let sent = 0;
+    let failure = null;
+    for (const command of commands) {
+        if (Date.now() - command.queuedAt <= QUEUE_MAX_AGE_MS) {
+            try {
+                await fetch(command.url, {
+                    method: 'POST',
+                    headers: command.headers,
+                    body: command.body,
+                });
+                sent++;
+            } catch (error) {
+                failure = error;
+                break;
+            }
+        }
+        await queueTransaction('readwrite', store => store.delete(command.id));
+    }
+    if (sent) {
+        await notifyClients({ type: 'commands-replayed', count: sent });
+    }
+    if (failure) {
+        throw failure;
+    }
+}
+
+async function notifyClients(message) {
+    const clients = await self.clients.matchAll({ type: 'window' });
+    clients.forEach(client => client.postMessage(message));
+}
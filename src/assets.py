@@ -0,0 +1,146 @@
+"""
+Serves the static files in public/, including the fingerprinted assets that
+`build_assets.py` writes to public/dist.
+
+`asset_url` maps an asset name to its hashed file through the manifest of the
+build. Without a build, e.g. during development, it returns the fallback URL
+instead, so the dashboard keeps working from the unbuilt files and the CDN.
+"""
+
+import hashlib
+import json
+import logging
+import mimetypes
+import os
+import re
+from functools import cache
+
+from starlette.datastructures import Headers
+from starlette.responses import FileResponse, Response
+from starlette.staticfiles import NotModifiedResponse, StaticFiles
+from starlette.types import Scope
+
+MANIFEST_PATH = "public/dist/manifest.json"
+# The content hash build_assets.py puts in file names
+HASHED_NAME = re.compile(r"\.[0-9a-f]{10}\.[^./]+$")
+IMMUTABLE = "public, max-age=31536000, immutable"
+# Preferred first
+ENCODINGS = (("br", ".br"), ("gzip", ".gz"))
+
+logger = logging.getLogger("LuminaSync")
+
+
+@cache
+def load_manifest() -> dict:
+    try:
+        with open(MANIFEST_PATH, encoding="utf-8") as file:
+            manifest = json.load(file)
+    except FileNotFoundError:
+        logger.warning(
+            "No asset build found at %s, serving unbuilt assets.", MANIFEST_PATH
+        )
+        return {}
+    logger.info("Loaded %s fingerprinted assets.", len(manifest))
+    return manifest
+
+
+def asset_url(name: str, fallback: str) -> str:
+    """
+    Returns the URL of a built asset.
+    Args:
+        name (str): The asset name in the manifest, e.g. "main.css".
+        fallback (str): The URL used when the asset was not built.
+    Returns:
+        str: The URL of the hashed file, relative to the page.
+    """
+    path = load_manifest().get(name)
+    return f"public/{path}" if path else fallback
+
+
+@cache
+def asset_version() -> str:
+    """
+    A short hash of the asset build, which changes whenever any asset does.
+    """
+    manifest = load_manifest()
+    digest = hashlib.sha256(json.dumps(manifest, sort_keys=True).encode())
+    if not manifest:
+        # The unbuilt files keep their names, so their content is hashed
+        for url in built_asset_urls():
+            try:
+                with open(url, "rb") as file:
+                    digest.update(file.read())
+            except OSError:
+                pass
+    return digest.hexdigest()[:10]
+
+
+def built_asset_urls() -> list[str]:
+    """
+    The URLs of all built assets, or of the unbuilt local files without a
+    build.
+    """
+    manifest = load_manifest()
+    if not manifest:
+        return ["public/css/main.css", "public/js/main.js"]
+    return [f"public/{path}" for path in manifest.values()]
+
+
+def accepted_encodings(accept_encoding: str) -> set[str]:
+    """
+    The content codings an Accept-Encoding header allows.
+    """
+    encodings = set()
+    for part in accept_encoding.split(","):
+        coding, _, params = part.strip().partition(";")
+        match = re.search(r"q=([0-9.]+)", params)
+        if coding and not (match and float(match.group(1)) == 0):
+            encodings.add(coding.strip().lower())
+    return encodings
+
+
+class PrecompressedStaticFiles(StaticFiles):
+    """
+    StaticFiles that serves a precompressed .br or .gz variant of a file when
+    the client accepts it, and marks files with a content hash in their name
+    as immutable.
+    """
+
+    def file_response(
+        self,
+        full_path: os.PathLike,
+        stat_result: os.stat_result,
+        scope: Scope,
+        status_code: int = 200,
+    ) -> Response:
+        request_headers = Headers(scope=scope)
+        accepted = accepted_encodings(request_headers.get("accept-encoding", ""))
+        response = None
+        for encoding, suffix in ENCODINGS:
+            if encoding not in accepted:
+                continue
+            variant = f"{full_path}{suffix}"
+            try:
+                variant_stat = os.stat(variant)
+            except OSError:
+                continue
+            media_type, _ = mimetypes.guess_type(str(full_path))
+            response = FileResponse(
+                variant,
+                status_code=status_code,
+                stat_result=variant_stat,
+                media_type=media_type or "application/octet-stream",
+                headers={"Content-Encoding": encoding},
+            )
+            break
+        if response is None:
+            response = FileResponse(
+                full_path, status_code=status_code, stat_result=stat_result
+            )
+
+        response.headers["Vary"] = "Accept-Encoding"
+        if HASHED_NAME.search(str(full_path)):
+            response.headers["Cache-Control"] = IMMUTABLE
+        if self.is_not_modified(response.headers, request_headers):
+            return NotModifiedResponse(response.headers)
+        return response
@@ -0,0 +1,165 @@
+"""
+Schema migrations for existing databases.
+
+`create_all` only creates missing tables, so columns added to existing tables
+are applied here. The schema version is kept in SQLite's `user_version`
+pragma and every migration runs once, in order. Migrations must also work on
+a database whose tables `create_all` has just created with the new columns.
+"""
+
+import logging
+
+from sqlalchemy import text
+from sqlalchemy.engine import Connection
+
+logger = logging.getLogger("LuminaSync")
+
+
+def _columns(connection: Connection, table: str) -> set[str]:
+    return {row[1] for row in connection.execute(text(f"PRAGMA table_info({table})"))}
+
+
+def _add_column(connection: Connection, table: str, column: str, ddl: str) -> None:
+    if column not in _columns(connection, table):
+        connection.execute(text(f"ALTER TABLE {table} ADD COLUMN {column} {ddl}"))
+
+
+def _add_zones(connection: Connection) -> None:
+    """
+    Lamps and presets reference a zone. The zones table itself is created by
+    `create_all`.
+    """
+    _add_column(connection, "lamps", "zone_id", "INTEGER REFERENCES zones (id)")
+    _add_column(connection, "presets", "zone_id", "INTEGER REFERENCES zones (id)")
+    connection.execute(
+        text("CREATE INDEX IF NOT EXISTS ix_lamps_zone_id ON lamps (zone_id)")
+    )
+
+
+def _add_preset_sets(connection: Connection) -> None:
+    """
+    Presets belong to a generation. Names become unique per generation, which
+    SQLite can only change by rebuilding the table. The generated presets of
+    an existing database become the first, active generation.
+    """
+    if "set_id" in _columns(connection, "presets"):
+        return
+    connection.execute(text("ALTER TABLE presets RENAME TO presets_old"))
+    connection.execute(
+        text(
+            """
+            CREATE TABLE presets (
+                name VARCHAR NOT NULL,
+                value JSON NOT NULL,
+                protected INTEGER,
+                zone_id INTEGER,
+                set_id INTEGER,
+                id INTEGER NOT NULL,
+                updated_at DATETIME,
+                PRIMARY KEY (id),
+                CONSTRAINT uq_presets_set_id_name UNIQUE (set_id, name),
+                FOREIGN KEY(zone_id) REFERENCES zones (id),
+                FOREIGN KEY(set_id) REFERENCES preset_sets (id)
+            )
+            """
+        )
+    )
+    connection.execute(
+        text(
+            "INSERT INTO presets (id, updated_at, name, value, protected, zone_id) "
+            "SELECT id, updated_at, name, value, protected, zone_id "
+            "FROM presets_old"
+        )
+    )
+    connection.execute(text("DROP TABLE presets_old"))
+    connection.execute(
+        text(
+            "CREATE UNIQUE INDEX ux_presets_name_without_set ON presets (name) "
+            "WHERE set_id IS NULL"
+        )
+    )
+    connection.execute(text("CREATE INDEX ix_presets_set_id ON presets (set_id)"))
+
+    generated = connection.execute(
+        text(
+            "SELECT COUNT(*), MAX(updated_at) FROM presets "
+            "WHERE COALESCE(protected, 0) = 0"
+        )
+    ).one()
+    if generated[0]:
+        set_id = connection.execute(
+            text(
+                "INSERT INTO preset_sets (generated_at, updated_at, active, source) "
+                "VALUES (COALESCE(:generated_at, CURRENT_TIMESTAMP), "
+                "CURRENT_TIMESTAMP, 1, 'migrated')"
+            ),
+            {"generated_at": generated[1]},
+        ).lastrowid
+        connection.execute(
+            text(
+                "UPDATE presets SET set_id = :set_id "
+                "WHERE COALESCE(protected, 0) = 0"
+            ),
+            {"set_id": set_id},
+        )
+
+
+def _add_preset_set_inputs(connection: Connection) -> None:
+    """
+    Preset sets record the fingerprint of their inputs. Existing sets have
+    none, so the next update regenerates.
+    """
+    _add_column(connection, "preset_sets", "inputs", "JSON")
+
+
+def _add_schedule_preset_ids(connection: Connection) -> None:
+    """
+    Schedules reference their preset by ID instead of by name, since the
+    names of generated presets change with every generation. Existing
+    schedules get the active preset of their name, if there is one.
+    """
+    _add_column(
+        connection, "schedules", "preset_id", "INTEGER REFERENCES presets (id)"
+    )
+    if "preset_name" not in _columns(connection, "schedules"):
+        return
+    connection.execute(
+        text(
+            """
+            UPDATE schedules SET preset_id = (
+                SELECT presets.id FROM presets
+                LEFT JOIN preset_sets ON presets.set_id = preset_sets.id
+                WHERE presets.name = schedules.preset_name
+                AND (presets.set_id IS NULL OR preset_sets.active = 1)
+                ORDER BY presets.id LIMIT 1
+            )
+            WHERE preset_id IS NULL AND preset_name IS NOT NULL
+            """
+        )
+    )
+
+
+# The position in the list is the schema version the migration leads to,
+# starting at 1. Only append to this list.
+MIGRATIONS = [
+    _add_zones,
+    _add_preset_sets,
+    _add_preset_set_inputs,
+    _add_schedule_preset_ids,
+]
+
+
+def migrate(connection: Connection) -> int:
+    """
+    Applies the migrations newer than the database's schema version.
+    Args:
+        connection (Connection): A connection inside a transaction.
+    Returns:
+        int: The schema version after migrating.
+    """
+    version = connection.execute(text("PRAGMA user_version")).scalar()
+    for number, migration in enumerate(MIGRATIONS[version:], start=version + 1):
+        logger.info("Migrating the database to version %s.", number)
+        migration(connection)
+        connection.execute(text(f"PRAGMA user_version = {number}"))
+    return max(version, len(MIGRATIONS))
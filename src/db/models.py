@@ -2,7 +2,18 @@
 A module for the database models.
 """
 
-from sqlalchemy import JSON, Column, DateTime, Integer, String
+from sqlalchemy import (
+    JSON,
+    Column,
+    DateTime,
+    Float,
+    ForeignKey,
+    Index,
+    Integer,
+    String,
+    UniqueConstraint,
+    text,
+)
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.sql import func
 
@@ -24,18 +35,90 @@ class BaseModel(Base):
     # pylint: enable=not-callable
 
 
+class Zone(BaseModel):
+    """
+    Zone model for grouping lamps, e.g. the lamps in one room.
+    Attributes:
+        name (str): The name of the zone.
+    """
+
+    __tablename__ = "zones"
+    name = Column(String(50), unique=True, nullable=False)
+
+    def to_dict(self):
+        """
+        Returns the zone as a dictionary.
+        """
+        return {
+            "id": str(self.id),
+            "updated_at": self.updated_at.isoformat() if self.updated_at else None,
+            "name": self.name,
+        }
+
+
+class PresetSet(BaseModel):
+    """
+    PresetSet model for one generation of presets. Only the presets of the
+    active set are shown, next to the presets that belong to no set.
+    Attributes:
+        generated_at (datetime): When the set was generated.
+        active (int): 1 for the set in use, 0 otherwise.
+        source (str): How the set was generated, e.g. "stream".
+        inputs (dict): Fingerprint of the weather and news the set was
+            generated from, see `utils.change_detection`.
+    """
+
+    __tablename__ = "preset_sets"
+    # pylint: disable=not-callable
+    generated_at = Column(DateTime, default=func.now(), nullable=False, index=True)
+    # pylint: enable=not-callable
+    active = Column(Integer, default=0, nullable=False)
+    source = Column(String(20))
+    inputs = Column(JSON)
+
+    def to_dict(self):
+        """
+        Returns the preset set as a dictionary.
+        """
+        return {
+            "id": str(self.id),
+            "updated_at": self.updated_at.isoformat() if self.updated_at else None,
+            "generated_at": (
+                self.generated_at.isoformat() if self.generated_at else None
+            ),
+            "active": bool(self.active),
+            "source": self.source,
+        }
+
+
 class Preset(BaseModel):
     """
     Preset model for storing preset data.
     Attributes:
         name (str): The name of the preset.
         value (dict): The value of the preset
+        zone_id (int): The zone the preset targets, all lamps when unset.
+        set_id (int): The generation the preset belongs to. Protected and
+            manually created presets belong to none.
     """
 
     __tablename__ = "presets"
-    name = Column(String, unique=True, nullable=False)
+    # Names are unique within a set, and among the presets without a set
+    __table_args__ = (
+        UniqueConstraint("set_id", "name", name="uq_presets_set_id_name"),
+        Index(
+            "ux_presets_name_without_set",
+            "name",
+            unique=True,
+            sqlite_where=text("set_id IS NULL"),
+            postgresql_where=text("set_id IS NULL"),
+        ),
+    )
+    name = Column(String, nullable=False)
     value = Column(JSON, nullable=False)
     protected = Column(Integer, default=0)
+    zone_id = Column(Integer, ForeignKey("zones.id"), nullable=True)
+    set_id = Column(Integer, ForeignKey("preset_sets.id"), nullable=True, index=True)
 
     def to_dict(self):
         """
@@ -47,6 +130,8 @@ class Preset(BaseModel):
             "name": self.name,
             "value": self.value,
             "protected": bool(self.protected),
+            "zone_id": str(self.zone_id) if self.zone_id else None,
+            "set_id": str(self.set_id) if self.set_id else None,
         }
 
 
@@ -63,6 +148,7 @@ class Lamp(BaseModel):
         saturation (int): The saturation of the lamp.
         rgb (str): The RGB color of the lamp.
         hex (str): The hex color
+        zone_id (int): The zone the lamp belongs to, if any.
     """
 
     __tablename__ = "lamps"
@@ -75,6 +161,7 @@ class Lamp(BaseModel):
     saturation = Column(Integer)
     rgb = Column(String(50))
     hex = Column(String(50))
+    zone_id = Column(Integer, ForeignKey("zones.id"), nullable=True, index=True)
 
     def to_dict(self):
         """
@@ -92,4 +179,188 @@ class Lamp(BaseModel):
             "saturation": self.saturation,
             "rgb": self.rgb,
             "hex": self.hex,
+            "zone_id": str(self.zone_id) if self.zone_id else None,
+        }
+
+
+class Snapshot(BaseModel):
+    """
+    Snapshot model for the live state of the lamps at one moment.
+    Attributes:
+        name (str): An optional name of the snapshot.
+        taken_at (datetime): When the lamps were read.
+        state (list): Per lamp [lamp_id, on, color_temp, hue, saturation,
+            brightness], where on is 1 or 0.
+    """
+
+    __tablename__ = "snapshots"
+    name = Column(String(50))
+    # pylint: disable=not-callable
+    taken_at = Column(DateTime, default=func.now(), nullable=False, index=True)
+    # pylint: enable=not-callable
+    state = Column(JSON, nullable=False)
+
+    def to_dict(self):
+        """
+        Returns the snapshot as a dictionary.
+        """
+        return {
+            "id": str(self.id),
+            "updated_at": self.updated_at.isoformat() if self.updated_at else None,
+            "name": self.name,
+            "taken_at": self.taken_at.isoformat() if self.taken_at else None,
+            "lamp_count": len(self.state or []),
+        }
+
+
+class LampSample(Base):
+    """
+    LampSample model for the append-only history of lamp states. A row is
+    only written when the state of a lamp changes, and the rows are never
+    updated, so the table has no updated_at column.
+    Attributes:
+        lamp_id (int): The lamp.
+        recorded_at (datetime): When the state was read, in UTC.
+        on (int): 1 when the lamp is on, 0 otherwise.
+        brightness (int): The brightness of the lamp.
+        color_temp (int): The color temperature, 0 in color mode.
+        hue (int): The hue of the lamp.
+        saturation (int): The saturation of the lamp.
+    """
+
+    __tablename__ = "lamp_samples"
+    # Range queries per lamp, and retention by age
+    __table_args__ = (
+        Index("ix_lamp_samples_lamp_id_recorded_at", "lamp_id", "recorded_at"),
+    )
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    lamp_id = Column(Integer, nullable=False)
+    recorded_at = Column(DateTime, nullable=False, index=True)
+    on = Column(Integer, nullable=False)
+    brightness = Column(Integer)
+    color_temp = Column(Integer)
+    hue = Column(Integer)
+    saturation = Column(Integer)
+
+    def to_dict(self):
+        """
+        Returns the sample as a dictionary.
+        """
+        return {
+            "lamp_id": str(self.lamp_id),
+            "recorded_at": self.recorded_at.isoformat(),
+            "on": bool(self.on),
+            "brightness": self.brightness,
+            "color_temp": self.color_temp,
+            "hue": self.hue,
+            "saturation": self.saturation,
+        }
+
+
+class LampRollup(Base):
+    """
+    LampRollup model for the usage of a lamp per hour or per day, computed
+    from the samples.
+    Attributes:
+        lamp_id (int): The lamp.
+        period (str): "hour" or "day".
+        period_start (datetime): The start of the period, in UTC.
+        on_seconds (float): How long the lamp was on.
+        brightness_seconds (float): The brightness integrated over the time
+            the lamp was on, so the average is brightness_seconds / on_seconds.
+        changes (int): The number of state changes in the period.
+    """
+
+    __tablename__ = "lamp_rollups"
+    __table_args__ = (
+        UniqueConstraint(
+            "lamp_id", "period", "period_start", name="uq_lamp_rollups_period"
+        ),
+        Index("ix_lamp_rollups_period_period_start", "period", "period_start"),
+    )
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    lamp_id = Column(Integer, nullable=False)
+    period = Column(String(4), nullable=False)
+    period_start = Column(DateTime, nullable=False)
+    on_seconds = Column(Float, nullable=False, default=0)
+    brightness_seconds = Column(Float, nullable=False, default=0)
+    changes = Column(Integer, nullable=False, default=0)
+
+    def to_dict(self):
+        """
+        Returns the rollup as a dictionary.
+        """
+        return {
+            "lamp_id": str(self.lamp_id),
+            "period": self.period,
+            "period_start": self.period_start.isoformat(),
+            "on_seconds": round(self.on_seconds, 1),
+            "average_brightness": (
+                round(self.brightness_seconds / self.on_seconds, 1)
+                if self.on_seconds
+                else None
+            ),
+            "changes": self.changes,
+        }
+
+
+class Schedule(BaseModel):
+    """
+    Schedule model for applying a preset, or turning the lamps off, at a
+    time of day.
+    Attributes:
+        name (str): The name of the schedule.
+        action (str): "preset" to apply a preset, "off" to turn lamps off.
+        preset_id (int): The preset to apply. Its preset set is kept while
+            a schedule uses it.
+        zone_id (int): The zone to apply to, the preset's zone or all lamps
+            when unset.
+        trigger (str): "time" for a fixed time, "sunrise" or "sunset".
+        time (str): The local time of a "time" trigger, as HH:MM.
+        offset_minutes (int): Minutes before (negative) or after a sunrise
+            or sunset.
+        weekdays (int): Bit mask of the days the schedule runs on, bit 0 for
+            Monday.
+        transition_ms (int): Duration of the fade to the preset.
+        enabled (int): 1 when the schedule runs, 0 otherwise.
+        last_run_at (datetime): The due time of the latest run, in UTC.
+        last_status (str): "ok", "failed" or "missed" for the latest run.
+        last_error (str): Why the latest run failed.
+    """
+
+    __tablename__ = "schedules"
+    name = Column(String(50), nullable=False)
+    action = Column(String(10), nullable=False, default="preset")
+    preset_id = Column(Integer, ForeignKey("presets.id"), nullable=True)
+    zone_id = Column(Integer, ForeignKey("zones.id"), nullable=True)
+    trigger = Column(String(10), nullable=False)
+    time = Column(String(5))
+    offset_minutes = Column(Integer, nullable=False, default=0)
+    weekdays = Column(Integer, nullable=False, default=0b1111111)
+    transition_ms = Column(Integer, nullable=False, default=0)
+    enabled = Column(Integer, nullable=False, default=1)
+    last_run_at = Column(DateTime)
+    last_status = Column(String(10))
+    last_error = Column(String)
+
+    def to_dict(self):
+        """
+        Returns the schedule as a dictionary.
+        """
+        return {
+            "id": str(self.id),
+            "updated_at": self.updated_at.isoformat() if self.updated_at else None,
+            "name": self.name,
+            "action": self.action,
+            "preset_id": self.preset_id,
+            "zone_id": self.zone_id,
+            "trigger": self.trigger,
+            "time": self.time,
+            "offset_minutes": self.offset_minutes,
+            "weekdays": self.weekdays,
+            "transition_ms": self.transition_ms,
+            "enabled": bool(self.enabled),
+            "last_run_at": self.last_run_at.isoformat() if self.last_run_at else None,
+            "last_status": self.last_status,
+            "last_error": self.last_error,
         }
@@ -4,22 +4,134 @@ database sessions and seeding the database.
 """
 
 import logging
+import time
 
-from sqlalchemy import create_engine
+from sqlalchemy import (
+    JSON,
+    Integer,
+    String,
+    create_engine,
+    event,
+    exists,
+    insert,
+    literal,
+    select,
+    union_all,
+)
 from sqlalchemy.exc import SQLAlchemyError
 from sqlalchemy.orm import scoped_session, sessionmaker
 
+from db.migrations import migrate
 from db.models import Base, Lamp, Preset
+from metrics import histogram
+from settings import get_settings
+from utils.coordination import cache_generation, startup_lock
 
-engine = create_engine("sqlite:///db/light_control.db")
-Session = scoped_session(sessionmaker(bind=engine, expire_on_commit=False))
+_database_url = get_settings().database_url
+_is_sqlite = _database_url.startswith("sqlite")
 
-Base.metadata.create_all(engine)
+# Several worker processes may write to the same SQLite file. Writers wait
+# for the lock instead of failing right away, and WAL lets readers proceed
+# while another process writes.
+engine = create_engine(
+    _database_url, connect_args={"timeout": 30} if _is_sqlite else {}
+)
+
+if _is_sqlite:
+
+    @event.listens_for(engine, "connect")
+    def _configure_sqlite(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        cursor.execute("PRAGMA journal_mode=WAL")
+        cursor.execute("PRAGMA synchronous=NORMAL")
+        cursor.close()
+
+
+session_factory = sessionmaker(bind=engine, expire_on_commit=False)
+Session = scoped_session(session_factory)
+
+DB_TRANSACTION_DURATION = histogram(
+    "luminasync_db_transaction_duration_seconds",
+    "Time between the start and the end of a database transaction.",
+    ["outcome"],
+)
+
+
+@event.listens_for(session_factory, "after_begin")
+def _transaction_started(session, transaction, connection):
+    session.info.setdefault("transaction_started", time.perf_counter())
+
+
+@event.listens_for(session_factory, "after_flush")
+def _data_flushed(session, flush_context):
+    session.info["data_changed"] = True
+
+
+@event.listens_for(session_factory, "do_orm_execute")
+def _statement_executed(orm_execute_state):
+    if (
+        orm_execute_state.is_insert
+        or orm_execute_state.is_update
+        or orm_execute_state.is_delete
+    ):
+        orm_execute_state.session.info["data_changed"] = True
+
+
+@event.listens_for(session_factory, "after_commit")
+def _transaction_committed(session):
+    session.info["transaction_committed"] = True
+    # Let the other workers know their cached views of the data are stale
+    if session.info.pop("data_changed", False):
+        cache_generation.bump()
+
+
+@event.listens_for(session_factory, "after_transaction_end")
+def _transaction_ended(session, transaction):
+    if transaction.parent is not None:
+        return
+    started = session.info.pop("transaction_started", None)
+    committed = session.info.pop("transaction_committed", False)
+    session.info.pop("data_changed", None)
+    if started is not None:
+        DB_TRANSACTION_DURATION.observe(
+            time.perf_counter() - started, "commit" if committed else "rollback"
+        )
 
 
 logger = logging.getLogger("LuminaSync")
+_db_initialized = False
 _db_seeded = False
 
+SEED_LAMP_IPS = ["192.168.2.31", "192.168.2.32"]
+SEED_PRESETS = [
+    {
+        "name": "default",
+        "value": {"type": "temp", "setting": 3500, "brightness": 80},
+        "protected": 1,
+    },
+    {
+        "name": "meeting",
+        "value": {"type": "temp", "setting": 5000, "brightness": 100},
+        "protected": 1,
+    },
+]
+
+
+def init_db():
+    """
+    Creates the missing database tables and migrates existing ones. Safe to
+    call more than once, also from several workers starting at the same time.
+    """
+    global _db_initialized
+    if _db_initialized:
+        return
+    with startup_lock():
+        Base.metadata.create_all(engine)
+        if _is_sqlite:
+            with engine.begin() as connection:
+                migrate(connection)
+    _db_initialized = True
+
 
 def get_session():
     """
@@ -33,58 +145,71 @@ def get_session():
 def seed_db():
     """
     Seeds the database with Lamp and Preset objects if they do not already exist.
+    Each table is seeded with a single idempotent INSERT ... SELECT that skips
+    the existing rows, so restarts don't pay a SELECT per seeded row, on any
+    database. Workers starting together seed one after another.
     """
-    global _db_seeded
     if _db_seeded:
         logger.info("Database already seeded.")
         return
+    init_db()
+    with startup_lock():
+        _seed_tables()
+
+
+def _seed_tables():
+    global _db_seeded
+    session = get_session()
     try:
-        session = get_session()
-
-        # Seed Lamps
-        lamp_ips = ["192.168.2.31", "192.168.2.32"]
-        for ip in lamp_ips:
-            existing_lamp = session.query(Lamp).filter_by(ip=ip).first()
-            if not existing_lamp:
-                logger.info(f"Adding Lamp with IP: {ip}")
-                session.add(Lamp(ip=ip))
-            else:
-                logger.debug(f"Lamp with IP {ip} already exists.")
-
-        # Seed Presets
-        presets = [
-            {
-                "name": "default",
-                "value": {"type": "temp", "setting": 3500, "brightness": 80},
-                "protected": 1,
-            },
-            {
-                "name": "meeting",
-                "value": {"type": "temp", "setting": 5000, "brightness": 100},
-                "protected": 1,
-            },
-        ]
-        for preset_data in presets:
-            existing_preset = (
-                session.query(Preset).filter_by(name=preset_data["name"]).first()
+        # Lamps have no unique constraint on the IP, so only insert the IPs
+        # that are not present yet
+        seed_ips = union_all(
+            *(select(literal(ip).label("ip")) for ip in SEED_LAMP_IPS)
+        ).subquery()
+        lamps_added = session.execute(
+            insert(Lamp).from_select(
+                ["ip"],
+                select(seed_ips.c.ip).where(
+                    ~exists().where(Lamp.ip == seed_ips.c.ip)
+                ),
             )
-            if not existing_preset:
-                logger.info(f"Adding Preset: {preset_data['name']}")
-                session.add(
-                    Preset(
-                        name=preset_data["name"],
-                        value=preset_data["value"],
-                        protected=preset_data["protected"],
-                    )
+        ).rowcount
+
+        # The same for the presets without a set, whose names are unique
+        seed_presets = union_all(
+            *(
+                select(
+                    literal(preset["name"], String).label("name"),
+                    literal(preset["value"], JSON).label("value"),
+                    literal(preset["protected"], Integer).label("protected"),
                 )
-            else:
-                logger.debug(f"Preset {preset_data['name']} already exists.")
+                for preset in SEED_PRESETS
+            )
+        ).subquery()
+        presets_added = session.execute(
+            insert(Preset).from_select(
+                ["name", "value", "protected"],
+                select(
+                    seed_presets.c.name,
+                    seed_presets.c.value,
+                    seed_presets.c.protected,
+                ).where(
+                    ~exists().where(
+                        Preset.name == seed_presets.c.name, Preset.set_id.is_(None)
+                    )
+                ),
+            )
+        ).rowcount
 
         session.commit()
-        logger.info("Database seeding completed.")
+        logger.info(
+            "Database seeding completed, added %s lamps and %s presets.",
+            lamps_added,
+            presets_added,
+        )
         _db_seeded = True
     except SQLAlchemyError as e:
         session.rollback()
-        logger.error(f"An error occurred while seeding the database: {e}")
+        logger.error("An error occurred while seeding the database: %s", e)
     finally:
         session.close()
@@ -0,0 +1,228 @@
+"""
+Health and readiness of the app, for the probes of the orchestrator.
+
+Probing every bulb on each request would be expensive and slow, so a
+background thread in each worker refreshes a report every HEALTH_INTERVAL
+seconds and `/healthz` and `/readyz` only read the latest one. A refresh
+checks that the database is writable, with an update that is rolled back,
+and that every lamp accepts a TCP connection on its HTTP port, without a
+handshake. The lamps are probed concurrently. The report also holds the last
+successful calls to the weather, news and OpenAI APIs, as recorded by
+`metrics.track_upstream`.
+
+The app is ready once a recent report shows a writable database. Unreachable
+lamps only mark it as degraded, since the dashboard still works.
+"""
+
+import logging
+import socket
+import threading
+import time
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional
+
+from sqlalchemy import text
+
+from db.models import Lamp
+from db.session import engine, get_session
+from metrics import gauge
+from services.dispatch import run_concurrently
+from settings import get_settings
+from utils.upstream_status import last_success
+
+# Tapo bulbs serve their API over plain HTTP
+DEVICE_PORT = 80
+UPSTREAMS = ("open-meteo", "newsdata", "openai")
+# A report older than this many intervals means the refresh thread is stuck
+STALE_INTERVALS = 3
+
+DEVICES_REACHABLE = gauge(
+    "luminasync_health_devices_reachable",
+    "Lamps that accepted a connection in the latest health check.",
+)
+HEALTH_CHECK_DURATION = gauge(
+    "luminasync_health_check_duration_seconds",
+    "Duration of the latest health check.",
+)
+
+logger = logging.getLogger("LuminaSync")
+
+
+def _isoformat(timestamp: Optional[float]) -> Optional[str]:
+    if timestamp is None:
+        return None
+    return datetime.fromtimestamp(timestamp, timezone.utc).isoformat(
+        timespec="seconds"
+    )
+
+
+def check_database() -> Dict[str, Any]:
+    """
+    Checks that the database accepts writes. The update takes the write lock
+    but changes nothing and is rolled back.
+    """
+    start = time.perf_counter()
+    try:
+        with engine.connect() as connection:
+            with connection.begin() as transaction:
+                connection.execute(
+                    text(
+                        "UPDATE lamps SET id = id "
+                        "WHERE id = (SELECT MIN(id) FROM lamps)"
+                    )
+                )
+                transaction.rollback()
+        error = None
+    except Exception as e:  # pylint: disable=broad-except
+        error = str(e)
+    return {
+        "ok": error is None,
+        "latency_ms": round((time.perf_counter() - start) * 1000, 1),
+        "error": error,
+    }
+
+
+def check_device(ip: str, timeout: float) -> float:
+    """
+    Opens and closes a TCP connection to a lamp.
+    Returns:
+        float: The connect time in milliseconds.
+    """
+    start = time.perf_counter()
+    with socket.create_connection((ip, DEVICE_PORT), timeout=timeout):
+        pass
+    return round((time.perf_counter() - start) * 1000, 1)
+
+
+def check_devices(timeout: float) -> List[Dict[str, Any]]:
+    session = get_session()
+    try:
+        ips = [lamp.ip for lamp in session.query(Lamp).order_by(Lamp.id)]
+    finally:
+        session.close()
+    return [
+        {
+            "ip": ip,
+            "reachable": error is None,
+            "latency_ms": latency,
+            "error": str(error) if error else None,
+        }
+        for ip, latency, error in run_concurrently(
+            lambda ip: check_device(ip, timeout), ips
+        )
+    ]
+
+
+def check_upstreams(now: float) -> Dict[str, Dict[str, Any]]:
+    upstreams = {}
+    for upstream in UPSTREAMS:
+        stamp = last_success(upstream)
+        upstreams[upstream] = {
+            "last_success": _isoformat(stamp),
+            "age_seconds": None if stamp is None else round(max(0.0, now - stamp)),
+        }
+    return upstreams
+
+
+class HealthMonitor:
+    """
+    Refreshes the health report in a daemon thread and keeps the latest one.
+    """
+
+    def __init__(self) -> None:
+        self._report: Optional[Dict[str, Any]] = None
+        self._checked_at = 0.0
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._unreachable: List[str] = []
+
+    def start(self) -> None:
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(
+            target=self._run, name="health-monitor", daemon=True
+        )
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+
+    @property
+    def alive(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def _run(self) -> None:
+        interval = get_settings().health_interval
+        while not self._stop.is_set():
+            try:
+                self.refresh()
+            except Exception:  # pylint: disable=broad-except
+                logger.exception("The health check failed.")
+            self._stop.wait(interval)
+
+    def refresh(self) -> Dict[str, Any]:
+        """
+        Runs all checks and stores the report.
+        """
+        start = time.perf_counter()
+        database = check_database()
+        try:
+            devices = check_devices(get_settings().health_probe_timeout)
+            devices_error = None
+        except Exception as e:  # pylint: disable=broad-except
+            logger.warning("The device health check failed: %s", e)
+            devices, devices_error = [], e
+
+        now = time.time()
+        unreachable = [device["ip"] for device in devices if not device["reachable"]]
+        if not database["ok"]:
+            status = "unavailable"
+        elif unreachable or devices_error is not None:
+            status = "degraded"
+        else:
+            status = "ok"
+        duration = time.perf_counter() - start
+        report = {
+            "status": status,
+            "checked_at": _isoformat(now),
+            "duration_ms": round(duration * 1000, 1),
+            "database": database,
+            "devices": devices,
+            "upstreams": check_upstreams(now),
+        }
+        if unreachable != self._unreachable:
+            if unreachable:
+                logger.warning("Lamps not reachable: %s", ", ".join(unreachable))
+            else:
+                logger.info("All lamps are reachable again.")
+            self._unreachable = unreachable
+
+        DEVICES_REACHABLE.set(value=len(devices) - len(unreachable))
+        HEALTH_CHECK_DURATION.set(value=duration)
+        with self._lock:
+            self._report = report
+            self._checked_at = time.monotonic()
+        return report
+
+    def report(self) -> Optional[Dict[str, Any]]:
+        """
+        The latest report, or None before the first check finished.
+        """
+        with self._lock:
+            return self._report
+
+    def ready(self) -> bool:
+        """
+        Whether a recent report shows a writable database.
+        """
+        with self._lock:
+            if self._report is None:
+                return False
+            age = time.monotonic() - self._checked_at
+            database_ok = self._report["database"]["ok"]
+        return database_ok and age <= get_settings().health_interval * STALE_INTERVALS
+
+
+health_monitor = HealthMonitor()
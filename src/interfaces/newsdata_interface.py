@@ -1,41 +1,60 @@
+from types import MappingProxyType
+
 import requests
 
 from logging_config import get_logger
+from metrics import track_upstream
+from utils.upstream_client import upstream_client
 
 
 class NewsDataInterfaceException(Exception):
     pass
 
 
+def _error_message(response: requests.Response) -> str:
+    try:
+        return response.json()["message"]
+    except (ValueError, KeyError, TypeError):
+        return f"HTTP {response.status_code}"
+
+
 class NewsDataInterface:
     def __init__(self, api_key: str) -> None:
         self.logger = get_logger(self.__class__)
         self.api_key = api_key
         self.base_url = "https://newsdata.io/api/1/latest"
-        self.params = {
-            "apikey": self.api_key,
-            # "language": "en",
-            "size": 10,
-            "removeduplicate": 1,
-        }
+        # Read-only, every call adds its filters to its own copy
+        self.params = MappingProxyType(
+            {
+                "apikey": self.api_key,
+                # "language": "en",
+                "size": 10,
+                "removeduplicate": 1,
+            }
+        )
 
     def fetch_news_data(self, country=None, category="top", query=None) -> dict:
         url = self.base_url
+        params = dict(self.params)
         if country:
-            self.params["country"] = country
+            params["country"] = country
         if category:
-            self.params["category"] = category
+            params["category"] = category
         if query:
-            self.params["q"] = query
+            params["q"] = query
         try:
             self.logger.info("Fetching news data.")
-            response = requests.get(url, params=self.params, timeout=30)
-            data = response.json()
-            if response.status_code != 200:
-                self.logger.error(f"Error fetching news data: {data['message']}")
-                raise NewsDataInterfaceException(
-                    f"Error fetching news data: {data['message']}"
-                )
+            # A failed status must raise inside the block, so it isn't
+            # recorded as a successful call
+            with track_upstream("newsdata"):
+                response = upstream_client().get(url, params=params, timeout=30)
+                if response.status_code != 200:
+                    message = _error_message(response)
+                    self.logger.error("Error fetching news data: %s", message)
+                    raise NewsDataInterfaceException(
+                        f"Error fetching news data: {message}"
+                    )
+                data = response.json()
 
             articles = []
             for article in data["results"]:
@@ -52,5 +71,5 @@ class NewsDataInterface:
             return articles
 
         except requests.exceptions.RequestException as e:
-            self.logger.error(f"Error fetching news data: {e}")
+            self.logger.error("Error fetching news data: %s", e)
             raise NewsDataInterfaceException(f"Error fetching news data: {e}") from e
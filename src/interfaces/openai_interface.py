@@ -3,51 +3,52 @@ This module is a simple interface for the OpenAI API.
 It features methods to generate emotional responses and light presets using the API.
 """
 
-import json
+import asyncio
+from functools import cache
 from textwrap import dedent
-from typing import List, Literal, Optional
-
-from openai import OpenAI
-from pydantic import BaseModel, Field
-
+from typing import Callable, List
+
+from openai import (
+    APIConnectionError,
+    AsyncOpenAI,
+    InternalServerError,
+    OpenAI,
+    RateLimitError,
+)
+from pydantic import BaseModel, ValidationError
+
+# The models are defined in interfaces.schemas and re-exported from here
+from interfaces.schemas import (  # pylint: disable=unused-import
+    HEX_COLOR,
+    ColorSetting,
+    EmotionalResponses,
+    LightPresetModel,
+    Preset,
+    TempSetting,
+    ValidationModel,
+    preset_errors,
+)
 from logging_config import get_logger
+from metrics import counter, track_upstream
+from tracing import span
+from utils.prompt_payload import compact_json, estimate_tokens
+from utils.upstream_client import backoff_delay
 from prompts.analyze_weather_news import system_prompt as emotional_prompt
+from prompts.create_presets import general_system_prompt as general_presets_prompt
+from prompts.create_presets import mood_system_prompt as mood_presets_prompt
 from prompts.create_presets import system_prompt as create_presets_prompt
 
 
-class EmotionalResponses(BaseModel):
-    emotional_responses: list[str]
-
-
-class ColorSetting(BaseModel):
-    type: Literal["color"] = "color"
-    setting: str = Field(...)
-    brightness: int = Field(...)
-
-
-class TempSetting(BaseModel):
-    type: Literal["temp"] = "temp"
-    setting: int = Field(...)
-    brightness: int = Field(...)
-
-
-class Preset(BaseModel):
-    type: Literal["color", "temp"] = Field(..., description="Type of the preset")
-    name: str = Field(..., description="Name of the preset")
-    # Optional fields for color and temp presets
-    value_color: Optional[List[ColorSetting]] = Field(
-        None, description="List of color settings"
-    )
-    value_temp: Optional[TempSetting] = Field(None, description="Temperature setting")
-
+OPENAI_TOKENS = counter(
+    "luminasync_openai_tokens_total",
+    "Tokens reported in the usage of OpenAI completions.",
+    ["model", "type"],
+)
 
-class LightPresetModel(BaseModel):
-    presets: List[Preset]
 
-
-class ValidationModel(BaseModel):
-    validation: Literal["VALID", "INVALID"] = Field(...)
-    explanation: str = Field(...)
+# Errors worth another attempt: rate limits, timeouts and connection errors,
+# and 5xx responses. Other errors, e.g. a rejected API key, fail at once.
+RETRYABLE_ERRORS = (APIConnectionError, InternalServerError, RateLimitError)
 
 
 class OpenAIInterfaceException(Exception):
@@ -58,6 +59,20 @@ class OpenAIInterflaceResponseValidationException(OpenAIInterfaceException):
     pass
 
 
+def _retry_after(error: Exception) -> float | None:
+    # Only the seconds form, as sent with rate limits
+    response = getattr(error, "response", None)
+    try:
+        return max(0.0, float(response.headers["Retry-After"]))
+    except (AttributeError, KeyError, TypeError, ValueError):
+        return None
+
+
+@cache
+def _compact_schema(model: type[BaseModel]) -> str:
+    return compact_json(model.model_json_schema())
+
+
 class OpenAIInterface:
     def __init__(self, api_key: str) -> None:
         self.logger = get_logger(self.__class__)
@@ -109,6 +124,265 @@ class OpenAIInterface:
             f"Error generating light presets: {exception}"
         ) from exception
 
+    def stream_light_presets(
+        self,
+        data: str,
+        on_preset: Callable[[Preset], None],
+        model: str = "gpt-4o",
+    ) -> LightPresetModel:
+        """
+        Generate light presets, handing each one to `on_preset` as soon as the
+        model has finished writing it instead of waiting for the whole set.
+        Presets are checked with `preset_errors` rather than the validation
+        model, and invalid ones are logged and skipped.
+
+        Args:
+            data (str): The input data.
+            on_preset (Callable): Called with every valid preset while the
+                response is still streaming.
+
+        Returns:
+            LightPresetModel: The complete generated output.
+        """
+        system_message = dedent(create_presets_prompt)
+        user_message = dedent(data)
+        estimated_tokens = estimate_tokens(system_message) + estimate_tokens(
+            user_message
+        )
+        delivered = 0
+
+        def deliver(raw: dict | Preset) -> None:
+            try:
+                preset = Preset.model_validate(raw)
+            except ValidationError as e:
+                self.logger.warning("Skipping malformed preset: %s", e)
+                return
+            errors = preset_errors(preset)
+            if errors:
+                self.logger.warning(
+                    "Skipping invalid preset %s: %s", preset.name, "; ".join(errors)
+                )
+                return
+            on_preset(preset)
+
+        try:
+            with span(
+                "openai.completion_stream",
+                model=model,
+                response=LightPresetModel.__name__,
+                estimated_input_tokens=estimated_tokens,
+            ), track_upstream("openai"):
+                with self.client.beta.chat.completions.stream(
+                    model=model,
+                    messages=[
+                        {"role": "system", "content": system_message},
+                        {"role": "user", "content": user_message},
+                    ],
+                    response_format=LightPresetModel,
+                    stream_options={"include_usage": True},
+                ) as stream:
+                    for event in stream:
+                        if event.type == "content.delta" and isinstance(
+                            event.parsed, dict
+                        ):
+                            presets = event.parsed.get("presets") or []
+                            # Every preset but the last one in the partial
+                            # output is complete
+                            while delivered < len(presets) - 1:
+                                deliver(presets[delivered])
+                                delivered += 1
+                        elif event.type == "content.done" and event.parsed:
+                            for preset in event.parsed.presets[delivered:]:
+                                deliver(preset)
+                            delivered = len(event.parsed.presets)
+                    completion = stream.get_final_completion()
+            self._record_usage(model, completion, LightPresetModel, estimated_tokens)
+            output = completion.choices[0].message.parsed
+            if output is None:
+                raise OpenAIInterfaceException("The model returned no presets.")
+            self.logger.info("Streamed %s light presets.", delivered)
+            return output
+        except OpenAIInterfaceException:
+            raise
+        except Exception as e:
+            self.logger.error("Error streaming light presets: %s", e)
+            raise OpenAIInterfaceException(f"Error streaming light presets: {e}") from e
+
+    async def generate_presets_concurrently(
+        self,
+        news_data: str,
+        lamp_count: int,
+        max_concurrency: int = 4,
+        mood_batches: int = 2,
+        general_count: int = 3,
+        attempts: int = 2,
+    ) -> tuple[List[str], LightPresetModel]:
+        """
+        Generate emotional responses and light presets with concurrent
+        requests. The general presets don't depend on the news, so they are
+        generated while the emotional responses are; the mood presets are
+        then split into batches of descriptions that run side by side. Every
+        request is retried on its own and checked with `preset_errors`
+        instead of the validation model.
+
+        Args:
+            news_data (str): The weather and news input.
+            lamp_count (int): The number of lamps.
+            max_concurrency (int): Maximum requests in flight at once.
+            mood_batches (int): Number of requests the mood presets are
+                split into.
+            general_count (int): Number of general presets.
+            attempts (int): Attempts per request.
+
+        Returns:
+            tuple: The emotional responses and the presets, mood presets in
+                the order of the responses followed by the general presets.
+        """
+        semaphore = asyncio.Semaphore(max_concurrency)
+        async with AsyncOpenAI(api_key=self.api_key) as client:
+
+            async def request(system_message, user_message, response_format):
+                return await self._get_message_async(
+                    client,
+                    semaphore,
+                    system_message,
+                    user_message,
+                    response_format,
+                    attempts,
+                )
+
+            general_task = asyncio.create_task(
+                request(
+                    general_presets_prompt,
+                    compact_json(
+                        {"lamp_count": lamp_count, "preset_count": general_count}
+                    ),
+                    LightPresetModel,
+                )
+            )
+            try:
+                emotional = await request(
+                    emotional_prompt, news_data, EmotionalResponses
+                )
+                descriptions = emotional.emotional_responses
+                # Without descriptions only the general presets are generated
+                batch_size = max(1, -(-len(descriptions) // max(1, mood_batches)))
+                batches = [
+                    descriptions[start : start + batch_size]
+                    for start in range(0, len(descriptions), batch_size)
+                ]
+                mood_results = await asyncio.gather(
+                    *(
+                        request(
+                            mood_presets_prompt,
+                            compact_json(
+                                {"lamp_count": lamp_count, "descriptions": batch}
+                            ),
+                            LightPresetModel,
+                        )
+                        for batch in batches
+                    )
+                )
+                general = await general_task
+            finally:
+                general_task.cancel()
+
+        presets = self._merge_presets(
+            [result.presets for result in mood_results]
+            + [general.presets[:general_count]]
+        )
+        self.logger.info(
+            "Generated %s presets in %s concurrent requests.",
+            len(presets.presets),
+            len(batches) + 2,
+        )
+        return descriptions, presets
+
+    def _merge_presets(self, groups: List[List[Preset]]) -> LightPresetModel:
+        """
+        Concatenates preset groups in the given order, dropping invalid
+        presets and renaming duplicates, so the result doesn't depend on
+        which request finished first.
+        """
+        merged = []
+        names = set()
+        for group in groups:
+            for preset in group:
+                errors = preset_errors(preset)
+                if errors:
+                    self.logger.warning(
+                        "Skipping invalid preset %s: %s",
+                        preset.name,
+                        "; ".join(errors),
+                    )
+                    continue
+                name, suffix = preset.name, 2
+                while name.lower() in names:
+                    name, suffix = f"{preset.name}{suffix}", suffix + 1
+                names.add(name.lower())
+                merged.append(preset.model_copy(update={"name": name}))
+        return LightPresetModel(presets=merged)
+
+    async def _get_message_async(
+        self,
+        client: AsyncOpenAI,
+        semaphore: asyncio.Semaphore,
+        system_message: str,
+        user_message: str,
+        response_format: type[BaseModel],
+        attempts: int = 2,
+        model: str = "gpt-4o",
+    ) -> BaseModel:
+        """
+        Generate a message with the async client, holding the semaphore for
+        the duration of each request. Rate limits, timeouts and 5xx errors
+        are retried after a backoff, honouring a `Retry-After` header.
+        """
+        system_message = dedent(system_message)
+        user_message = dedent(user_message)
+        estimated_tokens = estimate_tokens(system_message) + estimate_tokens(
+            user_message
+        )
+        exception = None
+        for attempt in range(attempts):
+            try:
+                async with semaphore:
+                    with span(
+                        "openai.completion",
+                        model=model,
+                        response=response_format.__name__,
+                        estimated_input_tokens=estimated_tokens,
+                    ), track_upstream("openai"):
+                        completion = await client.beta.chat.completions.parse(
+                            model=model,
+                            messages=[
+                                {"role": "system", "content": system_message},
+                                {"role": "user", "content": user_message},
+                            ],
+                            response_format=response_format,
+                        )
+                self._record_usage(model, completion, response_format, estimated_tokens)
+                parsed = completion.choices[0].message.parsed
+                if parsed is None:
+                    raise OpenAIInterfaceException("The model returned no output.")
+                return parsed
+            except RETRYABLE_ERRORS as e:
+                exception = e
+                if attempt + 1 >= attempts:
+                    break
+                delay = backoff_delay(attempt, _retry_after(e))
+                self.logger.warning(
+                    "Error generating message, retrying in %.2f s: %s", delay, e
+                )
+                await asyncio.sleep(delay)
+            except Exception as e:  # pylint: disable=broad-except
+                exception = e
+                break
+        self.logger.error("Error generating message: %s", exception)
+        raise OpenAIInterfaceException(
+            f"Error generating message: {exception}"
+        ) from exception
+
     def _get_message(
         self,
         system_message: str,
@@ -127,19 +401,62 @@ class OpenAIInterface:
             str: The generated message.
         """
         try:
-            completion = self.client.beta.chat.completions.parse(
-                model=model,
-                messages=[
-                    {"role": "system", "content": dedent(system_message)},
-                    {"role": "user", "content": dedent(user_message)},
-                ],
-                response_format=response_format,
+            system_message = dedent(system_message)
+            user_message = dedent(user_message)
+            estimated_tokens = estimate_tokens(system_message) + estimate_tokens(
+                user_message
             )
+            with span(
+                "openai.completion",
+                model=model,
+                response=response_format.__name__,
+                estimated_input_tokens=estimated_tokens,
+            ), track_upstream("openai"):
+                completion = self.client.beta.chat.completions.parse(
+                    model=model,
+                    messages=[
+                        {"role": "system", "content": system_message},
+                        {"role": "user", "content": user_message},
+                    ],
+                    response_format=response_format,
+                )
+            self._record_usage(model, completion, response_format, estimated_tokens)
             return completion.choices[0].message.parsed
         except Exception as e:
-            self.logger.error(f"Error generating message: {e}")
+            self.logger.error("Error generating message: %s", e)
             raise OpenAIInterfaceException(f"Error generating message: {e}") from e
 
+    def _record_usage(
+        self,
+        model: str,
+        completion,
+        response_format: type[BaseModel],
+        estimated_tokens: int,
+    ) -> None:
+        """
+        Logs the token usage of a completion and adds it to the token counters.
+        """
+        usage = getattr(completion, "usage", None)
+        if usage is None:
+            self.logger.info(
+                "%s completion with %s: ~%s input tokens.",
+                response_format.__name__,
+                model,
+                estimated_tokens,
+            )
+            return
+        self.logger.info(
+            "%s completion with %s: %s prompt and %s completion tokens "
+            "(estimated input %s).",
+            response_format.__name__,
+            model,
+            usage.prompt_tokens,
+            usage.completion_tokens,
+            estimated_tokens,
+        )
+        OPENAI_TOKENS.inc(model, "prompt", amount=usage.prompt_tokens)
+        OPENAI_TOKENS.inc(model, "completion", amount=usage.completion_tokens)
+
     def _validate_preset_output(self, output: LightPresetModel) -> bool:
         """
         Validate the generated output using an additional GPT call.
@@ -150,8 +467,7 @@ class OpenAIInterface:
         Returns:
             bool: True if the output is valid, False otherwise.
         """
-        schema = output.__class__.model_json_schema()
-        schema_json = json.dumps(schema, indent=2)
+        schema_json = _compact_schema(output.__class__)
 
         validation_prompt = f"""
         You are a data validation assistant.
@@ -179,7 +495,7 @@ class OpenAIInterface:
         try:
             response: ValidationModel = self._get_message(
                 validation_prompt,
-                output.model_dump_json(indent=2),
+                output.model_dump_json(exclude_none=True),
                 ValidationModel,
                 model="gpt-4o-mini",
             )
@@ -0,0 +1,187 @@
+"""
+Pydantic models for lamp settings and presets, shared by the OpenAI interface
+and the HTTP API. Kept apart from `openai_interface` so the web app can
+validate requests without importing the OpenAI client.
+"""
+
+import re
+from typing import List, Literal, Optional, Union
+
+from pydantic import BaseModel, Field, field_validator, model_validator
+
+HEX_COLOR = re.compile(r"^#[0-9a-fA-F]{6}$")
+MIN_TEMPERATURE = 2700
+MAX_TEMPERATURE = 6500
+
+
+class EmotionalResponses(BaseModel):
+    emotional_responses: list[str]
+
+
+class ColorSetting(BaseModel):
+    type: Literal["color"] = "color"
+    setting: str = Field(...)
+    brightness: int = Field(...)
+
+
+class TempSetting(BaseModel):
+    type: Literal["temp"] = "temp"
+    setting: int = Field(...)
+    brightness: int = Field(...)
+
+
+class Preset(BaseModel):
+    type: Literal["color", "temp"] = Field(..., description="Type of the preset")
+    name: str = Field(..., description="Name of the preset")
+    # Optional fields for color and temp presets
+    value_color: Optional[List[ColorSetting]] = Field(
+        None, description="List of color settings"
+    )
+    value_temp: Optional[TempSetting] = Field(None, description="Temperature setting")
+
+
+class LightPresetModel(BaseModel):
+    presets: List[Preset]
+
+
+class ValidationModel(BaseModel):
+    validation: Literal["VALID", "INVALID"] = Field(...)
+    explanation: str = Field(...)
+
+
+def setting_errors(setting: ColorSetting | TempSetting) -> List[str]:
+    """
+    Checks the values of a single lamp setting.
+
+    Args:
+        setting (ColorSetting | TempSetting): The setting to check.
+
+    Returns:
+        List[str]: The problems found, empty for a valid setting.
+    """
+    errors = []
+    if setting.type == "temp":
+        if not MIN_TEMPERATURE <= setting.setting <= MAX_TEMPERATURE:
+            errors.append(f"temperature {setting.setting} out of range")
+    elif not HEX_COLOR.match(setting.setting):
+        errors.append(f"{setting.setting!r} is not a HEX color")
+    if not 0 <= setting.brightness <= 100:
+        errors.append(f"brightness {setting.brightness} out of range")
+    return errors
+
+
+def preset_errors(preset: Preset) -> List[str]:
+    """
+    Checks a generated preset against the rules given to the validation
+    model, without a model call.
+
+    Args:
+        preset (Preset): The preset to check.
+
+    Returns:
+        List[str]: The problems found, empty for a valid preset.
+    """
+    errors = []
+    if preset.type == "temp":
+        if preset.value_temp is None:
+            errors.append("temp preset without value_temp")
+        else:
+            errors.extend(setting_errors(preset.value_temp))
+    else:
+        if not preset.value_color:
+            errors.append("color preset without value_color")
+        for setting in preset.value_color or []:
+            errors.extend(setting_errors(setting))
+    return errors
+
+
+class LampTarget(BaseModel):
+    """
+    The state one lamp should be put in: off, or on with an optional color or
+    color temperature setting.
+    """
+
+    lamp_id: int = Field(..., description="ID of the lamp")
+    on: bool = Field(True, description="False turns the lamp off")
+    setting: Optional[Union[ColorSetting, TempSetting]] = Field(
+        None, discriminator="type", description="Color or temperature to set"
+    )
+
+    @field_validator("setting")
+    @classmethod
+    def _check_setting(cls, setting):
+        if setting is not None:
+            errors = setting_errors(setting)
+            if errors:
+                raise ValueError("; ".join(errors))
+        return setting
+
+    @model_validator(mode="after")
+    def _check_off(self):
+        if not self.on and self.setting is not None:
+            raise ValueError("a lamp that is turned off takes no setting")
+        return self
+
+
+class LampBatch(BaseModel):
+    targets: List[LampTarget] = Field(..., min_length=1)
+
+    @field_validator("targets")
+    @classmethod
+    def _check_unique(cls, targets):
+        lamp_ids = [target.lamp_id for target in targets]
+        if len(set(lamp_ids)) != len(lamp_ids):
+            raise ValueError("every lamp may only be targeted once")
+        return targets
+
+
+class ZoneSpec(BaseModel):
+    name: str = Field(..., min_length=1, max_length=50)
+
+
+class ZoneLamps(BaseModel):
+    lamp_ids: List[int] = Field(..., min_length=1, description="Lamps to move")
+    zone_id: Optional[int] = Field(..., description="Zone, or None for no zone")
+
+
+class PresetZone(BaseModel):
+    zone_id: Optional[int] = Field(..., description="Zone, or None for all lamps")
+
+
+WEEKDAYS = ("mon", "tue", "wed", "thu", "fri", "sat", "sun")
+TIME_OF_DAY = re.compile(r"^([01][0-9]|2[0-3]):[0-5][0-9]$")
+MAX_TRANSITION_MS = 10 * 60 * 1000
+
+
+class ScheduleSpec(BaseModel):
+    """
+    A schedule as created or replaced through the HTTP API.
+    """
+
+    name: str = Field(..., min_length=1, max_length=50)
+    action: Literal["preset", "off"] = Field("preset")
+    preset_id: Optional[int] = Field(None, description="Preset to apply")
+    zone_id: Optional[int] = Field(None, description="Zone, or all lamps")
+    trigger: Literal["time", "sunrise", "sunset"] = Field(...)
+    time: Optional[str] = Field(None, description="Local time as HH:MM")
+    offset_minutes: int = Field(0, ge=-720, le=720)
+    weekdays: List[Literal[WEEKDAYS]] = Field(  # type: ignore[valid-type]
+        list(WEEKDAYS), min_length=1
+    )
+    transition_ms: int = Field(0, ge=0, le=MAX_TRANSITION_MS)
+    enabled: bool = Field(True)
+
+    @model_validator(mode="after")
+    def _check_trigger(self):
+        if self.trigger == "time":
+            if self.time is None or not TIME_OF_DAY.match(self.time):
+                raise ValueError("a time trigger needs a time as HH:MM")
+            if self.offset_minutes:
+                raise ValueError("only sunrise and sunset take an offset")
+        elif self.time is not None:
+            raise ValueError(f"a {self.trigger} trigger takes no time")
+        if self.action == "preset" and self.preset_id is None:
+            raise ValueError("a preset schedule needs a preset_id")
+        if self.action == "off" and self.preset_id is not None:
+            raise ValueError("a schedule that turns lamps off takes no preset")
+        return self
@@ -0,0 +1,487 @@
+"""
+An asyncio-native interface for the Tapo L530 lamp, next to the PyP100 based
+`TapoLampInterface`.
+
+It speaks the KLAP protocol of current firmware itself, over one
+`httpx.AsyncClient` per event loop. Any number of lamps can be driven from a
+single loop through a pool of keep-alive connections, instead of a thread and
+a `requests` session per lamp. Sessions are kept in the same encrypted store
+as the PyP100 sessions, so the two drivers can take over each other's
+sessions. The store is written when a session starts and then once every
+SEQ_LEASE requests, not after every request. Everything that blocks, the
+store, the key derivation and the rate limit files, runs in worker threads,
+so it never stalls the other lamps on the loop.
+
+With `TAPO_DRIVER=async`, `connect_bulb` returns a `BlockingTapoLampInterface`,
+which runs this driver on a background event loop for the threaded services.
+"""
+
+import asyncio
+import base64
+import contextvars
+import hashlib
+import json
+import os
+import threading
+import time
+import weakref
+from concurrent.futures import Future
+from http.cookiejar import CookieJar, DefaultCookiePolicy
+from typing import Any, Dict, Optional, Tuple
+
+import httpx
+from Crypto.Cipher import AES
+from Crypto.Util.Padding import pad, unpad
+
+from interfaces.tapo_lamp_interface import (
+    DEVICE_COMMAND_DURATION,
+    DEVICE_COMMAND_ERRORS,
+    DEVICE_SESSIONS,
+    device_properties,
+    device_rate_limiter,
+    session_expiry,
+)
+from logging_config import get_logger
+from settings import get_settings
+from tracing import span
+from utils.color_translate import hex_to_rgb, rgb_to_hsv
+from utils.rate_limit import READ_OPERATIONS
+from utils.session_store import decode_bytes, encode_bytes, session_store
+
+REQUEST_TIMEOUT = 2.0
+# Error code of a request in a session the lamp has dropped
+SESSION_EXPIRED = 9999
+MAX_SEQ = 2**31 - 1
+# Sequence numbers reserved in the store at a time. A client restoring the
+# session continues after them, so no number is used twice.
+SEQ_LEASE = 256
+
+# The transport of new clients, replaced by the benchmark fakes
+transport: Optional[httpx.AsyncBaseTransport] = None
+
+_clients: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, httpx.AsyncClient]"
+_clients = weakref.WeakKeyDictionary()
+
+
+class TapoError(Exception):
+    pass
+
+
+class TapoSessionError(TapoError):
+    pass
+
+
+def _sha1(data: bytes) -> bytes:
+    return hashlib.sha1(data).digest()
+
+
+def _sha256(data: bytes) -> bytes:
+    return hashlib.sha256(data).digest()
+
+
+def _wrap_seq(seq: int) -> int:
+    # Into the signed 32 bit range, the way `KlapSession.encrypt` wraps
+    return (seq + 2**31) % 2**32 - 2**31
+
+
+def auth_hash(username: str, password: str) -> bytes:
+    return _sha256(_sha1(username.encode("utf-8")) + _sha1(password.encode("utf-8")))
+
+
+def get_client() -> httpx.AsyncClient:
+    """
+    The HTTP client shared by all lamps of the running event loop. Cookies
+    are not kept by the client, every lamp sends its own session cookie.
+    """
+    loop = asyncio.get_running_loop()
+    client = _clients.get(loop)
+    if client is None or client.is_closed:
+        limit = get_settings().device_concurrency
+        client = _clients[loop] = httpx.AsyncClient(
+            transport=transport,
+            timeout=REQUEST_TIMEOUT,
+            limits=httpx.Limits(
+                max_connections=limit, max_keepalive_connections=limit
+            ),
+            cookies=CookieJar(policy=DefaultCookiePolicy(allowed_domains=[])),
+        )
+    return client
+
+
+def _session_cookies(response: httpx.Response) -> Dict[str, str]:
+    # The lamp sends e.g. "TP_SESSIONID=...;TIMEOUT=86400" as a single cookie
+    cookies = {}
+    for header in response.headers.get_list("set-cookie"):
+        for part in header.split(";"):
+            name, _, value = part.strip().partition("=")
+            if name and value:
+                cookies[name] = value
+    return cookies
+
+
+class KlapSession:
+    """
+    The keys and sequence number of a KLAP session.
+    """
+
+    def __init__(
+        self,
+        key: bytes,
+        iv: bytes,
+        seq: int,
+        sig: bytes,
+        cookies: Dict[str, str],
+        expires_at: float,
+    ) -> None:
+        self.key = key
+        self.iv = iv
+        self.seq = seq
+        self.sig = sig
+        self.cookies = cookies
+        self.expires_at = expires_at
+
+    @classmethod
+    def derive(
+        cls, local_seed: bytes, remote_seed: bytes, auth: bytes, cookies: dict
+    ) -> "KlapSession":
+        seeds = local_seed + remote_seed + auth
+        iv = _sha256(b"iv" + seeds)
+        return cls(
+            key=_sha256(b"lsk" + seeds)[:16],
+            iv=iv[:12],
+            seq=int.from_bytes(iv[-4:], "big", signed=True),
+            sig=_sha256(b"ldk" + seeds)[:28],
+            cookies=cookies,
+            expires_at=session_expiry(cookies),
+        )
+
+    @classmethod
+    def from_stored(cls, stored: Dict[str, Any]) -> "KlapSession":
+        return cls(
+            key=decode_bytes(stored["key"]),
+            iv=decode_bytes(stored["iv"]),
+            seq=int(stored["seq"]),
+            sig=decode_bytes(stored["sig"]),
+            cookies=dict(stored["cookies"]),
+            expires_at=float(stored["expires_at"]),
+        )
+
+    def to_stored(self) -> Dict[str, Any]:
+        return {
+            "key": encode_bytes(self.key),
+            "iv": encode_bytes(self.iv),
+            "seq": self.seq,
+            "sig": encode_bytes(self.sig),
+            "cookies": self.cookies,
+            "expires_at": self.expires_at,
+        }
+
+    @property
+    def cookie_header(self) -> Dict[str, str]:
+        session_id = self.cookies.get("TP_SESSIONID")
+        return {"Cookie": f"TP_SESSIONID={session_id}"} if session_id else {}
+
+    def _cipher(self, seq: int):
+        iv = self.iv + seq.to_bytes(4, "big", signed=True)
+        return AES.new(self.key, AES.MODE_CBC, iv)
+
+    def encrypt(self, payload: bytes) -> Tuple[int, bytes]:
+        """
+        Encrypts a request with the next sequence number.
+        Returns:
+            tuple: The sequence number and the signed request body.
+        """
+        self.seq = self.seq + 1 if self.seq < MAX_SEQ else -MAX_SEQ - 1
+        ciphertext = self._cipher(self.seq).encrypt(pad(payload, AES.block_size))
+        seq = self.seq.to_bytes(4, "big", signed=True)
+        return self.seq, _sha256(self.sig + seq + ciphertext) + ciphertext
+
+    def decrypt(self, seq: int, body: bytes) -> bytes:
+        # The response starts with a 32 byte signature
+        return unpad(self._cipher(seq).decrypt(body[32:]), AES.block_size)
+
+
+class AsyncTapoLampInterface:
+    """
+    The operations of `TapoLampInterface` as coroutines. Use `connect` to
+    create one.
+    """
+
+    def __init__(self, lamp_ip: str, username: str, password: str):
+        self.logger = get_logger(self.__class__)
+        self.ip = lamp_ip
+        self._auth = auth_hash(username or "", password or "")
+        self._session: Optional[KlapSession] = None
+        self._restored = False
+        # Requests left before the stored sequence number is reached
+        self._lease_left = 0
+        # Requests of one session go out one at a time, in sequence order
+        self._lock = asyncio.Lock()
+        self.deviceProperties: Dict[str, Any] = {}
+
+    @classmethod
+    async def connect(
+        cls, lamp_ip: str, username: str, password: str
+    ) -> "AsyncTapoLampInterface":
+        lamp = cls(lamp_ip, username, password)
+        with span("tapo.connect", ip=lamp_ip) as connect_span:
+            restored = await asyncio.to_thread(lamp._restoreSession)
+            connect_span.set_attribute("session_restored", restored)
+            lamp.deviceProperties = await lamp.getDeviceProperties()
+        return lamp
+
+    def _url(self, path: str) -> str:
+        return f"http://{self.ip}/app/{path}"
+
+    def _restoreSession(self) -> bool:
+        store = session_store()
+        if store is None:
+            return False
+        stored = store.load(self.ip)
+        if stored is None:
+            return False
+        if stored.get("expires_at", 0) <= time.time():
+            store.delete(self.ip)
+            return False
+        try:
+            self._session = KlapSession.from_stored(stored)
+        except (KeyError, TypeError, ValueError) as e:
+            self.logger.warning("Could not restore the session of %s: %s", self.ip, e)
+            store.delete(self.ip)
+            return False
+        self._restored = True
+        DEVICE_SESSIONS.inc(self.ip, "restored")
+        return True
+
+    async def _storeSession(self) -> None:
+        store = session_store()
+        if store is None or self._session is None:
+            return
+        stored = self._session.to_stored()
+        stored["seq"] = _wrap_seq(self._session.seq + SEQ_LEASE)
+        await asyncio.to_thread(store.save, self.ip, stored)
+        self._lease_left = SEQ_LEASE
+
+    async def _handshake(self) -> None:
+        client = get_client()
+        local_seed = os.urandom(16)
+        with span("tapo.handshake", ip=self.ip):
+            response = await client.post(self._url("handshake1"), content=local_seed)
+            response.raise_for_status()
+            remote_seed, server_hash = response.content[:16], response.content[16:]
+            if server_hash != _sha256(local_seed + remote_seed + self._auth):
+                raise TapoError(f"{self.ip} did not accept the credentials")
+            session = KlapSession.derive(
+                local_seed, remote_seed, self._auth, _session_cookies(response)
+            )
+            response = await client.post(
+                self._url("handshake2"),
+                content=_sha256(remote_seed + local_seed + self._auth),
+                headers=session.cookie_header,
+            )
+            response.raise_for_status()
+        self._session = session
+        self._restored = False
+        self._lease_left = 0
+        DEVICE_SESSIONS.inc(self.ip, "handshake")
+
+    async def _send(self, method: str, params: Optional[dict]) -> Any:
+        async with self._lock:
+            if self._session is None:
+                await self._handshake()
+            session = self._session
+            payload = {"method": method}
+            if params:
+                payload["params"] = params
+            seq, body = session.encrypt(json.dumps(payload).encode("utf-8"))
+            self._lease_left -= 1
+            response = await get_client().post(
+                self._url("request"),
+                params={"seq": seq},
+                content=body,
+                headers=session.cookie_header,
+            )
+            if response.status_code in (401, 403):
+                raise TapoSessionError(f"{self.ip} rejected the session")
+            response.raise_for_status()
+            try:
+                data = json.loads(session.decrypt(seq, response.content))
+            except ValueError as e:
+                raise TapoSessionError(f"Unreadable response from {self.ip}") from e
+            error_code = data.get("error_code", 0)
+            if error_code == SESSION_EXPIRED:
+                raise TapoSessionError(f"{self.ip} ended the session")
+            if error_code != 0:
+                raise TapoError(f"{method} to {self.ip} failed: error {error_code}")
+            if self._lease_left <= 0:
+                await self._storeSession()
+            return data.get("result")
+
+    async def _call(self, operation: str, method: str, params: Optional[dict] = None):
+        """
+        Sends a single request and records its latency and errors. A request
+        in a session the lamp dropped is repeated once after a new handshake.
+        A request that changes the lamp's state first waits for the lamp's
+        rate limit.
+        """
+        if operation not in READ_OPERATIONS:
+            await device_rate_limiter().throttle_async(self.ip)
+        start = time.perf_counter()
+        try:
+            with span(f"tapo.{operation}", ip=self.ip):
+                try:
+                    return await self._send(method, params)
+                except TapoSessionError:
+                    if self._restored:
+                        DEVICE_SESSIONS.inc(self.ip, "rejected")
+                    self.logger.info("Session of %s ended, reconnecting", self.ip)
+                    self._session = None
+                    return await self._send(method, params)
+        except Exception:
+            DEVICE_COMMAND_ERRORS.inc(self.ip, operation)
+            raise
+        finally:
+            DEVICE_COMMAND_DURATION.observe(
+                time.perf_counter() - start, self.ip, operation
+            )
+
+    async def _setDeviceInfo(self, operation: str, **params):
+        # Like PyP100, setting the light turns the lamp on, but in the same
+        # request instead of a separate one
+        await self._call(operation, "set_device_info", params)
+
+    async def getDeviceProperties(self):
+        with span("tapo.get_device_properties", ip=self.ip):
+            info = await self._call("get_device_info", "get_device_info")
+            self.logger.debug("Device properties: %s", info)
+            # The name comes with the device info, no second request needed
+            name = base64.b64decode(info.get("nickname", "")).decode("utf-8")
+            return device_properties(info, name)
+
+    async def turnOn(self):
+        await self._setDeviceInfo("turn_on", device_on=True)
+
+    async def turnOff(self):
+        await self._setDeviceInfo("turn_off", device_on=False)
+
+    async def setColor(self, colorHex):
+        hue, saturation, value = rgb_to_hsv(hex_to_rgb(colorHex))
+
+        if self.deviceProperties.get("state") == "Off":
+            await self.turnOn()
+        await self.setHueSaturation(hue, saturation)
+        await self.setBrightness(value)
+
+    async def setHueSaturation(self, hue, saturation):
+        await self._setDeviceInfo(
+            "set_color", device_on=True, hue=hue, saturation=saturation, color_temp=0
+        )
+
+    async def setColorTemperature(self, temperature):
+        await self._setDeviceInfo(
+            "set_color_temp", device_on=True, color_temp=temperature
+        )
+
+    async def setBrightness(self, brightness):
+        if brightness == 0:
+            await self.turnOff()
+            return
+
+        await self._setDeviceInfo(
+            "set_brightness", device_on=True, brightness=brightness
+        )
+
+    async def setTemperature(self, temperature, brightness):
+        await self.setColorTemperature(temperature)
+        await self.setBrightness(brightness)
+
+
+class DeviceLoop:
+    """
+    An event loop in a daemon thread, shared by all threads of the worker,
+    which run coroutines on it and wait for their results.
+    """
+
+    def __init__(self) -> None:
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+
+    def _get_loop(self) -> asyncio.AbstractEventLoop:
+        with self._lock:
+            if self._loop is None:
+                self._loop = asyncio.new_event_loop()
+                self._thread = threading.Thread(
+                    target=self._loop.run_forever, name="device-loop", daemon=True
+                )
+                self._thread.start()
+            return self._loop
+
+    def run(self, coroutine):
+        """
+        Runs a coroutine on the loop, in a copy of the caller's context so
+        spans join the caller's trace, and returns its result.
+        """
+        loop = self._get_loop()
+        if threading.current_thread() is self._thread:
+            coroutine.close()
+            raise RuntimeError("DeviceLoop.run would block its own loop")
+        context = contextvars.copy_context()
+        future: Future = Future()
+
+        def copy_outcome(task: asyncio.Task) -> None:
+            if task.cancelled():
+                future.cancel()
+            elif task.exception() is not None:
+                future.set_exception(task.exception())
+            else:
+                future.set_result(task.result())
+
+        def start() -> None:
+            loop.create_task(coroutine, context=context).add_done_callback(
+                copy_outcome
+            )
+
+        loop.call_soon_threadsafe(start)
+        return future.result()
+
+
+device_loop = DeviceLoop()
+
+
+class BlockingTapoLampInterface:
+    """
+    `TapoLampInterface` backed by the async driver. Every call blocks the
+    calling thread while the request runs on the shared device loop.
+    """
+
+    def __init__(self, lamp_ip: str, username: str, password: str):
+        self.ip = lamp_ip
+        self.lamp: AsyncTapoLampInterface = device_loop.run(
+            AsyncTapoLampInterface.connect(lamp_ip, username, password)
+        )
+        self.deviceProperties = self.lamp.deviceProperties
+
+    def getDeviceProperties(self):
+        return device_loop.run(self.lamp.getDeviceProperties())
+
+    def turnOn(self):
+        device_loop.run(self.lamp.turnOn())
+
+    def turnOff(self):
+        device_loop.run(self.lamp.turnOff())
+
+    def setColor(self, colorHex):
+        device_loop.run(self.lamp.setColor(colorHex))
+
+    def setHueSaturation(self, hue, saturation):
+        device_loop.run(self.lamp.setHueSaturation(hue, saturation))
+
+    def setColorTemperature(self, temperature):
+        device_loop.run(self.lamp.setColorTemperature(temperature))
+
+    def setBrightness(self, brightness):
+        device_loop.run(self.lamp.setBrightness(brightness))
+
+    def setTemperature(self, temperature, brightness):
+        device_loop.run(self.lamp.setTemperature(temperature, brightness))
@@ -1,10 +1,21 @@
 """
 This module is an interface for the Tapo L530 lamp.
+
+The session negotiated with a lamp (the KLAP key, IV, sequence number,
+signature key and session cookie) is kept in an encrypted store under
+db/sessions. A new client for the lamp, also in another worker or after a
+restart, reuses it until it expires instead of repeating the handshake.
 """
 
+import time
+from functools import cache
+
 from PyP100 import PyL530
 
 from logging_config import get_logger
+from metrics import counter, histogram
+from settings import get_settings
+from tracing import span
 from utils.color_translate import (
     hex_to_rgb,
     hsv_to_rgb,
@@ -12,54 +23,222 @@ from utils.color_translate import (
     rgb_to_hsv,
     tuple_to_rgb_string,
 )
+from utils.rate_limit import READ_OPERATIONS, DeviceRateLimiter
+from utils.session_store import decode_bytes, encode_bytes, session_store
+
+try:
+    from PyP100 import auth_protocol
+except ImportError:  # pragma: no cover - releases without the KLAP protocol
+    auth_protocol = None
+
+# Lamps end a session after a day unless the cookie says otherwise. A stored
+# session is only reused well before that.
+DEFAULT_SESSION_TTL = 86400
+SESSION_EXPIRY_MARGIN = 600
+
+DEVICE_COMMAND_DURATION = histogram(
+    "luminasync_device_command_duration_seconds",
+    "Round trip time of commands sent to a lamp, including session setup.",
+    ["ip", "operation"],
+)
+DEVICE_COMMAND_ERRORS = counter(
+    "luminasync_device_command_errors_total",
+    "Commands sent to a lamp that raised an error.",
+    ["ip", "operation"],
+)
+DEVICE_SESSIONS = counter(
+    "luminasync_device_sessions_total",
+    "Device sessions by how they were set up: restored from the store, "
+    "rejected by the lamp after a restore, or a new handshake.",
+    ["ip", "outcome"],
+)
+
+
+@cache
+def device_rate_limiter() -> DeviceRateLimiter:
+    settings = get_settings()
+    return DeviceRateLimiter(
+        settings.device_command_rate, settings.device_command_burst
+    )
+
+
+def export_session(bulb) -> dict | None:
+    """
+    The material of the bulb's KLAP session, or None without one.
+    """
+    protocol = getattr(bulb, "protocol", None)
+    if protocol is None or not getattr(protocol, "key", None):
+        return None
+    if not all(hasattr(protocol, name) for name in ("iv", "seq", "sig", "session")):
+        return None
+    return {
+        "key": encode_bytes(protocol.key),
+        "iv": encode_bytes(protocol.iv),
+        "seq": protocol.seq,
+        "sig": encode_bytes(protocol.sig),
+        "cookies": protocol.session.cookies.get_dict(),
+    }
+
+
+def restore_session(bulb, ip: str, username: str, password: str, session: dict):
+    """
+    Gives the bulb a KLAP protocol with the stored session material, so its
+    next request skips the handshake.
+    """
+    protocol = auth_protocol.AuthProtocol(ip, username, password)
+    protocol.key = decode_bytes(session["key"])
+    protocol.iv = decode_bytes(session["iv"])
+    protocol.seq = int(session["seq"])
+    protocol.sig = decode_bytes(session["sig"])
+    protocol.session.cookies.update(session["cookies"])
+    bulb.protocol = protocol
+
+
+def session_expiry(cookies: dict) -> float:
+    """
+    When a session negotiated now should no longer be reused.
+    """
+    try:
+        ttl = int(cookies.get("TIMEOUT", DEFAULT_SESSION_TTL))
+    except (TypeError, ValueError):
+        ttl = DEFAULT_SESSION_TTL
+    return time.time() + ttl - SESSION_EXPIRY_MARGIN
+
+
+def device_properties(info: dict, name: str) -> dict:
+    """
+    The lamp state as stored in the database, from the device info.
+    """
+    brightness = info.get("brightness")
+    color_temp = info.get("color_temp")
+    hue_value = info.get("hue") if color_temp == 0 else 0
+    saturation = info.get("saturation") if color_temp == 0 else 0
+    rgb_value = hsv_to_rgb(hue_value, saturation, brightness)
+    hex_value = rgb_to_hex(rgb_value)
+
+    return {
+        "name": name,
+        "state": "On" if info.get("device_on") else "Off",
+        "color_temp": color_temp,
+        "brightness": brightness,
+        "hue": hue_value,
+        "saturation": saturation,
+        "rgb": tuple_to_rgb_string(rgb_value),
+        "hex": hex_value,
+    }
 
 
 class TapoLampInterface:
     def __init__(self, lamp_ip: str, username: str, password: str):
         self.logger = get_logger(self.__class__)
         self.ip = lamp_ip
-        self.bulb = PyL530.L530(lamp_ip, username, password)
-        self.deviceProperties = self.getDeviceProperties()
+        # The stored session this client uses, if any
+        self._session: dict | None = None
+        with span("tapo.connect", ip=lamp_ip) as connect_span:
+            self.bulb = PyL530.L530(lamp_ip, username, password)
+            restored = self._restoreSession(username, password)
+            connect_span.set_attribute("session_restored", restored)
+            try:
+                self.deviceProperties = self.getDeviceProperties()
+            except Exception:
+                if not restored:
+                    raise
+                # The lamp no longer knows the session, e.g. after a power cycle
+                self.logger.info("Stored session of %s was rejected", lamp_ip)
+                DEVICE_SESSIONS.inc(lamp_ip, "rejected")
+                session_store().delete(lamp_ip)
+                self._session = None
+                self.bulb.protocol = None
+                self.deviceProperties = self.getDeviceProperties()
+
+    def _restoreSession(self, username: str, password: str) -> bool:
+        store = session_store()
+        if store is None or auth_protocol is None:
+            return False
+        session = store.load(self.ip)
+        if session is None:
+            return False
+        if session.get("expires_at", 0) <= time.time():
+            store.delete(self.ip)
+            return False
+        try:
+            restore_session(self.bulb, self.ip, username, password, session)
+        except (AttributeError, KeyError, TypeError, ValueError) as e:
+            self.logger.warning("Could not restore the session of %s: %s", self.ip, e)
+            store.delete(self.ip)
+            return False
+        self._session = session
+        DEVICE_SESSIONS.inc(self.ip, "restored")
+        return True
+
+    def _storeSession(self):
+        """
+        Stores the session after a successful command, with its sequence
+        number, so the next client continues where this one stopped.
+        """
+        store = session_store()
+        if store is None:
+            return
+        session = export_session(self.bulb)
+        if session is None:
+            return
+        if self._session is None or self._session["key"] != session["key"]:
+            DEVICE_SESSIONS.inc(self.ip, "handshake")
+            session["expires_at"] = session_expiry(session["cookies"])
+        else:
+            session["expires_at"] = self._session["expires_at"]
+        self._session = session
+        store.save(self.ip, session)
+
+    def _call(self, operation: str, command, *args):
+        """
+        Sends a single command to the bulb and records its latency and errors.
+        A command that changes the lamp's state first waits for the lamp's
+        rate limit, which is not part of the recorded latency.
+        """
+        if operation not in READ_OPERATIONS:
+            device_rate_limiter().throttle(self.ip)
+        start = time.perf_counter()
+        try:
+            with span(f"tapo.{operation}", ip=self.ip):
+                result = command(*args)
+            self._storeSession()
+            return result
+        except Exception:
+            DEVICE_COMMAND_ERRORS.inc(self.ip, operation)
+            raise
+        finally:
+            DEVICE_COMMAND_DURATION.observe(
+                time.perf_counter() - start, self.ip, operation
+            )
 
     def _getStatus(self):
-        return self.bulb.getDeviceInfo()
+        return self._call("get_device_info", self.bulb.getDeviceInfo)
 
     def _getName(self):
-        return self.bulb.getDeviceName()
+        return self._call("get_device_name", self.bulb.getDeviceName)
 
     def _setBrightness(self, brightness):
         if brightness == 0:
             self.turnOff()
             return
 
-        self.bulb.setBrightness(brightness)
+        self._call("set_brightness", self.bulb.setBrightness, brightness)
 
     def getDeviceProperties(self):
+        with span("tapo.get_device_properties", ip=self.ip):
+            return self._readDeviceProperties()
+
+    def _readDeviceProperties(self):
         deviceProperties: dict = self._getStatus()
-        self.logger.debug(f"Device properties: {deviceProperties}")
-        brightness = deviceProperties.get("brightness")
-        color_temp = deviceProperties.get("color_temp")
-        hue_value = deviceProperties.get("hue") if color_temp == 0 else 0
-        saturation = deviceProperties.get("saturation") if color_temp == 0 else 0
-        rgb_value = hsv_to_rgb(hue_value, saturation, brightness)
-        hex_value = rgb_to_hex(rgb_value)
-
-        return {
-            "name": self._getName(),
-            "state": "On" if deviceProperties.get("device_on") else "Off",
-            "color_temp": color_temp,
-            "brightness": brightness,
-            "hue": hue_value,
-            "saturation": saturation,
-            "rgb": tuple_to_rgb_string(rgb_value),
-            "hex": hex_value,
-        }
+        self.logger.debug("Device properties: %s", deviceProperties)
+        return device_properties(deviceProperties, self._getName())
 
     def turnOn(self):
-        self.bulb.turnOn()
+        self._call("turn_on", self.bulb.turnOn)
 
     def turnOff(self):
-        self.bulb.turnOff()
+        self._call("turn_off", self.bulb.turnOff)
 
     def setColor(self, colorHex):
         rgb = hex_to_rgb(colorHex)
@@ -67,9 +246,18 @@ class TapoLampInterface:
 
         if self.deviceProperties["state"] == "Off":
             self.turnOn()
-        self.bulb.setColor(hue, saturation)
+        self._call("set_color", self.bulb.setColor, hue, saturation)
         self._setBrightness(value)
 
+    def setHueSaturation(self, hue, saturation):
+        self._call("set_color", self.bulb.setColor, hue, saturation)
+
+    def setColorTemperature(self, temperature):
+        self._call("set_color_temp", self.bulb.setColorTemp, temperature)
+
+    def setBrightness(self, brightness):
+        self._setBrightness(brightness)
+
     def setTemperature(self, temperature, brightness):
-        self.bulb.setColorTemp(temperature)
+        self._call("set_color_temp", self.bulb.setColorTemp, temperature)
         self._setBrightness(brightness)
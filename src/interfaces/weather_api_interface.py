@@ -3,6 +3,8 @@ from datetime import datetime
 import requests
 
 from logging_config import get_logger
+from metrics import track_upstream
+from utils.upstream_client import upstream_client
 
 
 class WeatherAPIInterfaceException(Exception):
@@ -28,11 +30,13 @@ class WeatherAPIInterface:
         try:
             # Make the API call
             self.logger.info("Fetching weather data.")
-            self.logger.debug(f"URL: {url}")
-            self.logger.debug(f"Params: {params}")
-            response = requests.get(url, params=params, timeout=30)
-            data = response.json()
-            self.logger.debug(f"Response: {data}")
+            self.logger.debug("URL: %s", url)
+            self.logger.debug("Params: %s", params)
+            with track_upstream("open-meteo"):
+                response = upstream_client().get(url, params=params, timeout=30)
+                response.raise_for_status()
+                data = response.json()
+            self.logger.debug("Response: %s", data)
 
             # Extract hourly data
             hourly_forecast = data["hourly"]
@@ -52,7 +56,7 @@ class WeatherAPIInterface:
                 "rain": total_rain,
             }
         except requests.exceptions.RequestException as e:
-            self.logger.error(f"Error fetching weather data: {e}")
+            self.logger.error("Error fetching weather data: %s", e)
             raise WeatherAPIInterfaceException(
                 f"Error fetching weather data: {e}"
             ) from e
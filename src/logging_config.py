@@ -1,43 +1,150 @@
+import atexit
+import copy
+import json
 import logging
 import os
+import queue
+import random
 import sys
-from logging.handlers import RotatingFileHandler
+from logging.handlers import (
+    QueueHandler,
+    QueueListener,
+    RotatingFileHandler,
+    WatchedFileHandler,
+)
 
 from colorlog import ColoredFormatter
 
+from settings import get_settings
+from tracing import TraceContextFilter
+
+_listener: QueueListener | None = None
+
+
+class JSONFormatter(logging.Formatter):
+    """
+    Formats records as single line JSON objects for log shippers.
+    """
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "time": self.formatTime(record, "%Y-%m-%dT%H:%M:%S"),
+            "level": record.levelname,
+            "logger": record.name,
+            "location": f"{record.filename}:{record.lineno}",
+            "trace_id": getattr(record, "trace_id", "-"),
+            "span_id": getattr(record, "span_id", "-"),
+            "message": record.getMessage(),
+        }
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            entry["exception"] = record.exc_text
+        return json.dumps(entry, default=str)
+
+
+class DeferredFormattingQueueHandler(QueueHandler):
+    """
+    Queues records for the listener thread without formatting them.
+
+    `QueueHandler.prepare` formats the record in the calling thread, merges
+    the traceback into the message and drops `exc_info`, which suits a queue
+    to another process. The listener runs in this process, so only the
+    message arguments are merged here, in case they change later, and the
+    exception is left for the formatters on the listener thread.
+    """
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+
+class SamplingFilter(logging.Filter):
+    """
+    Keeps only a fraction of the records below WARNING for configured loggers.
+    Rates are matched on the most specific logger name prefix, so
+    "LuminaSync.TapoLampInterface=0.1" keeps one in ten device log records
+    while other loggers are unaffected. Warnings and errors are never dropped.
+    """
+
+    def __init__(self, rates: dict[str, float]) -> None:
+        super().__init__()
+        # Longest prefixes first so the most specific rule wins
+        self.rates = sorted(rates.items(), key=lambda item: len(item[0]), reverse=True)
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno >= logging.WARNING:
+            return True
+        for prefix, rate in self.rates:
+            if record.name == prefix or record.name.startswith(prefix + "."):
+                return rate >= 1 or random.random() < rate
+        return True
+
+
+def _parse_sampling(spec: str) -> dict[str, float]:
+    """
+    Parses "logger=rate,logger=rate" into a dictionary.
+    """
+    rates = {}
+    for entry in spec.split(","):
+        name, _, rate = entry.strip().partition("=")
+        if name and rate:
+            rates[name] = float(rate)
+    return rates
+
 
 def setup_logging():
+    """
+    Sets up the LuminaSync logger.
+
+    Records are put on a queue by the calling thread and formatted, including
+    their tracebacks, and written to the log file and console by a background
+    listener thread, so request handlers never wait on disk or terminal I/O.
+    Set LOG_FORMAT=json for structured file output and LOG_SAMPLING (e.g.
+    "LuminaSync.TapoLampInterface=0.1") to sample high-frequency loggers.
+    """
+    global _listener
     logger = logging.getLogger("LuminaSync")
 
     if not logger.handlers:
+        settings = get_settings()
         # Set loglevel based on DEBUG environment variable
-        loglevel = logging.DEBUG if "DEBUG" in os.environ else logging.INFO
+        loglevel = logging.DEBUG if settings.debug else logging.INFO
 
         logger.setLevel(loglevel)
-        file_handler = RotatingFileHandler(
-            "logs/luminasync.log",
-            maxBytes=10 * 1024 * 1024,  # 10 MB
-            backupCount=5,  # Keep up to 5 backup files
-        )
+        os.makedirs("logs", exist_ok=True)
+        if settings.workers > 1:
+            # Every worker appends to the same file, and rotating it from
+            # several processes would rename it under the others. It is
+            # rotated externally, e.g. by logrotate, and reopened when moved.
+            file_handler = WatchedFileHandler("logs/luminasync.log")
+        else:
+            file_handler = RotatingFileHandler(
+                "logs/luminasync.log",
+                maxBytes=10 * 1024 * 1024,  # 10 MB
+                backupCount=5,  # Keep up to 5 backup files
+            )
         file_handler.setLevel(loglevel)
 
         # Define a formatter for the file handler
-        file_formatter = logging.Formatter(
-            "%(asctime)s - %(levelname)s -  %(name)s - %(filename)s:%(lineno)d - %(message)s",
-            datefmt="%Y-%m-%d %H:%M:%S",
-        )
+        if settings.log_format == "json":
+            file_formatter = JSONFormatter()
+        else:
+            file_formatter = logging.Formatter(
+                "%(asctime)s - %(levelname)s -  %(name)s - %(filename)s:%(lineno)d - [%(trace_id)s] - %(message)s",
+                datefmt="%Y-%m-%d %H:%M:%S",
+            )
         file_handler.setFormatter(file_formatter)
 
-        # Add the handler to the logger
-        logger.addHandler(file_handler)
-
         # Create a console handler for logging to the console
         console_handler = logging.StreamHandler(sys.stdout)
         console_handler.setLevel(loglevel)
 
         # Define a colored formatter for the console handler
         console_formatter = ColoredFormatter(
-            "%(log_color)s%(asctime)s - %(name)s - %(levelname)s: %(message)s",
+            "%(log_color)s%(asctime)s - %(name)s - %(levelname)s [%(trace_id)s]: %(message)s",
             datefmt="%Y-%m-%d %H:%M:%S",
             log_colors={
                 "DEBUG": "cyan",
@@ -49,13 +156,38 @@ def setup_logging():
         )
         console_handler.setFormatter(console_formatter)
 
-        # Add both handlers to the logger
-        logger.addHandler(file_handler)
-        logger.addHandler(console_handler)
+        # The queue handler is the only handler on the logger. Filters on it
+        # run in the calling thread, which is where the trace context lives
+        # and where dropping a sampled record saves the most work.
+        queue_handler = DeferredFormattingQueueHandler(queue.SimpleQueue())
+        queue_handler.addFilter(TraceContextFilter())
+        sampling = _parse_sampling(settings.log_sampling)
+        if sampling:
+            queue_handler.addFilter(SamplingFilter(sampling))
+        logger.addHandler(queue_handler)
+
+        _listener = QueueListener(
+            queue_handler.queue,
+            file_handler,
+            console_handler,
+            respect_handler_level=True,
+        )
+        _listener.start()
+        atexit.register(shutdown_logging)
 
         logger.info("Logging is set up.")
 
 
+def shutdown_logging():
+    """
+    Flushes the queued records and stops the background writer thread.
+    """
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
 def get_logger(cls):
     """
     Helper function to get a child logger for a class.
@@ -2,9 +2,16 @@
 """Main module for the application."""
 
 # Standard library imports
+# pylint: disable=wrong-import-position
+import time
+
+# Measure how long the imports below take, reported as a startup phase
+_import_started = time.perf_counter()
+
+import hashlib
 import json
 import logging
-import os
+from datetime import datetime, timedelta, timezone
 from functools import cache
 from typing import Any
 
@@ -30,46 +37,145 @@ from fasthtml.common import (
     Title,
     Ul,
     serve,
+    to_xml,
 )
+from pydantic import BaseModel, ValidationError
 from starlette.exceptions import HTTPException
-from starlette.responses import FileResponse
-from starlette.staticfiles import StaticFiles
+from starlette.responses import FileResponse, HTMLResponse, Response
 from starlette.status import (
     HTTP_200_OK,
+    HTTP_304_NOT_MODIFIED,
     HTTP_400_BAD_REQUEST,
     HTTP_404_NOT_FOUND,
+    HTTP_409_CONFLICT,
     HTTP_500_INTERNAL_SERVER_ERROR,
+    HTTP_503_SERVICE_UNAVAILABLE,
 )
 
 # Local application imports
-from db.models import Lamp, Preset
-from db.session import get_session, seed_db
+# The OpenAI, news and device clients are imported on first use, see
+# `lazy_import`, so they don't delay serving the dashboard after a restart.
+from assets import (
+    PrecompressedStaticFiles,
+    asset_url,
+    asset_version,
+    built_asset_urls,
+)
+from db.models import Lamp
+from db.session import get_session, init_db, seed_db
+from health import health_monitor
+from interfaces.schemas import (
+    MAX_TRANSITION_MS,
+    LampBatch,
+    PresetZone,
+    ScheduleSpec,
+    ZoneLamps,
+    ZoneSpec,
+)
 from logging_config import setup_logging
-from services.preset_service import apply_preset, turn_off_bulbs
-from update_presets import update_presets
+from metrics import CONTENT_TYPE as METRICS_CONTENT_TYPE
+from metrics import REGISTRY, RequestMetricsMiddleware, gauge, register_cache
+from scheduler import scheduler
+from services.lamp_control_service import apply_lamp_targets
+from services.preset_service import (
+    PresetNotFound,
+    ZoneNotFound,
+    apply_to_zones,
+    set_preset_zone,
+    turn_off_bulbs,
+)
+from services.preset_set_service import (
+    PresetSetNotFound,
+    activate_preset_set,
+    get_active_presets,
+    get_preset_sets,
+)
+from services.schedule_service import (
+    ScheduleNotFound,
+    create_schedule,
+    delete_schedule,
+    get_schedules,
+    update_schedule,
+)
+from services.snapshot_service import (
+    SnapshotNotFound,
+    get_snapshots,
+    restore_snapshot,
+    take_snapshot,
+)
+from services.telemetry_service import (
+    InvalidHistoryQuery,
+    get_lamp_history,
+    telemetry,
+    utcnow,
+)
+from services.transition_service import cancel_all as cancel_transitions
+from services.zone_service import (
+    LampNotFound,
+    ZoneNameTaken,
+    assign_lamps_to_zone,
+    create_zone,
+    delete_zone,
+    get_all_zones,
+    rename_zone,
+)
+from settings import get_settings
+from tracing import TracingMiddleware, configure_tracing
+from utils.coordination import GenerationCache
+from utils.lazy_import import lazy_import
+from utils.session_store import prepare_session_store
+
+# pylint: enable=wrong-import-position
 
-# Set up logging
+STARTUP_DURATION = gauge(
+    "luminasync_startup_duration_seconds",
+    "Time spent in each startup phase of this process.",
+    ["phase"],
+)
+_imports_duration = time.perf_counter() - _import_started
+STARTUP_DURATION.set("imports", value=_imports_duration)
+
+# Set up logging and tracing
+_phase_started = time.perf_counter()
 setup_logging()
+configure_tracing()
 logger = logging.getLogger("LuminaSync")
+STARTUP_DURATION.set("logging", value=time.perf_counter() - _phase_started)
 
-# Seed the database
+# Create the tables and seed the database
+_phase_started = time.perf_counter()
+init_db()
 seed_db()
+STARTUP_DURATION.set("database", value=time.perf_counter() - _phase_started)
+
+update_presets_module = lazy_import("update_presets")
 
 # Set up the FastHTML app with some basic configuration
-# All CSS is defined by MaterializeCSS
+# All CSS is defined by MaterializeCSS. The assets are served from the build
+# in public/dist (see build_assets.py), the CDN is only used without a build.
 materialize_fonts_link = Link(
-    href="https://fonts.googleapis.com/icon?family=Material+Icons", rel="stylesheet"
+    href=asset_url(
+        "material-icons.css",
+        "https://fonts.googleapis.com/icon?family=Material+Icons",
+    ),
+    rel="stylesheet",
 )
 materialize_css_link = Link(
-    href="https://cdnjs.cloudflare.com/ajax/libs/materialize/1.0.0/css/materialize.min.css",
+    href=asset_url(
+        "materialize.css",
+        "https://cdnjs.cloudflare.com/ajax/libs/materialize/1.0.0/css/materialize.min.css",
+    ),
     rel="stylesheet",
 )
 materialize_js = Script(
-    src="https://cdnjs.cloudflare.com/ajax/libs/materialize/1.0.0/js/materialize.min.js"
+    src=asset_url(
+        "materialize.js",
+        "https://cdnjs.cloudflare.com/ajax/libs/materialize/1.0.0/js/materialize.min.js",
+    )
 )
 
-custom_css = Link(href="public/css/main.css", rel="stylesheet")
-custom_js = Script(src="public/js/main.js")
+custom_css = Link(href=asset_url("main.css", "public/css/main.css"), rel="stylesheet")
+custom_js = Script(src=asset_url("main.js", "public/js/main.js"))
 favicon = Link(href="public/favicon.ico", rel="icon")
 manifest = Link(href="manifest.webmanifest", rel="manifest")
 
@@ -90,10 +196,29 @@ def get_html_headers():
     )
 
 
-app = FastHTML(default_hdrs=False)
+# The health checks and the telemetry writes run in the background of every
+# worker, see health.py and services/telemetry_service.py
+app = FastHTML(
+    default_hdrs=False,
+    on_startup=[
+        health_monitor.start,
+        telemetry.start,
+        scheduler.start,
+        prepare_session_store,
+    ],
+    on_shutdown=[
+        health_monitor.stop,
+        telemetry.stop,
+        scheduler.stop,
+        cancel_transitions,
+    ],
+)
+app.add_middleware(RequestMetricsMiddleware)
+app.add_middleware(TracingMiddleware)
 rt = app.route
-# Mount the static files directory using Starlette
-app.mount("/public", StaticFiles(directory="public"), name="public")
+# Mount the static files directory, serving precompressed variants of the
+# built assets
+app.mount("/public", PrecompressedStaticFiles(directory="public"), name="public")
 
 
 def wrap_content_in_html(content: Any) -> Any:
@@ -144,9 +269,86 @@ def header_content():
     )
 
 
+# The rendered dashboard, showing the presets and lamp states. The cache is
+# local to this worker and is dropped whenever any worker commits a change to
+# the database.
+dashboard_cache = GenerationCache()
+
+
+def load_dashboard_data() -> tuple[list[dict], list[dict]]:
+    presets = get_active_presets()
+    session = get_session()
+    lamps = [lamp.to_dict() for lamp in session.query(Lamp).order_by(Lamp.id).all()]
+    session.close()
+    return presets, lamps
+
+
+register_cache("html_headers", get_html_headers)
+register_cache("header_content", header_content)
+register_cache("dashboard", dashboard_cache)
+
+
+@rt("/metrics")
+async def serve_metrics():
+    return Response(REGISTRY.render(), media_type=METRICS_CONTENT_TYPE)
+
+
+@rt("/healthz", methods=["get"])
+async def healthz():
+    """
+    Liveness: the worker serves requests and its health checks keep running.
+    """
+    alive = health_monitor.alive
+    return JSONResponse(
+        {"status": "alive" if alive else "health monitor stopped"},
+        status_code=HTTP_200_OK if alive else HTTP_503_SERVICE_UNAVAILABLE,
+    )
+
+
+@rt("/readyz", methods=["get"])
+async def readyz():
+    """
+    Readiness, from the latest background health check. Costs no database
+    query or device round trip.
+    """
+    report = health_monitor.report()
+    return JSONResponse(
+        report or {"status": "starting"},
+        status_code=(
+            HTTP_200_OK if health_monitor.ready() else HTTP_503_SERVICE_UNAVAILABLE
+        ),
+    )
+
+
+@cache
+def render_service_worker() -> str:
+    """
+    The service worker script with the asset version and the URLs to
+    precache filled in, so every asset build gets its own caches.
+    """
+    with open("public/service-worker.js", encoding="utf-8") as file:
+        script = file.read()
+    precache = ["./manifest.webmanifest"] + [
+        f"./{url}"
+        for url in built_asset_urls()
+        + ["public/logo192.png", "public/logo512.png", "public/favicon.ico"]
+    ]
+    return script.replace("__ASSET_VERSION__", asset_version()).replace(
+        "__PRECACHE_URLS__", json.dumps(precache)
+    )
+
+
+register_cache("service_worker", render_service_worker)
+
+
 @rt("/service-worker.js")
 async def serve_service_worker():
-    return FileResponse("public/service-worker.js", media_type="application/javascript")
+    # Browsers check for a new worker on navigation; it must not be cached
+    return Response(
+        render_service_worker(),
+        media_type="application/javascript",
+        headers={"Cache-Control": "no-cache"},
+    )
 
 
 @rt("/manifest.webmanifest")
@@ -156,41 +358,41 @@ async def serve_manifest():
     )
 
 
-# Define the main route
-@rt("/")
-async def get():
-    try:
-        session = get_session()
-        presets = session.query(Preset).all()
-        logger.debug(f"Presets: {presets}")
-        lamps = session.query(Lamp).all()
-        session.close()
+def render_dashboard() -> tuple[str, str]:
+    """
+    Renders the dashboard page.
+    Returns:
+        tuple: The HTML and its entity tag.
+    """
+    presets, lamps = load_dashboard_data()
+    logger.debug("Presets: %s", presets)
 
-        preset_buttons = [
-            Div(
-                Button(
-                    preset.name,
-                    cls="waves-effect waves-dark btn-large preset-button",
-                    id=f"preset-{preset.id}",
-                    value=str(preset.id),
-                ),
-                cls="col s12 center-align",
-            )
-            for preset in presets
-        ]
+    preset_buttons = [
+        Div(
+            Button(
+                preset["name"],
+                cls="waves-effect waves-dark btn-large preset-button",
+                id=f"preset-{preset['id']}",
+                value=preset["id"],
+            ),
+            cls="col s12 center-align",
+        )
+        for preset in presets
+    ]
 
-        lamp_icons = [
-            I(
-                "lightbulb",
-                cls="medium material-icons lamp-icon",
-                # If the lamp.state is "Off", the color should be set to black with an opacity of 0
-                style=f"color: {lamp.hex if lamp.state == 'On' else 'rgba(0, 0, 0, 0)'}; opacity: {lamp.brightness if lamp.state == 'On' else 0};",
-                id=f"lamp-{lamp.id}",
-            )
-            for lamp in lamps
-        ]
+    lamp_icons = [
+        I(
+            "lightbulb",
+            cls="medium material-icons lamp-icon",
+            # If the lamp.state is "Off", the color should be set to black with an opacity of 0
+            style=f"color: {lamp['hex'] if lamp['state'] == 'On' else 'rgba(0, 0, 0, 0)'}; opacity: {lamp['brightness'] if lamp['state'] == 'On' else 0};",
+            id=f"lamp-{lamp['id']}",
+        )
+        for lamp in lamps
+    ]
 
-        return wrap_content_in_html(
+    html = to_xml(
+        wrap_content_in_html(
             (
                 # Loader Div
                 Div(
@@ -227,6 +429,29 @@ async def get():
                 ),
             )
         )
+    )
+    etag = '"' + hashlib.sha256(html.encode()).hexdigest()[:20] + '"'
+    return html, etag
+
+
+def etag_matches(request: Request, etag: str) -> bool:
+    if_none_match = request.headers.get("if-none-match", "")
+    # Weak comparison, as proxies may weaken the tag when compressing
+    tags = {tag.strip().removeprefix("W/") for tag in if_none_match.split(",")}
+    return etag in tags or "*" in tags
+
+
+# Define the main route
+@rt("/")
+async def get(request: Request):
+    try:
+        # The page is rendered once per data change. The service worker
+        # revalidates its copy with the ETag and mostly gets a 304.
+        html, etag = dashboard_cache.get("page", render_dashboard)
+        headers = {"ETag": etag, "Cache-Control": "no-cache"}
+        if etag_matches(request, etag):
+            return Response(status_code=HTTP_304_NOT_MODIFIED, headers=headers)
+        return HTMLResponse(html, headers=headers)
     except Exception:
         logger.exception("An unexpected error occurred in the root route.")
         raise HTTPException(
@@ -235,31 +460,90 @@ async def get():
         )
 
 
+def parse_apply_targets(data: dict) -> list[tuple[int, int | None]]:
+    """
+    Reads the presets and zones to apply from an /apply request body:
+    {"preset_id": 3} applies a preset to its own zone (or all lamps),
+    {"preset_id": 3, "zone_ids": [1, 2]} applies it to each listed zone and
+    {"targets": [{"preset_id": 3, "zone_id": 1}, ...]} applies several
+    presets to several zones at once.
+    """
+    if "targets" in data:
+        targets = [
+            (int(target["preset_id"]), _optional_id(target.get("zone_id")))
+            for target in data["targets"]
+        ]
+    else:
+        preset_id = int(data["preset_id"])
+        zone_ids = data.get("zone_ids") or [None]
+        targets = [(preset_id, _optional_id(zone_id)) for zone_id in zone_ids]
+    if not targets:
+        raise ValueError("No presets to apply.")
+    return targets
+
+
+def _optional_id(value: Any) -> int | None:
+    return None if value is None else int(value)
+
+
+async def _optional_body(request: Request) -> dict:
+    """
+    The JSON object of a request whose body is optional, {} without a body.
+    Raises:
+        ValueError: When the body is not a JSON object.
+    """
+    body = await request.body()
+    if not body:
+        return {}
+    data = json.loads(body)
+    if not isinstance(data, dict):
+        raise ValueError("The request body must be a JSON object.")
+    return data
+
+
+def _invalid_request(what: str, error: Exception) -> JSONResponse:
+    logger.warning("Invalid %s request: %s", what, error)
+    return JSONResponse(
+        {
+            "success": False,
+            "message": f"Invalid {what} request.",
+        },
+        status_code=HTTP_400_BAD_REQUEST,
+    )
+
+
+def parse_transition_ms(data: dict) -> int:
+    """
+    Reads the optional "transition_ms" of an /apply request body, the time
+    the lamps take to fade to the preset.
+    """
+    transition_ms = int(data.get("transition_ms") or 0)
+    if not 0 <= transition_ms <= MAX_TRANSITION_MS:
+        raise ValueError(f"transition_ms must be between 0 and {MAX_TRANSITION_MS}")
+    return transition_ms
+
+
 @rt("/apply", methods=["post"])
 async def apply(request: Request):
     try:
-        session = get_session()
         data = await request.json()
-        logger.debug(f"Received JSON data: {data}")
+        logger.debug("Received JSON data: %s", data)
 
-        preset_id = data.get("preset_id")
-        preset = session.query(Preset).filter_by(id=preset_id).first()
-        lamps = session.query(Lamp).all()
-        session.close()
-
-        if preset is None:
-            logger.warning(f"Preset with ID {preset_id} not found.")
+        try:
+            targets = parse_apply_targets(data)
+            transition_ms = parse_transition_ms(data)
+        except (KeyError, TypeError, ValueError) as e:
+            logger.warning("Invalid apply request %s: %s", data, e)
             return JSONResponse(
                 {
                     "success": False,
-                    "message": "Preset not found.",
+                    "message": "Invalid apply request.",
                 },
-                status_code=HTTP_404_NOT_FOUND,
+                status_code=HTTP_400_BAD_REQUEST,
             )
 
-        # Fetch the preset value, parse it into a dict or list of dicts
         try:
-            lamp_settings = apply_preset(preset.value, lamps)
+            lamp_settings = apply_to_zones(targets, transition_ms)
 
             return JSONResponse(
                 {
@@ -269,14 +553,18 @@ async def apply(request: Request):
                 },
                 status_code=HTTP_200_OK,
             )
-        except json.JSONDecodeError as e:
-            logger.error(f"Error decoding preset value: {e}")
+        except (PresetNotFound, ZoneNotFound) as e:
+            logger.warning("%s", e)
             return JSONResponse(
                 {
                     "success": False,
-                    "message": "Error decoding preset value.",
+                    "message": (
+                        "Preset not found."
+                        if isinstance(e, PresetNotFound)
+                        else "Zone not found."
+                    ),
                 },
-                status_code=HTTP_400_BAD_REQUEST,
+                status_code=HTTP_404_NOT_FOUND,
             )
         except Exception:
             logger.exception("An error occurred while applying the preset.")
@@ -285,7 +573,7 @@ async def apply(request: Request):
                 detail="An error occurred while applying the preset.",
             )
     except json.JSONDecodeError as e:
-        logger.error(f"Invalid JSON received: {e}")
+        logger.error("Invalid JSON received: %s", e)
         return JSONResponse(
             {
                 "success": False,
@@ -293,6 +581,8 @@ async def apply(request: Request):
             },
             status_code=HTTP_400_BAD_REQUEST,
         )
+    except HTTPException:
+        raise
     except Exception:
         logger.exception("An unexpected error occurred in the apply route.")
         raise HTTPException(
@@ -302,9 +592,18 @@ async def apply(request: Request):
 
 
 @rt("/turn-off", methods=["post"])
-async def turn_off():
+async def turn_off(request: Request):
     try:
-        turn_off_bulbs()
+        # An optional {"zone_ids": [...]} body limits the lamps turned off
+        data = await _optional_body(request)
+        zone_ids = data.get("zone_ids")
+        if zone_ids is not None:
+            zone_ids = [int(zone_id) for zone_id in zone_ids]
+    except (TypeError, ValueError) as e:
+        return _invalid_request("turn-off", e)
+
+    try:
+        turn_off_bulbs(zone_ids)
         return JSONResponse(
             {
                 "success": True,
@@ -320,25 +619,643 @@ async def turn_off():
         )
 
 
+@rt("/lamps/batch", methods=["post"])
+async def control_lamps(request: Request):
+    """
+    Sets lamps to individual targets in one request, e.g.
+    {"targets": [{"lamp_id": 1, "setting": {"type": "temp", "setting": 3000,
+    "brightness": 60}}, {"lamp_id": 2, "on": false}]}.
+    """
+    try:
+        batch = LampBatch.model_validate_json(await request.body())
+    except ValidationError as e:
+        logger.warning("Invalid lamp batch: %s", e)
+        return JSONResponse(
+            {
+                "success": False,
+                "message": "Invalid lamp batch.",
+                "errors": e.errors(
+                    include_url=False, include_context=False, include_input=False
+                ),
+            },
+            status_code=HTTP_400_BAD_REQUEST,
+        )
+
+    try:
+        results = apply_lamp_targets(batch.targets)
+        failed = sum(not result["success"] for result in results)
+        return JSONResponse(
+            {
+                "success": not failed,
+                "message": (
+                    f"{failed} of {len(results)} lamps failed."
+                    if failed
+                    else "Lamps updated successfully."
+                ),
+                "results": results,
+            },
+            status_code=HTTP_200_OK,
+        )
+    except Exception:
+        logger.exception("An error occurred while controlling the lamps.")
+        raise HTTPException(
+            status_code=HTTP_500_INTERNAL_SERVER_ERROR,
+            detail="An error occurred while controlling the lamps.",
+        )
+
+
+def parse_history_range(params) -> tuple[datetime, datetime]:
+    """
+    Reads the ISO 8601 `start` and `end` query parameters as naive UTC. The
+    range defaults to the last day, or the last 30 days for daily rollups.
+    """
+
+    def parse(name: str) -> datetime | None:
+        value = params.get(name)
+        if not value:
+            return None
+        moment = datetime.fromisoformat(value)
+        if moment.tzinfo is not None:
+            moment = moment.astimezone(timezone.utc).replace(tzinfo=None)
+        return moment
+
+    end = parse("end") or utcnow()
+    days = 30 if params.get("resolution") == "day" else 1
+    start = parse("start") or end - timedelta(days=days)
+    return start, end
+
+
+@rt("/lamps/{lamp_id}/history", methods=["get"])
+async def lamp_history(request: Request, lamp_id: int):
+    """
+    The state changes of a lamp, or its hourly or daily usage, e.g.
+    /lamps/1/history?resolution=hour&start=2024-09-01T00:00:00Z
+    """
+    try:
+        start, end = parse_history_range(request.query_params)
+        resolution = request.query_params.get("resolution", "raw")
+        history = get_lamp_history(lamp_id, start, end, resolution)
+    except (InvalidHistoryQuery, ValueError) as e:
+        logger.warning("Invalid lamp history request: %s", e)
+        return JSONResponse(
+            {
+                "success": False,
+                "message": f"Invalid lamp history request: {e}",
+            },
+            status_code=HTTP_400_BAD_REQUEST,
+        )
+    except Exception:
+        logger.exception("An error occurred while reading the lamp history.")
+        raise HTTPException(
+            status_code=HTTP_500_INTERNAL_SERVER_ERROR,
+            detail="An error occurred while reading the lamp history.",
+        )
+    return JSONResponse(
+        {
+            "success": True,
+            "resolution": resolution,
+            "start": start.isoformat(),
+            "end": end.isoformat(),
+            "history": history,
+        },
+        status_code=HTTP_200_OK,
+    )
+
+
+@rt("/snapshots", methods=["get"])
+async def snapshots():
+    try:
+        return JSONResponse(
+            {
+                "success": True,
+                "snapshots": get_snapshots(),
+            },
+            status_code=HTTP_200_OK,
+        )
+    except Exception:
+        logger.exception("An error occurred while listing the snapshots.")
+        raise HTTPException(
+            status_code=HTTP_500_INTERNAL_SERVER_ERROR,
+            detail="An error occurred while listing the snapshots.",
+        )
+
+
+@rt("/snapshots", methods=["post"])
+async def create_snapshot(request: Request):
+    """
+    Stores the live state of all lamps, with an optional {"name": "..."}.
+    """
+    try:
+        data = await _optional_body(request)
+        name = data.get("name")
+        if name is not None and not isinstance(name, str):
+            raise ValueError("The name must be a string.")
+    except ValueError as e:
+        return _invalid_request("snapshot", e)
+
+    try:
+        snapshot = take_snapshot(name)
+        return JSONResponse(
+            {
+                "success": not snapshot["failed"],
+                "message": (
+                    f"Snapshot taken, {len(snapshot['failed'])} lamps not reached."
+                    if snapshot["failed"]
+                    else "Snapshot taken successfully."
+                ),
+                "snapshot": snapshot,
+            },
+            status_code=HTTP_200_OK,
+        )
+    except Exception:
+        logger.exception("An error occurred while taking a snapshot.")
+        raise HTTPException(
+            status_code=HTTP_500_INTERNAL_SERVER_ERROR,
+            detail="An error occurred while taking a snapshot.",
+        )
+
+
+@rt("/snapshots/restore", methods=["post"])
+async def restore(request: Request):
+    """
+    Restores {"snapshot_id": 3}, or the newest snapshot without a body.
+    """
+    try:
+        data = await _optional_body(request)
+        snapshot_id = _optional_id(data.get("snapshot_id"))
+    except (TypeError, ValueError) as e:
+        return _invalid_request("restore", e)
+
+    try:
+        results = restore_snapshot(snapshot_id)
+        failed = sum(not result["success"] for result in results)
+        changed = sum(result["changed"] for result in results)
+        return JSONResponse(
+            {
+                "success": not failed,
+                "message": (
+                    f"{failed} of {len(results)} lamps failed."
+                    if failed
+                    else f"Snapshot restored, {changed} lamps changed."
+                ),
+                "results": results,
+            },
+            status_code=HTTP_200_OK,
+        )
+    except SnapshotNotFound as e:
+        logger.warning("%s", e)
+        return JSONResponse(
+            {
+                "success": False,
+                "message": "Snapshot not found.",
+            },
+            status_code=HTTP_404_NOT_FOUND,
+        )
+    except Exception:
+        logger.exception("An error occurred while restoring the snapshot.")
+        raise HTTPException(
+            status_code=HTTP_500_INTERNAL_SERVER_ERROR,
+            detail="An error occurred while restoring the snapshot.",
+        )
+
+
 @rt("/update-presets", methods=["post"])
-async def update():
+async def update(request: Request):
+    """
+    Generates new presets, unless the news and weather did not change since
+    the active presets were generated. `?force=true` always generates.
+    """
+    force = request.query_params.get("force", "").lower() in ("1", "true", "yes")
     try:
-        update_presets()
+        result = update_presets_module.update_presets(force=force)
+        if result is None:
+            raise RuntimeError("The preset update returned no result.")
+        if not result["updated"]:
+            return JSONResponse(
+                {
+                    "success": True,
+                    "updated": False,
+                    "message": "Inputs unchanged, the active presets were kept.",
+                    "reasons": result["reasons"],
+                },
+                status_code=HTTP_200_OK,
+            )
         return JSONResponse(
             {
                 "success": True,
+                "updated": True,
                 "message": "Presets updated successfully.",
+                "reasons": result["reasons"],
             },
             status_code=HTTP_200_OK,
         )
     except Exception:
         logger.exception("An error occurred while updating presets.")
+        return JSONResponse(
+            {
+                "success": False,
+                "message": "An error occurred while updating presets.",
+            },
+            status_code=HTTP_500_INTERNAL_SERVER_ERROR,
+        )
+
+
+@rt("/preset-sets")
+async def preset_sets():
+    try:
+        return JSONResponse(
+            {
+                "success": True,
+                "preset_sets": get_preset_sets(),
+            },
+            status_code=HTTP_200_OK,
+        )
+    except Exception:
+        logger.exception("An error occurred while listing the preset sets.")
+        raise HTTPException(
+            status_code=HTTP_500_INTERNAL_SERVER_ERROR,
+            detail="An error occurred while listing the preset sets.",
+        )
+
+
+@rt("/preset-sets/activate", methods=["post"])
+async def activate_set(request: Request):
+    """
+    Switches the presets shown on the dashboard to an earlier generation,
+    e.g. {"set_id": 4}, without generating new ones.
+    """
+    try:
+        data = await request.json()
+        set_id = int(data["set_id"])
+    except (json.JSONDecodeError, KeyError, TypeError, ValueError) as e:
+        logger.warning("Invalid preset set activation request: %s", e)
+        return JSONResponse(
+            {
+                "success": False,
+                "message": "Invalid preset set activation request.",
+            },
+            status_code=HTTP_400_BAD_REQUEST,
+        )
+
+    try:
+        preset_set = activate_preset_set(set_id)
+        return JSONResponse(
+            {
+                "success": True,
+                "message": "Preset set activated successfully.",
+                "preset_set": preset_set,
+            },
+            status_code=HTTP_200_OK,
+        )
+    except PresetSetNotFound as e:
+        logger.warning("%s", e)
+        return JSONResponse(
+            {
+                "success": False,
+                "message": "Preset set not found.",
+            },
+            status_code=HTTP_404_NOT_FOUND,
+        )
+    except Exception:
+        logger.exception("An error occurred while activating the preset set.")
         raise HTTPException(
             status_code=HTTP_500_INTERNAL_SERVER_ERROR,
-            detail="An error occurred while updating presets.",
+            detail="An error occurred while activating the preset set.",
+        )
+
+
+def _parse_body(model: type[BaseModel], body: bytes, what: str):
+    """
+    Validates a JSON request body against `model`.
+    Returns:
+        The model instance, or a 400 response naming `what` was invalid.
+    """
+    try:
+        return model.model_validate_json(body)
+    except ValidationError as e:
+        logger.warning("Invalid %s: %s", what, e)
+        return JSONResponse(
+            {
+                "success": False,
+                "message": f"Invalid {what}.",
+                "errors": e.errors(
+                    include_url=False, include_context=False, include_input=False
+                ),
+            },
+            status_code=HTTP_400_BAD_REQUEST,
         )
 
 
+def _schedule_not_found(e: Exception) -> JSONResponse:
+    logger.warning("%s", e)
+    if isinstance(e, ZoneNotFound):
+        message = "Zone not found."
+    elif isinstance(e, PresetNotFound):
+        message = "Preset not found."
+    else:
+        message = "Schedule not found."
+    return JSONResponse(
+        {
+            "success": False,
+            "message": message,
+        },
+        status_code=HTTP_404_NOT_FOUND,
+    )
+
+
+def _zone_error(e: Exception) -> JSONResponse:
+    logger.warning("%s", e)
+    if isinstance(e, ZoneNameTaken):
+        message, status_code = "Zone name taken.", HTTP_409_CONFLICT
+    elif isinstance(e, LampNotFound):
+        message, status_code = "Lamp not found.", HTTP_404_NOT_FOUND
+    elif isinstance(e, PresetNotFound):
+        message, status_code = "Preset not found.", HTTP_404_NOT_FOUND
+    else:
+        message, status_code = "Zone not found.", HTTP_404_NOT_FOUND
+    return JSONResponse(
+        {
+            "success": False,
+            "message": message,
+        },
+        status_code=status_code,
+    )
+
+
+@rt("/zones", methods=["get"])
+async def zones():
+    try:
+        return JSONResponse(
+            {
+                "success": True,
+                "zones": get_all_zones(),
+            },
+            status_code=HTTP_200_OK,
+        )
+    except Exception:
+        logger.exception("An error occurred while listing the zones.")
+        raise HTTPException(
+            status_code=HTTP_500_INTERNAL_SERVER_ERROR,
+            detail="An error occurred while listing the zones.",
+        )
+
+
+@rt("/zones", methods=["post"])
+async def add_zone(request: Request):
+    """
+    Creates a zone, e.g. {"name": "Living room"}.
+    """
+    spec = _parse_body(ZoneSpec, await request.body(), "zone")
+    if isinstance(spec, JSONResponse):
+        return spec
+    try:
+        zone = create_zone(spec.name)
+    except ZoneNameTaken as e:
+        return _zone_error(e)
+    except Exception:
+        logger.exception("An error occurred while creating the zone.")
+        raise HTTPException(
+            status_code=HTTP_500_INTERNAL_SERVER_ERROR,
+            detail="An error occurred while creating the zone.",
+        )
+    return JSONResponse(
+        {
+            "success": True,
+            "message": "Zone created successfully.",
+            "zone": zone,
+        },
+        status_code=HTTP_200_OK,
+    )
+
+
+@rt("/zones/{zone_id}", methods=["put"])
+async def change_zone(request: Request, zone_id: int):
+    """
+    Renames a zone, e.g. {"name": "Kitchen"}.
+    """
+    spec = _parse_body(ZoneSpec, await request.body(), "zone")
+    if isinstance(spec, JSONResponse):
+        return spec
+    try:
+        zone = rename_zone(zone_id, spec.name)
+    except (ZoneNotFound, ZoneNameTaken) as e:
+        return _zone_error(e)
+    except Exception:
+        logger.exception("An error occurred while renaming the zone.")
+        raise HTTPException(
+            status_code=HTTP_500_INTERNAL_SERVER_ERROR,
+            detail="An error occurred while renaming the zone.",
+        )
+    return JSONResponse(
+        {
+            "success": True,
+            "message": "Zone renamed successfully.",
+            "zone": zone,
+        },
+        status_code=HTTP_200_OK,
+    )
+
+
+@rt("/zones/{zone_id}", methods=["delete"])
+async def remove_zone(zone_id: int):
+    try:
+        delete_zone(zone_id)
+    except ZoneNotFound as e:
+        return _zone_error(e)
+    except Exception:
+        logger.exception("An error occurred while deleting the zone.")
+        raise HTTPException(
+            status_code=HTTP_500_INTERNAL_SERVER_ERROR,
+            detail="An error occurred while deleting the zone.",
+        )
+    return JSONResponse(
+        {
+            "success": True,
+            "message": "Zone deleted successfully.",
+        },
+        status_code=HTTP_200_OK,
+    )
+
+
+@rt("/lamps/zone", methods=["put"])
+async def assign_lamps(request: Request):
+    """
+    Moves lamps into a zone, e.g. {"lamp_ids": [1, 2], "zone_id": 3}, or out
+    of their zone with {"lamp_ids": [1, 2], "zone_id": null}.
+    """
+    spec = _parse_body(ZoneLamps, await request.body(), "lamp assignment")
+    if isinstance(spec, JSONResponse):
+        return spec
+    try:
+        updated = assign_lamps_to_zone(spec.zone_id, spec.lamp_ids)
+    except (ZoneNotFound, LampNotFound) as e:
+        return _zone_error(e)
+    except Exception:
+        logger.exception("An error occurred while assigning the lamps.")
+        raise HTTPException(
+            status_code=HTTP_500_INTERNAL_SERVER_ERROR,
+            detail="An error occurred while assigning the lamps.",
+        )
+    return JSONResponse(
+        {
+            "success": True,
+            "message": f"{updated} lamps assigned.",
+        },
+        status_code=HTTP_200_OK,
+    )
+
+
+@rt("/presets/{preset_id}/zone", methods=["put"])
+async def change_preset_zone(request: Request, preset_id: int):
+    """
+    Sets the zone a preset applies to by default, e.g. {"zone_id": 2}, or
+    {"zone_id": null} for all lamps.
+    """
+    spec = _parse_body(PresetZone, await request.body(), "preset zone")
+    if isinstance(spec, JSONResponse):
+        return spec
+    try:
+        preset = set_preset_zone(preset_id, spec.zone_id)
+    except (PresetNotFound, ZoneNotFound) as e:
+        return _zone_error(e)
+    except Exception:
+        logger.exception("An error occurred while setting the preset zone.")
+        raise HTTPException(
+            status_code=HTTP_500_INTERNAL_SERVER_ERROR,
+            detail="An error occurred while setting the preset zone.",
+        )
+    return JSONResponse(
+        {
+            "success": True,
+            "message": "Preset zone set successfully.",
+            "preset": preset,
+        },
+        status_code=HTTP_200_OK,
+    )
+
+
+@rt("/schedules", methods=["get"])
+async def schedules():
+    try:
+        return JSONResponse(
+            {
+                "success": True,
+                "timezone": get_settings().timezone,
+                "schedules": get_schedules(),
+            },
+            status_code=HTTP_200_OK,
+        )
+    except Exception:
+        logger.exception("An error occurred while listing the schedules.")
+        raise HTTPException(
+            status_code=HTTP_500_INTERNAL_SERVER_ERROR,
+            detail="An error occurred while listing the schedules.",
+        )
+
+
+@rt("/schedules", methods=["post"])
+async def add_schedule(request: Request):
+    """
+    Creates a schedule, e.g. {"name": "Evening", "preset_id": 3,
+    "trigger": "sunset", "offset_minutes": -30, "weekdays": ["fri", "sat"]}.
+    """
+    spec = _parse_body(ScheduleSpec, await request.body(), "schedule")
+    if isinstance(spec, JSONResponse):
+        return spec
+    try:
+        schedule = create_schedule(spec)
+    except (PresetNotFound, ZoneNotFound) as e:
+        return _schedule_not_found(e)
+    except Exception:
+        logger.exception("An error occurred while creating the schedule.")
+        raise HTTPException(
+            status_code=HTTP_500_INTERNAL_SERVER_ERROR,
+            detail="An error occurred while creating the schedule.",
+        )
+    scheduler.reload()
+    return JSONResponse(
+        {
+            "success": True,
+            "message": "Schedule created successfully.",
+            "schedule": schedule,
+        },
+        status_code=HTTP_200_OK,
+    )
+
+
+@rt("/schedules/{schedule_id}", methods=["put"])
+async def change_schedule(request: Request, schedule_id: int):
+    """
+    Replaces a schedule, with the same body as creating one.
+    """
+    spec = _parse_body(ScheduleSpec, await request.body(), "schedule")
+    if isinstance(spec, JSONResponse):
+        return spec
+    try:
+        schedule = update_schedule(schedule_id, spec)
+    except (ScheduleNotFound, PresetNotFound, ZoneNotFound) as e:
+        return _schedule_not_found(e)
+    except Exception:
+        logger.exception("An error occurred while updating the schedule.")
+        raise HTTPException(
+            status_code=HTTP_500_INTERNAL_SERVER_ERROR,
+            detail="An error occurred while updating the schedule.",
+        )
+    scheduler.reload()
+    return JSONResponse(
+        {
+            "success": True,
+            "message": "Schedule updated successfully.",
+            "schedule": schedule,
+        },
+        status_code=HTTP_200_OK,
+    )
+
+
+@rt("/schedules/{schedule_id}", methods=["delete"])
+async def remove_schedule(schedule_id: int):
+    try:
+        delete_schedule(schedule_id)
+    except ScheduleNotFound as e:
+        return _schedule_not_found(e)
+    except Exception:
+        logger.exception("An error occurred while deleting the schedule.")
+        raise HTTPException(
+            status_code=HTTP_500_INTERNAL_SERVER_ERROR,
+            detail="An error occurred while deleting the schedule.",
+        )
+    scheduler.reload()
+    return JSONResponse(
+        {
+            "success": True,
+            "message": "Schedule deleted successfully.",
+        },
+        status_code=HTTP_200_OK,
+    )
+
+
+STARTUP_DURATION.set("total", value=time.perf_counter() - _import_started)
+logger.info(
+    "Startup completed in %.0f ms (imports %.0f ms).",
+    (time.perf_counter() - _import_started) * 1000,
+    _imports_duration * 1000,
+)
+
+
 if __name__ == "__main__":
-    SHOULD_RELOAD = True if "DEBUG" in os.environ else False
-    serve(port=5173, reload=SHOULD_RELOAD)
+    settings = get_settings()
+    if settings.workers > 1:
+        # Each worker imports this module and serves requests on the shared
+        # socket; device commands and caches are coordinated through the
+        # files in the db folder, see utils/coordination.py
+        import uvicorn  # pylint: disable=import-outside-toplevel
+
+        uvicorn.run(
+            "main:app",
+            host="0.0.0.0",
+            port=settings.port,
+            workers=settings.workers,
+        )
+    else:
+        SHOULD_RELOAD = settings.debug
+        serve(port=settings.port, reload=SHOULD_RELOAD)
@@ -0,0 +1,367 @@
+"""
+A small in-process metrics registry rendered in the Prometheus text format.
+
+Metrics are plain counters and histograms keyed by label values. Recording a
+sample is a dictionary lookup and a few additions under a lock, so the
+instrumentation can stay enabled in production. Values are only aggregated
+into the exposition format when `/metrics` is scraped.
+"""
+
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterable, List, Tuple
+
+from utils.upstream_status import record_success
+
+DEFAULT_BUCKETS = (
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+    30.0,
+    60.0,
+)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Tuple[str, ...], values: Tuple, extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metric:
+    """
+    Base class for a metric family with a fixed set of label names.
+    """
+
+    type_name = "untyped"
+
+    def __init__(self, name: str, documentation: str, labelnames=()) -> None:
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Tuple) -> Tuple:
+        if len(labels) != len(self.labelnames):
+            raise ValueError(
+                f"{self.name} expects labels {self.labelnames}, got {labels}"
+            )
+        return tuple(labels)
+
+    def render(self) -> List[str]:
+        return [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} {self.type_name}",
+            *self._samples(),
+        ]
+
+    def _samples(self) -> Iterable[str]:
+        raise NotImplementedError
+
+
+class Counter(Metric):
+    """
+    A monotonically increasing value per label combination.
+    """
+
+    type_name = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames=()) -> None:
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[Tuple, float] = {}
+
+    def inc(self, *labels, amount: float = 1) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, *labels) -> float:
+        with self._lock:
+            return self._values.get(self._key(labels), 0)
+
+    def _samples(self) -> Iterable[str]:
+        with self._lock:
+            values = sorted(self._values.items())
+        for labels, value in values:
+            yield (
+                f"{self.name}{_format_labels(self.labelnames, labels)} "
+                f"{_format_value(value)}"
+            )
+
+
+class Gauge(Metric):
+    """
+    A value that can go up and down. The value of a label combination can
+    also be provided by a callback evaluated at scrape time.
+    """
+
+    type_name = "gauge"
+
+    def __init__(self, name: str, documentation: str, labelnames=()) -> None:
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[Tuple, float] = {}
+        self._callbacks: Dict[Tuple, Callable[[], float]] = {}
+
+    def set(self, *labels, value: float) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def set_function(self, *labels, function: Callable[[], float]) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._callbacks[key] = function
+
+    def _samples(self) -> Iterable[str]:
+        with self._lock:
+            values = dict(self._values)
+            callbacks = dict(self._callbacks)
+        for labels, function in callbacks.items():
+            values[labels] = function()
+        for labels, value in sorted(values.items()):
+            yield (
+                f"{self.name}{_format_labels(self.labelnames, labels)} "
+                f"{_format_value(value)}"
+            )
+
+
+class Histogram(Metric):
+    """
+    Counts observations into cumulative buckets per label combination.
+    """
+
+    type_name = "histogram"
+
+    def __init__(
+        self, name: str, documentation: str, labelnames=(), buckets=DEFAULT_BUCKETS
+    ) -> None:
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # Per label combination: [bucket counts..., +Inf count, sum]
+        self._values: Dict[Tuple, List[float]] = {}
+
+    def observe(self, value: float, *labels) -> None:
+        key = self._key(labels)
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [0] * (len(self.buckets) + 1) + [0.0]
+            state[index] += 1
+            state[-1] += value
+
+    @contextmanager
+    def time(self, *labels):
+        """
+        Observes the duration of the enclosed block, also when it raises.
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, *labels)
+
+    def count(self, *labels) -> int:
+        with self._lock:
+            state = self._values.get(self._key(labels))
+            return int(sum(state[:-1])) if state else 0
+
+    def _samples(self) -> Iterable[str]:
+        with self._lock:
+            values = sorted((key, list(state)) for key, state in self._values.items())
+        for labels, state in values:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), state[:-1]):
+                cumulative += count
+                le = f'le="{_format_value(bound)}"'
+                yield (
+                    f"{self.name}_bucket{_format_labels(self.labelnames, labels, le)} "
+                    f"{cumulative}"
+                )
+            label_text = _format_labels(self.labelnames, labels)
+            yield f"{self.name}_sum{label_text} {_format_value(state[-1])}"
+            yield f"{self.name}_count{label_text} {cumulative}"
+
+
+class Registry:
+    """
+    Holds all metric families. Asking for an already registered name returns
+    the existing metric, so modules can declare the metrics they use at
+    import time without coordinating with each other.
+    """
+
+    def __init__(self) -> None:
+        self._metrics: Dict[str, Metric] = {}
+        self._lock = threading.Lock()
+
+    def _get_or_create(self, cls, name, documentation, labelnames, **kwargs):
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = self._metrics[name] = cls(
+                    name, documentation, labelnames, **kwargs
+                )
+            elif not isinstance(metric, cls):
+                raise ValueError(f"Metric {name} is already registered as another type")
+            return metric
+
+    def counter(self, name, documentation, labelnames=()) -> Counter:
+        return self._get_or_create(Counter, name, documentation, labelnames)
+
+    def gauge(self, name, documentation, labelnames=()) -> Gauge:
+        return self._get_or_create(Gauge, name, documentation, labelnames)
+
+    def histogram(
+        self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS
+    ) -> Histogram:
+        return self._get_or_create(
+            Histogram, name, documentation, labelnames, buckets=buckets
+        )
+
+    def render(self) -> str:
+        with self._lock:
+            metrics = sorted(self._metrics.values(), key=lambda metric: metric.name)
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+counter = REGISTRY.counter
+gauge = REGISTRY.gauge
+histogram = REGISTRY.histogram
+
+CACHE_HITS = gauge(
+    "luminasync_cache_hits", "Lookups answered from an in-process cache.", ["cache"]
+)
+CACHE_MISSES = gauge(
+    "luminasync_cache_misses", "Lookups that missed an in-process cache.", ["cache"]
+)
+CACHE_HIT_RATIO = gauge(
+    "luminasync_cache_hit_ratio", "Share of cache lookups that were hits.", ["cache"]
+)
+
+
+def register_cache(name: str, cached_function) -> None:
+    """
+    Exposes the hit and miss counts of a `functools.cache`/`lru_cache`
+    decorated function, or any other cache with a `cache_info()` method.
+    The counts are read from `cache_info()` at scrape time, so lookups
+    themselves are not slowed down.
+    """
+
+    def ratio():
+        info = cached_function.cache_info()
+        total = info.hits + info.misses
+        return info.hits / total if total else 0.0
+
+    CACHE_HITS.set_function(name, function=lambda: cached_function.cache_info().hits)
+    CACHE_MISSES.set_function(
+        name, function=lambda: cached_function.cache_info().misses
+    )
+    CACHE_HIT_RATIO.set_function(name, function=ratio)
+
+
+UPSTREAM_REQUEST_DURATION = histogram(
+    "luminasync_upstream_request_duration_seconds",
+    "Latency of calls to external APIs (open-meteo, newsdata, OpenAI).",
+    ["upstream", "outcome"],
+)
+
+
+@contextmanager
+def track_upstream(upstream: str):
+    """
+    Observes the duration of an upstream call, labelled with its outcome.
+    Successful calls are also recorded for the health check.
+    """
+    start = time.perf_counter()
+    outcome = "error"
+    try:
+        yield
+        outcome = "ok"
+        record_success(upstream)
+    finally:
+        UPSTREAM_REQUEST_DURATION.observe(
+            time.perf_counter() - start, upstream, outcome
+        )
+
+
+HTTP_REQUEST_DURATION = histogram(
+    "luminasync_http_request_duration_seconds",
+    "Time spent handling HTTP requests.",
+    ["route", "method", "status"],
+)
+
+
+class RequestMetricsMiddleware:
+    """
+    ASGI middleware observing the latency of every HTTP request, labelled
+    with the route template rather than the raw path to bound cardinality.
+    """
+
+    def __init__(self, app) -> None:
+        self.app = app
+        self._route_paths: Dict[object, str] | None = None
+
+    def _route_label(self, scope) -> str:
+        endpoint = scope.get("endpoint")
+        if endpoint is None:
+            return "unmatched"
+        if self._route_paths is None:
+            router = scope.get("router")
+            routes = getattr(router, "routes", [])
+            self._route_paths = {
+                getattr(route, "endpoint", getattr(route, "app", None)): route.path
+                for route in routes
+                if hasattr(route, "path")
+            }
+        return self._route_paths.get(endpoint, "unmatched")
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        status = 500
+        start = time.perf_counter()
+
+        async def send_with_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            HTTP_REQUEST_DURATION.observe(
+                time.perf_counter() - start,
+                self._route_label(scope),
+                scope["method"],
+                str(status),
+            )
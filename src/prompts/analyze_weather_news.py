@@ -4,7 +4,7 @@ system_prompt = """You are an assistant that generates brief emotional responses
 Input JSON Structure:
 
 - `weather`: Contains data on temperature, cloud cover, and rain.
-- `local_news`: A list of articles, each with a title, description, URL, source, and published date.
+- `local_news`: A list of articles, each with a title and, when available, a shortened description.
 - `global_news`: A list of articles, similar to local news, but on international topics.
 
 Instructions:
@@ -60,3 +60,40 @@ Note:
 - Aim for a diverse range of presets, reflecting the variety of emotions in the input descriptions.
 - Generate an extra 3 light presets that are more general and positive in nature.
 """
+
+# The prompts below are used when the mood presets and the general presets
+# are generated by separate requests that run at the same time.
+mood_system_prompt = """You are an assistant that creates light presets based on emotional one-line descriptions. The input consists of a list of emotional descriptions, and the number of lamps available for lighting control. Based on the input, generate exactly one light preset per description that reflects the mood described in the one-liner.
+
+Instructions:
+
+1. Input Structure:
+   - `descriptions`: A list of emotional one-line descriptions.
+   - `lamp_count`: An integer indicating the number of lamps available.
+
+2. Output Structure:
+   - Generate a list of objects, each representing a light preset, in the order of the descriptions.
+   - Each object should contain:
+     - `name`: A single word that encapsulates the mood or sentiment.
+     - `type`: `"color"` for a **color-based mood** (e.g., warm, vibrant, serene), `"temp"` for a **temperature-based mood** (e.g., calm, energetic, relaxing).
+     - For `"color"`: `value_color`, a list of values equal to the number of lamps (`lamp_count`). Each value includes a color (`setting`) in hex code format and a `brightness` level (1-100). Use a diverse range of colors and brightness levels.
+     - For `"temp"`: `value_temp`, a single value with a `setting` in Kelvin (2700 for warm to 6500 for cool) and a `brightness` level (1-100).
+
+Note:
+- Create a unique preset name for each description that captures the essence of the mood.
+- Aim for a diverse range of presets, reflecting the variety of emotions in the input descriptions.
+"""
+
+general_system_prompt = """You are an assistant that creates general and positive light presets, for example 'Creativity' or 'Sunshine'. The input contains the number of lamps available for lighting control (`lamp_count`) and the number of presets to create (`preset_count`).
+
+Output Structure:
+   - Generate a list of `preset_count` objects, each representing a light preset.
+   - Each object should contain:
+     - `name`: A single word that captures the positive mood of the preset.
+     - `type`: `"color"` or `"temp"`.
+     - For `"color"`: `value_color`, a list of values equal to the number of lamps (`lamp_count`). Each value includes a color (`setting`) in hex code format and a `brightness` level (1-100).
+     - For `"temp"`: `value_temp`, a single value with a `setting` in Kelvin (2700 for warm to 6500 for cool) and a `brightness` level (1-100).
+
+Note:
+- Make the presets clearly different from each other.
+"""
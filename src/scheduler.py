@@ -0,0 +1,204 @@
+"""
+Runs the schedules at their due times.
+
+A single worker leads: the one holding the "scheduler" file lock. The others
+retry the lock every LEADER_RETRY seconds, so one of them takes over when the
+leader exits. The leader keeps a heap of the next due time of every enabled
+schedule and sleeps until the earliest, instead of polling the database. It
+rebuilds the heap when the data changed, which it notices through the cache
+generation at least every RESYNC_INTERVAL seconds, or at once for changes made
+through its own worker.
+
+Runs missed while no worker was up, or while the lamps were busy, are made up
+for once when they are at most SCHEDULE_GRACE_MINUTES late: several missed
+runs of the same schedule coalesce into the latest. Older runs are recorded
+as missed.
+"""
+
+import heapq
+import logging
+import threading
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, List, Optional, Tuple
+
+from metrics import counter
+from services.schedule_service import (
+    get_enabled_schedules,
+    next_run,
+    record_run,
+    run_schedule,
+)
+from settings import get_settings
+from tracing import span
+from utils.coordination import LockTimeout, cache_generation, named_lock
+
+LEADER_RETRY = 30.0
+RESYNC_INTERVAL = 60.0
+
+SCHEDULE_RUNS = counter(
+    "luminasync_schedule_runs_total",
+    "Schedule runs, by outcome: ok, failed or missed.",
+    ["outcome"],
+)
+
+logger = logging.getLogger("LuminaSync")
+
+
+def _now() -> datetime:
+    return datetime.now(timezone.utc)
+
+
+def latest_due(
+    schedule: Dict[str, Any], since: datetime, now: datetime
+) -> Optional[datetime]:
+    """
+    The latest time in (since, now] that a schedule was due, if any.
+    """
+    latest, due = None, next_run(schedule, since)
+    while due is not None and due <= now:
+        latest, due = due, next_run(schedule, due)
+    return latest
+
+
+class Scheduler:
+    """
+    Fires the schedules from a daemon thread, in the leading worker only.
+    """
+
+    def __init__(self) -> None:
+        self._stop = threading.Event()
+        self._wake = threading.Condition()
+        self._reload = False
+        self._leading = False
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self) -> None:
+        if not get_settings().schedules_enabled:
+            return
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(
+            target=self._run, name="scheduler", daemon=True
+        )
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        self.reload()
+
+    def reload(self) -> None:
+        """
+        Makes the leader rebuild its heap now, after a schedule changed.
+        """
+        with self._wake:
+            self._reload = True
+            self._wake.notify_all()
+
+    @property
+    def leading(self) -> bool:
+        return self._leading
+
+    def _run(self) -> None:
+        lock = named_lock("scheduler")
+        while not self._stop.is_set():
+            try:
+                with lock.acquire(timeout=0.1):
+                    self._leading = True
+                    logger.info("This worker runs the schedules.")
+                    self._lead()
+            except LockTimeout:
+                self._stop.wait(LEADER_RETRY)
+            except Exception:  # pylint: disable=broad-except
+                logger.exception("The scheduler failed.")
+                self._stop.wait(LEADER_RETRY)
+            finally:
+                self._leading = False
+
+    def _wait(self, seconds: float) -> None:
+        with self._wake:
+            if not self._reload and not self._stop.is_set():
+                self._wake.wait(max(0.0, seconds))
+
+    def _build(self, now: datetime) -> Tuple[List, Dict[int, Dict[str, Any]]]:
+        """
+        The heap of (due time, schedule id), one entry per enabled schedule,
+        and the schedules by id. Runs missed beyond the grace period are
+        recorded here.
+        """
+        grace = timedelta(minutes=get_settings().schedule_grace_minutes)
+        heap, schedules = [], {}
+        for schedule in get_enabled_schedules():
+            schedule_id = int(schedule["id"])
+            schedules[schedule_id] = schedule
+            missed = latest_due(schedule, schedule["due_after"], now)
+            if missed is not None and now - missed <= grace:
+                heap.append((missed, schedule_id))
+                continue
+            if missed is not None:
+                self._missed(schedule, missed)
+            due = next_run(schedule, now)
+            if due is not None:
+                heap.append((due, schedule_id))
+        heapq.heapify(heap)
+        return heap, schedules
+
+    def _lead(self) -> None:
+        generation = None
+        heap: List = []
+        schedules: Dict[int, Dict[str, Any]] = {}
+        while not self._stop.is_set():
+            now = _now()
+            with self._wake:
+                reload, self._reload = self._reload, False
+            if reload or generation != cache_generation.current():
+                generation = cache_generation.current()
+                heap, schedules = self._build(now)
+
+            grace = timedelta(minutes=get_settings().schedule_grace_minutes)
+            while heap and heap[0][0] <= now and not self._stop.is_set():
+                due, schedule_id = heapq.heappop(heap)
+                schedule = schedules[schedule_id]
+                if now - due > grace:
+                    self._missed(schedule, due)
+                else:
+                    self._fire(schedule, due)
+                now = _now()
+                following = next_run(schedule, max(due, now))
+                if following is not None:
+                    heapq.heappush(heap, (following, schedule_id))
+
+            timeout = RESYNC_INTERVAL
+            if heap:
+                until_due = (heap[0][0] - _now()).total_seconds()
+                timeout = min(timeout, until_due)
+            self._wait(timeout)
+
+    def _missed(self, schedule: Dict[str, Any], due: datetime) -> None:
+        logger.warning(
+            "Schedule %s missed its run at %s.", schedule["name"], due.isoformat()
+        )
+        SCHEDULE_RUNS.inc("missed")
+        record_run(int(schedule["id"]), due, "missed")
+
+    def _fire(self, schedule: Dict[str, Any], due: datetime) -> None:
+        with span(
+            "schedule.run",
+            schedule=schedule["name"],
+            action=schedule["action"],
+            due=due.isoformat(),
+        ) as current:
+            try:
+                run_schedule(schedule)
+            except Exception as e:  # pylint: disable=broad-except
+                logger.error("Schedule %s failed: %s", schedule["name"], e)
+                current.set_attribute("error", str(e))
+                SCHEDULE_RUNS.inc("failed")
+                record_run(int(schedule["id"]), due, "failed", str(e))
+                return
+        logger.info("Schedule %s ran.", schedule["name"])
+        SCHEDULE_RUNS.inc("ok")
+        record_run(int(schedule["id"]), due, "ok")
+
+
+scheduler = Scheduler()
@@ -0,0 +1,65 @@
+"""
+Runs blocking device work for many lamps at the same time.
+"""
+
+import contextvars
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Iterable, List, Optional, Tuple, TypeVar
+
+from settings import get_settings
+
+T = TypeVar("T")
+R = TypeVar("R")
+
+_executor: Optional[ThreadPoolExecutor] = None
+_executor_lock = threading.Lock()
+
+
+def get_executor() -> ThreadPoolExecutor:
+    """
+    Returns the worker's shared device thread pool, sized by
+    DEVICE_CONCURRENCY, so concurrent requests share one cap.
+    """
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=get_settings().device_concurrency,
+                thread_name_prefix="device",
+            )
+        return _executor
+
+
+def run_concurrently(
+    function: Callable[[T], R], items: Iterable[T]
+) -> List[Tuple[T, Optional[R], Optional[BaseException]]]:
+    """
+    Calls `function` for every item on the device thread pool and waits for
+    all of them. Each call runs in a copy of the caller's context, so spans
+    and trace ids carry over into the pool threads.
+    Args:
+        function (Callable): The function to call with each item.
+        items (Iterable): The items, e.g. lamps.
+    Returns:
+        list: One (item, result, exception) tuple per item, in input order.
+    """
+    items = list(items)
+    if len(items) == 1:
+        try:
+            return [(items[0], function(items[0]), None)]
+        except Exception as e:  # pylint: disable=broad-except
+            return [(items[0], None, e)]
+
+    executor = get_executor()
+    futures = [
+        executor.submit(contextvars.copy_context().run, function, item)
+        for item in items
+    ]
+    results = []
+    for item, future in zip(items, futures):
+        try:
+            results.append((item, future.result(), None))
+        except Exception as e:  # pylint: disable=broad-except
+            results.append((item, None, e))
+    return results
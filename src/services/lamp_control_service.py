@@ -0,0 +1,105 @@
+"""
+Direct control of individual lamps, without a stored preset.
+
+A batch of per-lamp targets is applied concurrently through the same device
+path as presets: every lamp is claimed, which stops a transition driving it,
+commanded under its device lock and its state read back into the database.
+"""
+
+import logging
+from typing import TYPE_CHECKING, Any, Dict, List
+
+from db.models import Lamp
+from db.session import get_session
+from interfaces.schemas import LampTarget
+from services.dispatch import run_concurrently
+from services.lamp_service import update_lamp_by_ip as update_lamp
+from services.preset_service import connect_bulb
+from tracing import span
+from utils.color_translate import hex_to_rgb, rgb_to_hsv
+from utils.coordination import claim_device, device_lock
+
+if TYPE_CHECKING:
+    from interfaces.tapo_lamp_interface import TapoLampInterface
+
+logger = logging.getLogger("LuminaSync")
+
+
+def send_target(bulb: "TapoLampInterface", target: LampTarget) -> Dict[str, Any]:
+    """
+    Puts a connected lamp in its target state and stores the state read back.
+    Returns:
+        dict: The updated lamp.
+    """
+    with device_lock(bulb.ip):
+        setting = target.setting
+        if not target.on:
+            bulb.turnOff()
+        elif setting is None:
+            bulb.turnOn()
+        elif setting.type == "color":
+            if bulb.deviceProperties["state"] == "Off":
+                bulb.turnOn()
+            hue, saturation, _ = rgb_to_hsv(hex_to_rgb(setting.setting))
+            bulb.setHueSaturation(hue, saturation)
+            bulb.setBrightness(setting.brightness)
+        else:
+            bulb.setTemperature(setting.setting, setting.brightness)
+        return update_lamp(bulb.ip, **bulb.getDeviceProperties())
+
+
+def _apply_target(assignment) -> Dict[str, Any]:
+    ip, target = assignment
+    # Claiming the lamp stops a transition that is still driving it
+    claim_device(ip)
+    return send_target(connect_bulb(ip), target)
+
+
+def apply_lamp_targets(targets: List[LampTarget]) -> List[Dict[str, Any]]:
+    """
+    Puts each lamp in its target state, all lamps concurrently. A lamp that
+    fails or doesn't exist doesn't stop the others.
+    Args:
+        targets (list): The validated targets, at most one per lamp.
+    Returns:
+        list: Per target, in the same order, the lamp_id, whether it
+            succeeded, the lamp's state read back and the error, if any.
+    """
+    session = get_session()
+    try:
+        lamp_ids = [target.lamp_id for target in targets]
+        ips = {
+            lamp.id: lamp.ip
+            for lamp in session.query(Lamp).filter(Lamp.id.in_(lamp_ids))
+        }
+    finally:
+        session.close()
+
+    assignments = [
+        (ips[target.lamp_id], target) for target in targets if target.lamp_id in ips
+    ]
+    with span("lamps.apply_targets", lamps=len(assignments)):
+        outcomes = {
+            target.lamp_id: (lamp, error)
+            for (_, target), lamp, error in run_concurrently(
+                _apply_target, assignments
+            )
+        }
+
+    results = []
+    for target in targets:
+        if target.lamp_id not in ips:
+            lamp, error = None, "Lamp not found."
+        else:
+            lamp, error = outcomes[target.lamp_id]
+            if error:
+                logger.warning("Lamp %s failed: %s", target.lamp_id, error)
+        results.append(
+            {
+                "lamp_id": target.lamp_id,
+                "success": error is None,
+                "lamp": lamp,
+                "error": str(error) if error else None,
+            }
+        )
+    return results
@@ -6,6 +6,8 @@ from typing import Any, Dict, List
 
 from db.models import Lamp
 from db.session import get_session
+from services.telemetry_service import telemetry
+from tracing import span
 
 
 def create_lamp(ip, name):
@@ -73,10 +75,11 @@ def get_all_lamps():
     Returns:
         list: A list of dictionary representations of the lamp objects.
     """
-    session = get_session()
-    lamps = session.query(Lamp).all()
-    session.close()
-    return [lamp.to_dict() for lamp in lamps]
+    with span("db.get_all_lamps"):
+        session = get_session()
+        lamps = session.query(Lamp).order_by(Lamp.id).all()
+        session.close()
+        return [lamp.to_dict() for lamp in lamps]
 
 
 def update_lamp(lamp_id, **kwargs) -> Dict[str, Any] | None:
@@ -111,16 +114,19 @@ def update_lamp_by_ip(ip, **kwargs) -> Dict[str, Any] | None:
     """
     session = get_session()
     try:
-        lamp = session.query(Lamp).filter_by(ip=ip).first()
-        if lamp:
-            for key, value in kwargs.items():
-                setattr(lamp, key, value)
-            session.commit()  # Commit the session changes
-
-            # The lamp object should not be expired because expire_on_commit=False
-            return lamp.to_dict() if lamp else None
-        else:
-            return None
+        with span("db.update_lamp_by_ip", ip=ip):
+            lamp = session.query(Lamp).filter_by(ip=ip).first()
+            if lamp:
+                for key, value in kwargs.items():
+                    setattr(lamp, key, value)
+                session.commit()  # Commit the session changes
+
+                # The lamp object should not be expired because expire_on_commit=False
+                lamp_dict = lamp.to_dict()
+                telemetry.record(lamp_dict)
+                return lamp_dict
+            else:
+                return None
     except Exception as e:
         session.rollback()  # Roll back if there's an error
         raise e
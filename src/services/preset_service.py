@@ -2,28 +2,34 @@
 A module for CRUD operations on the Preset model.
 """
 
-import os
+from typing import TYPE_CHECKING, Any, Dict, List, Tuple
 
-from dotenv import load_dotenv
-
-from db.models import Preset
+from db.models import Lamp, Preset, Schedule, Zone
 from db.session import get_session
-from interfaces.tapo_lamp_interface import TapoLampInterface
+from services.dispatch import run_concurrently
 from services.lamp_service import get_all_lamps
 from services.lamp_service import update_lamp_by_ip as update_lamp
+from settings import get_settings
+from tracing import span
+from utils.coordination import claim_device, device_lock
+
+if TYPE_CHECKING:
+    from interfaces.tapo_lamp_interface import TapoLampInterface
 
 
-def create_preset(name, value):
+def create_preset(name, value, zone_id=None, set_id=None):
     """
     Creates a new preset object.
     Args:
         name (str): The name of the preset.
         value (dict): The value of the preset.
+        zone_id (int | None): The zone the preset targets, all lamps when None.
+        set_id (int | None): The preset set the preset belongs to.
     Returns:
         dict: A dictionary representation of the created preset object.
     """
     session = get_session()
-    preset = Preset(name=name, value=value)
+    preset = Preset(name=name, value=value, zone_id=zone_id, set_id=set_id)
     session.add(preset)
     session.commit()
     session.close()
@@ -74,14 +80,43 @@ def update_preset(preset_id, **kwargs):
     return preset.to_dict()
 
 
+def set_preset_zone(preset_id, zone_id):
+    """
+    Sets the zone a preset targets when it is applied without a zone.
+    Args:
+        preset_id (int): The ID of the preset.
+        zone_id (int | None): The ID of the zone, None for all lamps.
+    Returns:
+        dict: A dictionary representation of the updated preset object.
+    Raises:
+        PresetNotFound: When the preset does not exist.
+        ZoneNotFound: When the zone does not exist.
+    """
+    session = get_session()
+    try:
+        preset = session.get(Preset, preset_id)
+        if preset is None:
+            raise PresetNotFound(f"Preset not found: {preset_id}")
+        if zone_id is not None and session.get(Zone, zone_id) is None:
+            raise ZoneNotFound(f"Zone not found: {zone_id}")
+        preset.zone_id = zone_id
+        session.commit()
+        return preset.to_dict()
+    finally:
+        session.close()
+
+
 def delete_preset(preset_id):
     """
-    Deletes a preset object.
+    Deletes a preset object. Schedules that apply it are disabled.
     Args:
         preset_id (int): The ID of the preset.
     """
     session = get_session()
     preset = session.query(Preset).filter_by(id=preset_id).first()
+    session.query(Schedule).filter_by(preset_id=preset_id).update(
+        {Schedule.preset_id: None, Schedule.enabled: 0}, synchronize_session=False
+    )
     session.delete(preset)
     session.commit()
     session.close()
@@ -91,11 +126,19 @@ def bulk_insert_presets(presets):
     """
     Inserts multiple presets into the database.
     Args:
-        presets (list): A list of dictionaries representing presets.
+        presets (list): A list of dictionaries representing presets, with an
+            optional "zone_id" and "set_id".
     """
     session = get_session()
     for preset in presets:
-        session.add(Preset(name=preset["name"], value=preset["value"]))
+        session.add(
+            Preset(
+                name=preset["name"],
+                value=preset["value"],
+                zone_id=preset.get("zone_id"),
+                set_id=preset.get("set_id"),
+            )
+        )
     session.commit()
     session.close()
 
@@ -107,45 +150,191 @@ class PresetException(Exception):
     pass
 
 
-def apply_preset(value: list | dict, available_lights: list):
+class PresetNotFound(PresetException):
+    pass
+
+
+class ZoneNotFound(PresetException):
+    pass
+
+
+def connect_bulb(ip: str) -> "TapoLampInterface":
+    """
+    Connects to a bulb with the configured Tapo credentials.
+    The device client is imported on first use to keep it out of startup.
+    The handshake holds the lamp's device lock, so workers don't invalidate
+    each other's device sessions. TAPO_DRIVER=async selects the asyncio
+    driver behind the same blocking interface.
+    """
+    # pylint: disable=import-outside-toplevel
+    settings = get_settings()
+    if settings.tapo_driver == "async":
+        from interfaces.tapo_async_interface import (
+            BlockingTapoLampInterface as LampInterface,
+        )
+    else:
+        from interfaces.tapo_lamp_interface import TapoLampInterface as LampInterface
+
+    with device_lock(ip):
+        return LampInterface(ip, settings.tapo_username, settings.tapo_password)
+
+
+def assign_settings(value: list | dict, lamps: list) -> List[Tuple[Any, dict]]:
+    """
+    Pairs lamps with the settings of a preset value. A single setting applies
+    to every lamp. A list of settings is assigned in the given lamp order and
+    starts over when there are more lamps than settings, so a preset written
+    for two bulbs also covers a room with six.
+    Args:
+        value (list | dict): The value of the preset.
+        lamps (list): The lamps, in a stable order.
+    Returns:
+        list: (lamp, setting) pairs.
+    """
+    if isinstance(value, dict):
+        return [(lamp, value) for lamp in lamps]
+    if isinstance(value, list) and value:
+        return [(lamp, value[i % len(value)]) for i, lamp in enumerate(lamps)]
+    return []
+
+
+def _apply_to_lamp(assignment: Tuple[Any, dict]) -> None:
+    lamp, setting = assignment
+    # Claiming the lamp stops a transition that is still driving it
+    claim_device(lamp.ip)
+    apply_setting_to_bulb(setting, connect_bulb(lamp.ip))
+
+
+def _lamp_summary(
+    overrides: Dict[str, Dict[str, Any]] | None = None
+) -> Dict[str, Dict[str, Any]]:
+    # Return an object containing the id, hex and brightness of each lamp
+    summary = {
+        lamp["id"]: {
+            "id": lamp["id"],
+            "hex": lamp["hex"],
+            "brightness": lamp["brightness"],
+            "rgb": lamp["rgb"],
+        }
+        for lamp in get_all_lamps()
+    }
+    for lamp_id, state in (overrides or {}).items():
+        if lamp_id in summary:
+            summary[lamp_id].update(state)
+    return summary
+
+
+def dispatch_settings(assignments: List[Tuple[Any, dict]], transition_ms: int = 0):
+    """
+    Applies the settings to their lamps concurrently. A lamp that fails doesn't
+    stop the others; the failures are raised together once all lamps are done.
+    With a transition duration the lamps fade to the settings in the
+    background instead, and the returned states are the targets.
+    Args:
+        assignments (list): (lamp, setting) pairs.
+        transition_ms (int): Duration of the transition, 0 to apply at once.
+    Returns:
+        dict: The id, hex, brightness and rgb of every lamp, by lamp id.
+    """
+    if transition_ms > 0:
+        # pylint: disable=import-outside-toplevel
+        from services.transition_service import predicted_state, start_transition
+
+        start_transition(assignments, transition_ms)
+        return _lamp_summary(
+            {str(lamp.id): predicted_state(setting) for lamp, setting in assignments}
+        )
+
+    with span("preset.dispatch", lamps=len(assignments)):
+        results = run_concurrently(_apply_to_lamp, assignments)
+    failures = [f"{lamp.ip}: {error}" for (lamp, _), _, error in results if error]
+    if failures:
+        raise PresetException(
+            f"{len(failures)} of {len(results)} lamps failed: " + "; ".join(failures)
+        )
+    return _lamp_summary()
+
+
+def apply_preset(value: list | dict, available_lights: list, transition_ms: int = 0):
     """
     Applies a preset value.
     Args:
         value (list | dict): The value of the preset.
         available_lights (list): A list of available lights.
+        transition_ms (int): Duration of the transition, 0 to apply at once.
     """
     try:
-        load_dotenv()
-        bulbs = [
-            TapoLampInterface(
-                lamp.ip, os.getenv("TAPO_USERNAME"), os.getenv("TAPO_PASSWORD")
+        with span("preset.apply", lamps=len(available_lights)):
+            return dispatch_settings(
+                assign_settings(value, available_lights), transition_ms
             )
-            for lamp in available_lights
+    except PresetException:
+        raise
+    except Exception as e:
+        raise PresetException(f"Failed to apply preset: {e}") from e
+
+
+def apply_to_zones(targets: List[Tuple[int, int | None]], transition_ms: int = 0):
+    """
+    Applies presets to zones in one go. The lamps of all targeted zones are
+    commanded concurrently; when zones overlap, the later target wins.
+    Args:
+        targets (list): (preset_id, zone_id) pairs. Without a zone_id the
+            preset's own zone is used, or all lamps when it has none.
+        transition_ms (int): Duration of the transition, 0 to apply at once.
+    Returns:
+        dict: The id, hex, brightness and rgb of every lamp, by lamp id.
+    Raises:
+        PresetNotFound: When a preset does not exist.
+        ZoneNotFound: When a zone does not exist.
+        PresetException: When applying the settings failed.
+    """
+    session = get_session()
+    try:
+        preset_ids = {preset_id for preset_id, _ in targets}
+        presets = {
+            preset.id: preset
+            for preset in session.query(Preset).filter(Preset.id.in_(preset_ids))
+        }
+        missing = preset_ids - presets.keys()
+        if missing:
+            raise PresetNotFound(f"Preset not found: {sorted(missing)}")
+
+        resolved = [
+            (presets[preset_id], zone_id or presets[preset_id].zone_id)
+            for preset_id, zone_id in targets
         ]
-        if isinstance(value, dict):
-            # Handle a single setting object
-            apply_setting_to_bulb(value, bulbs)
-        elif isinstance(value, list):
-            # Handle multiple settings in an array
-            for setting, bulb in zip(value, bulbs):
-                apply_setting_to_bulb(setting, bulb)
-
-        lamps_data = get_all_lamps()
-        return {  # Return an object containing the id, hex and brightness of each lamp
-            lamp["id"]: {
-                "id": lamp["id"],
-                "hex": lamp["hex"],
-                "brightness": lamp["brightness"],
-                "rgb": lamp["rgb"],
-            }
-            for lamp in lamps_data
+        zone_ids = {zone_id for _, zone_id in resolved if zone_id is not None}
+        existing = {
+            zone_id
+            for (zone_id,) in session.query(Zone.id).filter(Zone.id.in_(zone_ids))
         }
+        if zone_ids - existing:
+            raise ZoneNotFound(f"Zone not found: {sorted(zone_ids - existing)}")
+
+        lamps = session.query(Lamp).order_by(Lamp.id).all()
+    finally:
+        session.close()
+
+    assignments: Dict[int, Tuple[Any, dict]] = {}
+    for preset, zone_id in resolved:
+        zone_lamps = [
+            lamp for lamp in lamps if zone_id is None or lamp.zone_id == zone_id
+        ]
+        for lamp, setting in assign_settings(preset.value, zone_lamps):
+            assignments[lamp.id] = (lamp, setting)
+
+    try:
+        with span("preset.apply_zones", targets=len(targets), lamps=len(assignments)):
+            return dispatch_settings(list(assignments.values()), transition_ms)
+    except PresetException:
+        raise
     except Exception as e:
         raise PresetException(f"Failed to apply preset: {e}") from e
 
 
 def apply_setting_to_bulb(
-    setting: dict, bulb: list[TapoLampInterface] | TapoLampInterface
+    setting: dict, bulb: "list[TapoLampInterface] | TapoLampInterface"
 ):
     """
     Apply a single setting to the bulbs.
@@ -163,6 +352,17 @@ def apply_setting_to_bulb(
             apply_setting_to_bulb(setting, b)
         return
 
+    # Commands and the state read back happen under the lamp's device lock,
+    # so concurrent requests in other workers can't interleave with them
+    with device_lock(bulb.ip):
+        send_setting(setting, bulb)
+
+
+def send_setting(setting: dict, bulb: "TapoLampInterface"):
+    """
+    Sends a setting to a bulb and stores the state read back from it.
+    The caller holds the lamp's device lock.
+    """
     if setting["type"] == "color":
         bulb.setColor(setting["setting"])
     elif setting["type"] == "temp":
@@ -171,18 +371,30 @@ def apply_setting_to_bulb(
     update_lamp(bulb.ip, **bulb.getDeviceProperties())
 
 
-def turn_off_bulbs():
+def _turn_off_lamp(ip: str) -> None:
+    claim_device(ip)
+    bulb = connect_bulb(ip)
+    with device_lock(ip):
+        bulb.turnOff()
+        update_lamp(ip, **bulb.getDeviceProperties())
+
+
+def turn_off_bulbs(zone_ids: List[int] | None = None):
     """
-    Turns off all bulbs.
+    Turns off all bulbs, or the bulbs in the given zones, concurrently.
+    Args:
+        zone_ids (list | None): The zones to turn off, all lamps when None.
     """
-    bulbs = [
-        TapoLampInterface(
-            lamp["ip"], os.getenv("TAPO_USERNAME"), os.getenv("TAPO_PASSWORD")
+    with span("preset.turn_off"):
+        lamps = get_all_lamps()
+        if zone_ids is not None:
+            wanted = {str(zone_id) for zone_id in zone_ids}
+            lamps = [lamp for lamp in lamps if lamp["zone_id"] in wanted]
+        results = run_concurrently(_turn_off_lamp, [lamp["ip"] for lamp in lamps])
+    failures = [f"{ip}: {error}" for ip, _, error in results if error]
+    if failures:
+        raise PresetException(
+            f"{len(failures)} of {len(results)} lamps failed: " + "; ".join(failures)
         )
-        for lamp in get_all_lamps()
-    ]
-    for bulb in bulbs:
-        bulb.turnOff()
-        update_lamp(bulb.ip, **bulb.getDeviceProperties())
 
     return True
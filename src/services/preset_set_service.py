@@ -0,0 +1,190 @@
+"""
+A module for CRUD operations on the PresetSet model.
+
+Every preset update stores its presets as a new set instead of replacing the
+previous ones. Switching back to an earlier set is a single UPDATE, and sets
+beyond the configured history are pruned after each update.
+"""
+
+from typing import List
+
+from sqlalchemy import case, func, or_
+
+from db.models import Preset, PresetSet, Schedule
+from db.session import get_session
+from services.preset_service import PresetException
+
+
+class PresetSetNotFound(PresetException):
+    pass
+
+
+def create_preset_set(source, presets=None, active=False, inputs=None):
+    """
+    Creates a new preset set, optionally with its presets, in one transaction.
+    Args:
+        source (str): How the set was generated.
+        presets (list): Dictionaries with the "name", "value" and optional
+            "zone_id" of each preset.
+        active (bool): Makes the new set the active one.
+        inputs (dict): Fingerprint of the inputs the set was generated from.
+    Returns:
+        dict: A dictionary representation of the created preset set.
+    """
+    session = get_session()
+    preset_set = PresetSet(source=source, inputs=inputs)
+    session.add(preset_set)
+    session.flush()
+    for preset in presets or []:
+        session.add(
+            Preset(
+                name=preset["name"],
+                value=preset["value"],
+                zone_id=preset.get("zone_id"),
+                set_id=preset_set.id,
+            )
+        )
+    if active:
+        _activate(session, preset_set.id)
+    session.commit()
+    session.close()
+    return preset_set.to_dict()
+
+
+def set_preset_set_inputs(set_id, inputs):
+    """
+    Stores the fingerprint of the inputs a preset set was generated from.
+    Args:
+        set_id (int): The ID of the preset set.
+        inputs (dict | None): The fingerprint, None to clear it.
+    """
+    session = get_session()
+    try:
+        session.query(PresetSet).filter(PresetSet.id == set_id).update(
+            {PresetSet.inputs: inputs}, synchronize_session=False
+        )
+        session.commit()
+    finally:
+        session.close()
+
+
+def _activate(session, set_id) -> None:
+    # Only the previously active set and the new one are touched
+    session.query(PresetSet).filter(
+        or_(PresetSet.active == 1, PresetSet.id == set_id)
+    ).update(
+        {PresetSet.active: case((PresetSet.id == set_id, 1), else_=0)},
+        synchronize_session=False,
+    )
+
+
+def activate_preset_set(set_id):
+    """
+    Makes a preset set the active one.
+    Args:
+        set_id (int): The ID of the preset set.
+    Returns:
+        dict: A dictionary representation of the activated preset set.
+    Raises:
+        PresetSetNotFound: When the set does not exist.
+    """
+    session = get_session()
+    preset_set = session.get(PresetSet, set_id)
+    if preset_set is None:
+        session.close()
+        raise PresetSetNotFound(f"Preset set not found: {set_id}")
+    _activate(session, set_id)
+    session.commit()
+    session.refresh(preset_set)
+    session.close()
+    return preset_set.to_dict()
+
+
+def get_active_preset_set():
+    """
+    Retrieves the active preset set with the fingerprint of its inputs.
+    Returns:
+        dict | None: The preset set and its "inputs", or None without an
+            active set.
+    """
+    session = get_session()
+    preset_set = session.query(PresetSet).filter(PresetSet.active == 1).first()
+    session.close()
+    if preset_set is None:
+        return None
+    return {**preset_set.to_dict(), "inputs": preset_set.inputs}
+
+
+def get_preset_sets():
+    """
+    Retrieves all preset sets, newest first, with their number of presets.
+    Returns:
+        list: A list of dictionary representations of the preset sets.
+    """
+    session = get_session()
+    rows = (
+        session.query(PresetSet, func.count(Preset.id))
+        .outerjoin(Preset, Preset.set_id == PresetSet.id)
+        .group_by(PresetSet.id)
+        .order_by(PresetSet.generated_at.desc(), PresetSet.id.desc())
+        .all()
+    )
+    session.close()
+    return [
+        {**preset_set.to_dict(), "preset_count": count} for preset_set, count in rows
+    ]
+
+
+def get_active_presets():
+    """
+    Retrieves the presets of the active set and the presets without a set,
+    ordered by ID.
+    Returns:
+        list: A list of dictionary representations of the preset objects.
+    """
+    session = get_session()
+    presets = (
+        session.query(Preset)
+        .outerjoin(PresetSet, Preset.set_id == PresetSet.id)
+        .filter(or_(Preset.set_id.is_(None), PresetSet.active == 1))
+        .order_by(Preset.id)
+        .all()
+    )
+    session.close()
+    return [preset.to_dict() for preset in presets]
+
+
+def prune_preset_sets(keep: int) -> List[int]:
+    """
+    Deletes the oldest preset sets and their presets, keeping the newest
+    `keep` sets. The active set, and sets with a preset that a schedule
+    applies, are never deleted.
+    Args:
+        keep (int): Number of sets to keep.
+    Returns:
+        list: The IDs of the deleted sets.
+    """
+    session = get_session()
+    active = session.query(PresetSet.id).filter(PresetSet.active == 1).count()
+    scheduled = (
+        session.query(Preset.set_id)
+        .join(Schedule, Schedule.preset_id == Preset.id)
+        .filter(Preset.set_id.is_not(None))
+    )
+    set_ids = [
+        set_id
+        for (set_id,) in session.query(PresetSet.id)
+        .filter(PresetSet.active == 0, PresetSet.id.not_in(scheduled))
+        .order_by(PresetSet.generated_at.desc(), PresetSet.id.desc())
+        .offset(max(0, keep - active))
+    ]
+    if set_ids:
+        session.query(Preset).filter(Preset.set_id.in_(set_ids)).delete(
+            synchronize_session=False
+        )
+        session.query(PresetSet).filter(PresetSet.id.in_(set_ids)).delete(
+            synchronize_session=False
+        )
+        session.commit()
+    session.close()
+    return set_ids
@@ -0,0 +1,274 @@
+"""
+A module for CRUD operations on the Schedule model, and for the times the
+schedules are due.
+
+Fixed times are local times in the configured time zone, so a schedule keeps
+its wall clock time across daylight saving changes. Sunrise and sunset are
+computed for the configured latitude and longitude and the local date.
+All times handed out are in UTC.
+"""
+
+import logging
+from datetime import date, datetime, time, timedelta, timezone, tzinfo
+from functools import cache
+from typing import Any, Dict, Iterable, List, Optional
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+
+from db.models import Preset, Schedule, Zone
+from db.session import get_session
+from interfaces.schemas import WEEKDAYS, ScheduleSpec
+from services.preset_service import (
+    PresetNotFound,
+    ZoneNotFound,
+    apply_to_zones,
+    turn_off_bulbs,
+)
+from settings import get_settings
+from utils.solar import sun_event
+
+# Days searched for the next run, enough to get past a polar night
+MAX_SEARCH_DAYS = 400
+
+logger = logging.getLogger("LuminaSync")
+
+
+class ScheduleException(Exception):
+    pass
+
+
+class ScheduleNotFound(ScheduleException):
+    pass
+
+
+@cache
+def local_timezone() -> tzinfo:
+    name = get_settings().timezone
+    try:
+        return ZoneInfo(name)
+    except (ZoneInfoNotFoundError, ValueError):
+        logger.warning("Unknown time zone %s, the schedules use UTC.", name)
+        return timezone.utc
+
+
+def weekday_mask(names: Iterable[str]) -> int:
+    return sum(1 << WEEKDAYS.index(name) for name in set(names))
+
+
+def weekday_names(mask: int) -> List[str]:
+    return [name for i, name in enumerate(WEEKDAYS) if mask & (1 << i)]
+
+
+def as_utc(value: Optional[datetime]) -> Optional[datetime]:
+    """
+    Makes a naive UTC time from the database timezone-aware.
+    """
+    return None if value is None else value.replace(tzinfo=timezone.utc)
+
+
+def occurrence(schedule: Dict[str, Any], day: date) -> Optional[datetime]:
+    """
+    The time a schedule is due on a local date.
+    Args:
+        schedule (dict): The schedule, as returned by `Schedule.to_dict`.
+        day (date): The local date.
+    Returns:
+        datetime: The due time in UTC, or None when the schedule doesn't run
+            that day, or the sun doesn't rise or set.
+    """
+    if not schedule["weekdays"] & (1 << day.weekday()):
+        return None
+    if schedule["trigger"] == "time":
+        hour, minute = (int(part) for part in schedule["time"].split(":"))
+        local = datetime.combine(day, time(hour, minute), tzinfo=local_timezone())
+        return local.astimezone(timezone.utc)
+    settings = get_settings()
+    event = sun_event(
+        day,
+        settings.latitude,
+        settings.longitude,
+        rising=schedule["trigger"] == "sunrise",
+    )
+    if event is None:
+        return None
+    return event + timedelta(minutes=schedule["offset_minutes"])
+
+
+def next_run(schedule: Dict[str, Any], after: datetime) -> Optional[datetime]:
+    """
+    The first time after `after` that a schedule is due.
+    Returns:
+        datetime: The due time in UTC, or None when it never is.
+    """
+    # An offset can move a sunrise or sunset onto the previous local date
+    day = after.astimezone(local_timezone()).date() - timedelta(days=1)
+    for _ in range(MAX_SEARCH_DAYS):
+        due = occurrence(schedule, day)
+        if due is not None and due > after:
+            return due
+        day += timedelta(days=1)
+    return None
+
+
+def _public(schedule: Schedule, now: datetime) -> Dict[str, Any]:
+    data = schedule.to_dict()
+    due = next_run(data, now) if schedule.enabled else None
+    return {
+        **data,
+        "weekdays": weekday_names(schedule.weekdays),
+        "next_run": due.isoformat() if due else None,
+    }
+
+
+def _apply_spec(session, schedule: Schedule, spec: ScheduleSpec) -> None:
+    if spec.preset_id is not None and session.get(Preset, spec.preset_id) is None:
+        raise PresetNotFound(f"Preset not found: {spec.preset_id}")
+    if spec.zone_id is not None and session.get(Zone, spec.zone_id) is None:
+        raise ZoneNotFound(f"Zone not found: {spec.zone_id}")
+    schedule.name = spec.name
+    schedule.action = spec.action
+    schedule.preset_id = spec.preset_id
+    schedule.zone_id = spec.zone_id
+    schedule.trigger = spec.trigger
+    schedule.time = spec.time
+    schedule.offset_minutes = spec.offset_minutes
+    schedule.weekdays = weekday_mask(spec.weekdays)
+    schedule.transition_ms = spec.transition_ms
+    schedule.enabled = int(spec.enabled)
+
+
+def create_schedule(spec: ScheduleSpec):
+    """
+    Creates a new schedule.
+    Args:
+        spec (ScheduleSpec): The validated schedule.
+    Returns:
+        dict: A dictionary representation of the schedule, with its next run.
+    Raises:
+        PresetNotFound: When the preset does not exist.
+        ZoneNotFound: When the zone does not exist.
+    """
+    session = get_session()
+    try:
+        schedule = Schedule()
+        _apply_spec(session, schedule, spec)
+        session.add(schedule)
+        session.commit()
+        return _public(schedule, datetime.now(timezone.utc))
+    finally:
+        session.close()
+
+
+def update_schedule(schedule_id, spec: ScheduleSpec):
+    """
+    Replaces a schedule. A changed schedule doesn't make up for runs it
+    missed before the change.
+    Args:
+        schedule_id (int): The ID of the schedule.
+        spec (ScheduleSpec): The validated schedule.
+    Returns:
+        dict: A dictionary representation of the schedule, with its next run.
+    Raises:
+        ScheduleNotFound: When the schedule does not exist.
+        PresetNotFound: When the preset does not exist.
+        ZoneNotFound: When the zone does not exist.
+    """
+    session = get_session()
+    try:
+        schedule = session.get(Schedule, schedule_id)
+        if schedule is None:
+            raise ScheduleNotFound(f"Schedule not found: {schedule_id}")
+        _apply_spec(session, schedule, spec)
+        session.commit()
+        return _public(schedule, datetime.now(timezone.utc))
+    finally:
+        session.close()
+
+
+def delete_schedule(schedule_id):
+    """
+    Deletes a schedule.
+    Args:
+        schedule_id (int): The ID of the schedule.
+    Raises:
+        ScheduleNotFound: When the schedule does not exist.
+    """
+    session = get_session()
+    try:
+        schedule = session.get(Schedule, schedule_id)
+        if schedule is None:
+            raise ScheduleNotFound(f"Schedule not found: {schedule_id}")
+        session.delete(schedule)
+        session.commit()
+    finally:
+        session.close()
+
+
+def get_schedules():
+    """
+    Retrieves all schedules, ordered by ID, with their next run.
+    Returns:
+        list: A list of dictionary representations of the schedules.
+    """
+    session = get_session()
+    schedules = session.query(Schedule).order_by(Schedule.id).all()
+    session.close()
+    now = datetime.now(timezone.utc)
+    return [_public(schedule, now) for schedule in schedules]
+
+
+def get_enabled_schedules() -> List[Dict[str, Any]]:
+    """
+    Retrieves the enabled schedules, with the time from which their runs
+    are due: the latest run, or the latest change when that came later.
+    """
+    session = get_session()
+    schedules = session.query(Schedule).filter(Schedule.enabled == 1).all()
+    session.close()
+    return [
+        {
+            **schedule.to_dict(),
+            "due_after": max(
+                as_utc(value)
+                for value in (schedule.updated_at, schedule.last_run_at)
+                if value is not None
+            ),
+        }
+        for schedule in schedules
+    ]
+
+
+def record_run(
+    schedule_id: int, due: datetime, status: str, error: Optional[str] = None
+) -> None:
+    """
+    Stores the outcome of a run, "ok", "failed" or "missed", under the time
+    it was due.
+    """
+    session = get_session()
+    try:
+        schedule = session.get(Schedule, schedule_id)
+        if schedule is None:
+            return
+        schedule.last_run_at = due.astimezone(timezone.utc).replace(tzinfo=None)
+        schedule.last_status = status
+        schedule.last_error = error
+        session.commit()
+    finally:
+        session.close()
+
+
+def run_schedule(schedule: Dict[str, Any]) -> None:
+    """
+    Applies the schedule's preset, or turns its lamps off, through the same
+    path as `/apply` and `/turn-off`.
+    Raises:
+        PresetNotFound: When the preset no longer exists.
+        PresetException: When applying the preset failed.
+    """
+    zone_id = schedule["zone_id"]
+    if schedule["action"] == "off":
+        turn_off_bulbs(None if zone_id is None else [zone_id])
+        return
+    if schedule["preset_id"] is None:
+        raise PresetNotFound("The schedule has no preset.")
+    apply_to_zones([(schedule["preset_id"], zone_id)], schedule["transition_ms"])
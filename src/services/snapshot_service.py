@@ -0,0 +1,209 @@
+"""
+Snapshots of the live lamp states, and restoring them.
+
+Taking a snapshot reads every lamp concurrently and stores the states in a
+single row. Restoring reads the lamps again and only commands the ones whose
+state differs from the snapshot, through the same path as `/lamps/batch`.
+"""
+
+import logging
+from typing import Any, Dict, List, Tuple
+
+from db.models import Lamp, Snapshot
+from db.session import get_session
+from interfaces.schemas import ColorSetting, LampTarget, TempSetting
+from services.dispatch import run_concurrently
+from services.lamp_control_service import send_target
+from services.lamp_service import update_lamp_by_ip as update_lamp
+from services.preset_service import connect_bulb
+from tracing import span
+from utils.color_translate import hsv_to_rgb, rgb_to_hex
+from utils.coordination import claim_device
+
+# Hue and saturation go through a hex color when restored, which can round
+# them by one
+COLOR_TOLERANCE = 1
+
+logger = logging.getLogger("LuminaSync")
+
+
+class SnapshotException(Exception):
+    pass
+
+
+class SnapshotNotFound(SnapshotException):
+    pass
+
+
+def _compact_state(lamp_id: int, properties: Dict[str, Any]) -> list:
+    return [
+        lamp_id,
+        1 if properties["state"] == "On" else 0,
+        properties["color_temp"] or 0,
+        properties["hue"] or 0,
+        properties["saturation"] or 0,
+        properties["brightness"] or 0,
+    ]
+
+
+def _read_lamp(lamp: Tuple[int, str]) -> list:
+    lamp_id, ip = lamp
+    properties = connect_bulb(ip).deviceProperties
+    # The read is free to keep the stored state current
+    update_lamp(ip, **properties)
+    return _compact_state(lamp_id, properties)
+
+
+def _lamps() -> List[Tuple[int, str]]:
+    session = get_session()
+    try:
+        return [
+            (lamp.id, lamp.ip) for lamp in session.query(Lamp).order_by(Lamp.id)
+        ]
+    finally:
+        session.close()
+
+
+def take_snapshot(name: str | None = None) -> Dict[str, Any]:
+    """
+    Reads the state of every lamp concurrently and stores it as a snapshot.
+    Lamps that can't be read are left out.
+    Args:
+        name (str | None): An optional name of the snapshot.
+    Returns:
+        dict: The snapshot, with the IPs of the lamps that could not be read
+            under "failed".
+    """
+    with span("snapshot.take") as snapshot_span:
+        results = run_concurrently(_read_lamp, _lamps())
+        state = [result for _, result, error in results if error is None]
+        failed = [ip for (_, ip), _, error in results if error is not None]
+        snapshot_span.set_attribute("lamps", len(state))
+        snapshot_span.set_attribute("failed", len(failed))
+    for (_, ip), _, error in results:
+        if error is not None:
+            logger.warning("Snapshot could not read %s: %s", ip, error)
+
+    session = get_session()
+    snapshot = Snapshot(name=name, state=state)
+    session.add(snapshot)
+    session.commit()
+    session.close()
+    return {**snapshot.to_dict(), "failed": failed}
+
+
+def get_snapshots() -> List[Dict[str, Any]]:
+    """
+    Retrieves all snapshots, newest first.
+    Returns:
+        list: A list of dictionary representations of the snapshots.
+    """
+    session = get_session()
+    snapshots = (
+        session.query(Snapshot)
+        .order_by(Snapshot.taken_at.desc(), Snapshot.id.desc())
+        .all()
+    )
+    session.close()
+    return [snapshot.to_dict() for snapshot in snapshots]
+
+
+def _target(state: list) -> LampTarget:
+    # The values were read from the lamp, so they are not range checked
+    # again; the lamp may support a wider range than presets use
+    lamp_id, on, color_temp, hue, saturation, brightness = state
+    if not on:
+        return LampTarget.model_construct(lamp_id=lamp_id, on=False)
+    if color_temp:
+        setting = TempSetting.model_construct(
+            setting=color_temp, brightness=brightness
+        )
+    else:
+        color = rgb_to_hex(hsv_to_rgb(hue, saturation, 100))
+        setting = ColorSetting.model_construct(setting=color, brightness=brightness)
+    return LampTarget.model_construct(lamp_id=lamp_id, setting=setting)
+
+
+def _differs(current: list, saved: list) -> bool:
+    """
+    Compares two compact lamp states. Lamps that are off are equal whatever
+    their last color was.
+    """
+    if current[1] != saved[1]:
+        return True
+    if not current[1]:
+        return False
+    # Color temperature and brightness
+    if current[2] != saved[2] or current[5] != saved[5]:
+        return True
+    if current[2]:
+        return False
+    hue_delta = abs(current[3] - saved[3]) % 360
+    return (
+        min(hue_delta, 360 - hue_delta) > COLOR_TOLERANCE
+        or abs(current[4] - saved[4]) > COLOR_TOLERANCE
+    )
+
+
+def _restore_lamp(lamp: Tuple[str, list]) -> Dict[str, Any] | None:
+    """
+    Returns the lamp's new state, or None when it already matched.
+    """
+    ip, saved = lamp
+    claim_device(ip)
+    bulb = connect_bulb(ip)
+    if not _differs(_compact_state(saved[0], bulb.deviceProperties), saved):
+        return None
+    return send_target(bulb, _target(saved))
+
+
+def restore_snapshot(snapshot_id: int | None = None) -> List[Dict[str, Any]]:
+    """
+    Puts the lamps back in the state of a snapshot. Every lamp is read first
+    and only the lamps that changed since are commanded.
+    Args:
+        snapshot_id (int | None): The snapshot to restore, the newest when
+            None.
+    Returns:
+        list: Per lamp of the snapshot, the lamp_id, whether it succeeded,
+            whether it had changed, the lamp's state and the error, if any.
+    Raises:
+        SnapshotNotFound: When the snapshot does not exist.
+    """
+    session = get_session()
+    try:
+        query = session.query(Snapshot)
+        if snapshot_id is None:
+            snapshot = query.order_by(
+                Snapshot.taken_at.desc(), Snapshot.id.desc()
+            ).first()
+        else:
+            snapshot = query.filter_by(id=snapshot_id).first()
+        if snapshot is None:
+            raise SnapshotNotFound(f"Snapshot not found: {snapshot_id or 'latest'}")
+        state = snapshot.state
+    finally:
+        session.close()
+
+    ips = dict(_lamps())
+    lamps = [(ips[saved[0]], saved) for saved in state if saved[0] in ips]
+    with span("snapshot.restore", lamps=len(lamps)) as restore_span:
+        results = run_concurrently(_restore_lamp, lamps)
+        restore_span.set_attribute(
+            "changed", sum(lamp is not None for _, lamp, _ in results)
+        )
+
+    outcomes = []
+    for (_, saved), lamp, error in results:
+        if error is not None:
+            logger.warning("Restoring lamp %s failed: %s", saved[0], error)
+        outcomes.append(
+            {
+                "lamp_id": saved[0],
+                "success": error is None,
+                "changed": error is None and lamp is not None,
+                "lamp": lamp,
+                "error": str(error) if error else None,
+            }
+        )
+    return outcomes
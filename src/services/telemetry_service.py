@@ -0,0 +1,424 @@
+"""
+The history of lamp states, and its hourly and daily rollups.
+
+Every state written by `update_lamp_by_ip` is passed to the recorder, which
+keeps it only when it differs from the last state of that lamp. The changes
+are buffered and written in batches by a background thread, straight through
+the engine, so recording a state costs no database round trip in the request
+and doesn't invalidate the cached dashboards.
+
+The same thread rolls the samples up into the time each lamp was on, its
+average brightness and its number of changes per hour and per day, and
+deletes rows past their retention. All times are naive UTC.
+"""
+
+import atexit
+import logging
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, List, Optional, Tuple
+
+from sqlalchemy import and_, delete, func, insert, select
+from sqlalchemy.exc import SQLAlchemyError
+
+from db.models import LampRollup, LampSample
+from db.session import engine, get_session
+from metrics import counter
+from settings import get_settings
+from utils.coordination import LockTimeout, named_lock
+
+# A full batch is written right away instead of waiting for the thread
+BATCH_SIZE = 200
+# Samples kept in memory while the database can't be written
+MAX_PENDING = 10_000
+MAINTENANCE_INTERVAL = 3600
+MAX_HISTORY_ROWS = 10_000
+RESOLUTIONS = ("raw", "hour", "day")
+SETTINGS = ("brightness", "color_temp", "hue", "saturation")
+
+TELEMETRY_SAMPLES = counter(
+    "luminasync_telemetry_samples_total",
+    "Lamp state changes, by whether they were written or dropped.",
+    ["outcome"],
+)
+
+logger = logging.getLogger("LuminaSync")
+
+
+class InvalidHistoryQuery(Exception):
+    pass
+
+
+def utcnow() -> datetime:
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+def _hour(moment: datetime) -> datetime:
+    return moment.replace(minute=0, second=0, microsecond=0)
+
+
+def _day(moment: datetime) -> datetime:
+    return moment.replace(hour=0, minute=0, second=0, microsecond=0)
+
+
+class TelemetryRecorder:
+    """
+    Buffers lamp state changes and writes them in batches.
+    """
+
+    def __init__(self) -> None:
+        self._pending: List[Dict[str, Any]] = []
+        # The last state seen per lamp, to skip states that didn't change
+        self._last: Dict[int, tuple] = {}
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def record(self, lamp: Dict[str, Any]) -> None:
+        """
+        Records the state of a lamp, as returned by `Lamp.to_dict`, when it
+        changed.
+        """
+        if not get_settings().telemetry_enabled:
+            return
+        lamp_id = int(lamp["id"])
+        on = 1 if lamp["state"] == "On" else 0
+        # The settings of a lamp that is off don't matter
+        state = (on,)
+        if on:
+            state += tuple(lamp[name] for name in SETTINGS)
+        with self._lock:
+            if self._last.get(lamp_id) == state:
+                return
+            self._last[lamp_id] = state
+            self._pending.append(
+                {
+                    "lamp_id": lamp_id,
+                    "recorded_at": utcnow(),
+                    "on": on,
+                    **{name: lamp[name] for name in SETTINGS},
+                }
+            )
+            full = len(self._pending) >= BATCH_SIZE
+        if full:
+            self.flush()
+
+    def flush(self) -> int:
+        """
+        Writes the buffered samples with a single insert.
+        Returns:
+            int: The number of samples written.
+        """
+        with self._flush_lock:
+            with self._lock:
+                rows, self._pending = self._pending, []
+            if not rows:
+                return 0
+            try:
+                with engine.begin() as connection:
+                    connection.execute(insert(LampSample), rows)
+            except SQLAlchemyError as e:
+                logger.warning("Could not write %s lamp samples: %s", len(rows), e)
+                with self._lock:
+                    self._pending[:0] = rows
+                    dropped = len(self._pending) - MAX_PENDING
+                    if dropped > 0:
+                        del self._pending[:dropped]
+                        TELEMETRY_SAMPLES.inc("dropped", amount=dropped)
+                return 0
+            TELEMETRY_SAMPLES.inc("written", amount=len(rows))
+            return len(rows)
+
+    def start(self) -> None:
+        settings = get_settings()
+        if not settings.telemetry_enabled:
+            return
+        if self._thread is not None and self._thread.is_alive():
+            return
+        # Continue from the stored states, so a restart adds no changes
+        with engine.connect() as connection:
+            rows = connection.execute(latest_samples()).all()
+        with self._lock:
+            for row in rows:
+                state = (row.on,)
+                if row.on:
+                    state += tuple(getattr(row, name) for name in SETTINGS)
+                self._last.setdefault(row.lamp_id, state)
+        self._stop.clear()
+        self._thread = threading.Thread(
+            target=self._run,
+            args=(settings.telemetry_flush_interval,),
+            name="telemetry",
+            daemon=True,
+        )
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        self.flush()
+
+    def _run(self, flush_interval: float) -> None:
+        next_maintenance = 0.0
+        while not self._stop.wait(flush_interval):
+            try:
+                self.flush()
+                if time.monotonic() >= next_maintenance:
+                    maintain()
+                    next_maintenance = time.monotonic() + MAINTENANCE_INTERVAL
+            except Exception:  # pylint: disable=broad-except
+                logger.exception("Telemetry maintenance failed.")
+
+
+telemetry = TelemetryRecorder()
+atexit.register(telemetry.flush)
+
+
+def latest_samples(before: Optional[datetime] = None):
+    """
+    A query for the latest sample of every lamp, optionally before a moment.
+    """
+    latest = select(
+        LampSample.lamp_id, func.max(LampSample.recorded_at).label("recorded_at")
+    )
+    if before is not None:
+        latest = latest.where(LampSample.recorded_at < before)
+    latest = latest.group_by(LampSample.lamp_id).subquery()
+    return select(LampSample).join(
+        latest,
+        and_(
+            LampSample.lamp_id == latest.c.lamp_id,
+            LampSample.recorded_at == latest.c.recorded_at,
+        ),
+    )
+
+
+def _add_segment(totals, lamp_id: int, state, begin: datetime, end: datetime):
+    """
+    Adds the time from `begin` to `end` in `state` to the hours it spans.
+    """
+    if state is None or not state[0]:
+        return
+    while begin < end:
+        boundary = min(end, _hour(begin) + timedelta(hours=1))
+        seconds = (boundary - begin).total_seconds()
+        entry = totals.setdefault((lamp_id, _hour(begin)), [0.0, 0.0, 0])
+        entry[0] += seconds
+        entry[1] += seconds * (state[1] or 0)
+        begin = boundary
+
+
+def integrate_hours(
+    previous: Dict[int, tuple],
+    samples: List[tuple],
+    start: datetime,
+    end: datetime,
+) -> Dict[Tuple[int, datetime], list]:
+    """
+    Turns samples into per hour totals, treating the state of a lamp as
+    constant until its next sample.
+    Args:
+        previous (dict): Per lamp, the (on, brightness) state at `start`.
+        samples (list): (lamp_id, recorded_at, on, brightness) tuples between
+            `start` and `end`, ordered by lamp and time.
+        start (datetime): The start of the first hour.
+        end (datetime): The end of the last hour.
+    Returns:
+        dict: [on_seconds, brightness_seconds, changes] per (lamp_id, hour).
+    """
+    totals: Dict[Tuple[int, datetime], list] = {}
+    by_lamp: Dict[int, List[tuple]] = {}
+    for sample in samples:
+        by_lamp.setdefault(sample[0], []).append(sample)
+    for lamp_id in set(previous) | set(by_lamp):
+        state, moment = previous.get(lamp_id), start
+        for _, recorded_at, on, brightness in by_lamp.get(lamp_id, []):
+            _add_segment(totals, lamp_id, state, moment, recorded_at)
+            totals.setdefault((lamp_id, _hour(recorded_at)), [0.0, 0.0, 0])[2] += 1
+            state, moment = (on, brightness), recorded_at
+        _add_segment(totals, lamp_id, state, moment, end)
+    return totals
+
+
+def roll_up(now: Optional[datetime] = None) -> int:
+    """
+    Recomputes the hourly rollups since the last hour with activity, up to
+    the current hour, and the daily rollups of the days they belong to.
+    Returns:
+        int: The number of hourly rollups written.
+    """
+    end = _hour(now or utcnow())
+    with engine.begin() as connection:
+        start = connection.execute(
+            select(func.max(LampRollup.period_start)).where(
+                LampRollup.period == "hour"
+            )
+        ).scalar()
+        if start is None:
+            first = connection.execute(
+                select(func.min(LampSample.recorded_at))
+            ).scalar()
+            if first is None:
+                return 0
+            start = _hour(first)
+        if start >= end:
+            return 0
+
+        previous = {
+            row.lamp_id: (row.on, row.brightness)
+            for row in connection.execute(latest_samples(before=start))
+        }
+        samples = connection.execute(
+            select(
+                LampSample.lamp_id,
+                LampSample.recorded_at,
+                LampSample.on,
+                LampSample.brightness,
+            )
+            .where(LampSample.recorded_at >= start, LampSample.recorded_at < end)
+            .order_by(LampSample.lamp_id, LampSample.recorded_at, LampSample.id)
+        ).all()
+        hours = integrate_hours(previous, samples, start, end)
+        _replace_rollups(connection, "hour", start, end, hours)
+
+        # The days are summed from their hours
+        day_start = _day(start)
+        days: Dict[Tuple[int, datetime], list] = {}
+        for lamp_id, period_start, on_seconds, brightness_seconds, changes in (
+            connection.execute(
+                select(
+                    LampRollup.lamp_id,
+                    LampRollup.period_start,
+                    LampRollup.on_seconds,
+                    LampRollup.brightness_seconds,
+                    LampRollup.changes,
+                ).where(
+                    LampRollup.period == "hour", LampRollup.period_start >= day_start
+                )
+            )
+        ):
+            entry = days.setdefault((lamp_id, _day(period_start)), [0.0, 0.0, 0])
+            entry[0] += on_seconds
+            entry[1] += brightness_seconds
+            entry[2] += changes
+        _replace_rollups(connection, "day", day_start, end, days)
+    return len(hours)
+
+
+def _replace_rollups(connection, period: str, start, end, totals) -> None:
+    connection.execute(
+        delete(LampRollup).where(
+            LampRollup.period == period,
+            LampRollup.period_start >= start,
+            LampRollup.period_start < end,
+        )
+    )
+    if totals:
+        connection.execute(
+            insert(LampRollup),
+            [
+                {
+                    "lamp_id": lamp_id,
+                    "period": period,
+                    "period_start": period_start,
+                    "on_seconds": on_seconds,
+                    "brightness_seconds": brightness_seconds,
+                    "changes": changes,
+                }
+                for (lamp_id, period_start), (
+                    on_seconds,
+                    brightness_seconds,
+                    changes,
+                ) in totals.items()
+            ],
+        )
+
+
+def apply_retention(now: Optional[datetime] = None) -> None:
+    """
+    Deletes samples and rollups past their retention. The latest sample of
+    every lamp is kept, since it holds the lamp's current state.
+    """
+    settings = get_settings()
+    now = now or utcnow()
+    latest = select(func.max(LampSample.id)).group_by(LampSample.lamp_id)
+    with engine.begin() as connection:
+        samples = connection.execute(
+            delete(LampSample).where(
+                LampSample.recorded_at
+                < now - timedelta(days=settings.telemetry_sample_days),
+                LampSample.id.not_in(latest),
+            )
+        ).rowcount
+        rollups = 0
+        for period, days in (
+            ("hour", settings.telemetry_hourly_days),
+            ("day", settings.telemetry_daily_days),
+        ):
+            rollups += connection.execute(
+                delete(LampRollup).where(
+                    LampRollup.period == period,
+                    LampRollup.period_start < now - timedelta(days=days),
+                )
+            ).rowcount
+    if samples or rollups:
+        logger.info(
+            "Deleted %s lamp samples and %s rollups past retention.", samples, rollups
+        )
+
+
+def maintain(now: Optional[datetime] = None) -> None:
+    """
+    Rolls up and applies the retention, in one worker at a time.
+    """
+    try:
+        with named_lock("telemetry").acquire(timeout=0.1):
+            roll_up(now)
+            apply_retention(now)
+    except LockTimeout:
+        logger.debug("Telemetry maintenance runs in another worker.")
+
+
+def get_lamp_history(
+    lamp_id: int, start: datetime, end: datetime, resolution: str = "raw"
+) -> List[Dict[str, Any]]:
+    """
+    Retrieves the history of a lamp between two moments.
+    Args:
+        lamp_id (int): The lamp.
+        start (datetime): The start of the range, naive UTC.
+        end (datetime): The end of the range, naive UTC.
+        resolution (str): "raw" for the state changes, "hour" or "day" for
+            the rollups.
+    Returns:
+        list: The samples or rollups, oldest first.
+    Raises:
+        InvalidHistoryQuery: For an unknown resolution or an empty range.
+    """
+    if resolution not in RESOLUTIONS:
+        raise InvalidHistoryQuery(f"Unknown resolution: {resolution}")
+    if start >= end:
+        raise InvalidHistoryQuery("The start must be before the end.")
+    # Samples of the lamp that are still buffered belong to the history
+    telemetry.flush()
+
+    session = get_session()
+    try:
+        if resolution == "raw":
+            column = LampSample.recorded_at
+            query = session.query(LampSample).filter(LampSample.lamp_id == lamp_id)
+        else:
+            column = LampRollup.period_start
+            query = session.query(LampRollup).filter(
+                LampRollup.lamp_id == lamp_id, LampRollup.period == resolution
+            )
+        rows = (
+            query.filter(column >= start, column < end)
+            .order_by(column)
+            .limit(MAX_HISTORY_ROWS)
+            .all()
+        )
+        return [row.to_dict() for row in rows]
+    finally:
+        session.close()
@@ -0,0 +1,321 @@
+"""
+Smooth transitions from the current lamp states to new settings.
+
+The frames of every lamp are computed up front through the color utilities.
+A scheduler thread then sends frame N to all lamps together, waits for the
+next tick and moves on, so the lamps change in lockstep instead of one after
+another. The tick interval follows from TRANSITION_COMMAND_RATE, so no lamp
+gets more commands per second than that. When the lamps respond too slowly
+for the schedule, frames are skipped rather than sent late.
+
+Every lamp is claimed when the transition starts (see `claim_device`). Any
+later command claims it again, so the transition stops driving that lamp
+before its next frame, in this worker or another one.
+"""
+
+import logging
+import threading
+import time
+import uuid
+from dataclasses import dataclass
+from functools import partial
+from typing import Any, Dict, List, Optional, Tuple
+
+from metrics import counter, gauge
+from services.dispatch import run_concurrently
+from services.preset_service import connect_bulb, send_setting
+from settings import get_settings
+from tracing import span
+from utils.color_translate import (
+    hex_to_rgb,
+    hsv_to_rgb,
+    interpolate_frames,
+    kelvin_to_rgb,
+    rgb_to_hex,
+    rgb_to_hsv,
+    tuple_to_rgb_string,
+)
+from utils.coordination import claim_device, device_lock, owns_device
+
+# A frame sets the color or the color temperature, then the brightness
+COMMANDS_PER_FRAME = 2
+MIN_BRIGHTNESS = 1
+# Seconds the shutdown waits for the running transitions to stop
+SHUTDOWN_TIMEOUT = 5.0
+
+TRANSITION_FRAMES = counter(
+    "luminasync_transition_frames_total",
+    "Frames per lamp by outcome: sent, skipped when behind schedule, "
+    "cancelled by a newer command or failed.",
+    ["outcome"],
+)
+ACTIVE_TRANSITIONS = gauge(
+    "luminasync_active_transitions",
+    "Transitions currently running in this process.",
+)
+
+logger = logging.getLogger("LuminaSync")
+
+
+def _current_state(lamp) -> tuple:
+    """
+    The lamp's last known state as ("hsv", hue, saturation, brightness) or
+    ("temp", kelvin, brightness). A lamp that is off starts from the lowest
+    brightness.
+    """
+    brightness = lamp.brightness if lamp.state == "On" and lamp.brightness else 0
+    brightness = max(MIN_BRIGHTNESS, brightness)
+    if lamp.color_temp:
+        return ("temp", lamp.color_temp, brightness)
+    return ("hsv", lamp.hue or 0, lamp.saturation or 0, brightness)
+
+
+def _target_state(setting: dict) -> tuple:
+    if setting["type"] == "color":
+        return ("hsv", *rgb_to_hsv(hex_to_rgb(setting["setting"])))
+    return ("temp", setting["setting"], setting["brightness"])
+
+
+def _as_hsv(state: tuple) -> tuple:
+    if state[0] == "hsv":
+        return state[1:]
+    hue, saturation, _ = rgb_to_hsv(kelvin_to_rgb(state[1]))
+    return hue, saturation, state[2]
+
+
+def plan_frames(lamp, setting: dict, steps: int) -> List[tuple]:
+    """
+    Computes the frames taking a lamp from its current state to a setting.
+    Between two color temperatures the temperature is interpolated; any other
+    change is interpolated in HSV, with white light mapped to its approximate
+    color. The last frame is the target itself.
+    """
+    start = _current_state(lamp)
+    end = _target_state(setting)
+    if start[0] == end[0] == "temp":
+        frames = [
+            ("temp", *frame) for frame in interpolate_frames(start[1:], end[1:], steps)
+        ]
+    else:
+        frames = [
+            ("hsv", *frame)
+            for frame in interpolate_frames(
+                _as_hsv(start), _as_hsv(end), steps, hue_index=0
+            )
+        ]
+    # Brightness 0 turns a bulb off, which only the target may do
+    frames = [(*frame[:-1], max(MIN_BRIGHTNESS, frame[-1])) for frame in frames]
+    frames[-1] = end
+    return frames
+
+
+def predicted_state(setting: dict) -> Dict[str, Any]:
+    """
+    The hex, rgb and brightness a lamp reports once the setting is applied,
+    derived the same way as the state read back from the bulb.
+    """
+    if setting["type"] == "color":
+        hue, saturation, brightness = rgb_to_hsv(hex_to_rgb(setting["setting"]))
+    else:
+        hue, saturation, brightness = 0, 0, setting["brightness"]
+    rgb = hsv_to_rgb(hue, saturation, brightness)
+    return {
+        "hex": rgb_to_hex(rgb),
+        "rgb": tuple_to_rgb_string(rgb),
+        "brightness": brightness,
+    }
+
+
+@dataclass
+class _LampTransition:
+    ip: str
+    setting: dict
+    frames: List[tuple]
+    token: str
+    turn_on: bool
+    bulb: Any = None
+    last: Optional[tuple] = None
+    active: bool = True
+
+
+class Transition:
+    """
+    A running transition of one or more lamps.
+    Attributes:
+        transition_id (str): Identifies the transition in logs and traces.
+        duration (float): Planned duration in seconds.
+        steps (int): Number of frames per lamp.
+    """
+
+    def __init__(self, lamps: List[_LampTransition], duration: float, steps: int):
+        self.transition_id = uuid.uuid4().hex[:12]
+        self.lamps = lamps
+        self.duration = duration
+        self.steps = steps
+        self._cancelled = threading.Event()
+        self._done = threading.Event()
+        self._thread = threading.Thread(
+            target=self._run, name=f"transition-{self.transition_id}", daemon=True
+        )
+
+    def start(self) -> None:
+        with _active_lock:
+            _active[self.transition_id] = self
+        self._thread.start()
+
+    def cancel(self) -> None:
+        self._cancelled.set()
+
+    def wait(self, timeout: Optional[float] = None) -> bool:
+        return self._done.wait(timeout)
+
+    def _run(self) -> None:
+        try:
+            with span(
+                "transition",
+                transition_id=self.transition_id,
+                lamps=len(self.lamps),
+                steps=self.steps,
+                duration_ms=round(self.duration * 1000),
+            ):
+                self._connect()
+                self._schedule()
+        except Exception:  # pylint: disable=broad-except
+            logger.exception("Transition %s failed.", self.transition_id)
+        finally:
+            with _active_lock:
+                _active.pop(self.transition_id, None)
+            self._done.set()
+
+    def _connect(self) -> None:
+        def connect(lamp: _LampTransition):
+            lamp.bulb = connect_bulb(lamp.ip)
+
+        for lamp, _, error in run_concurrently(connect, self.lamps):
+            if error:
+                logger.warning("Transition could not reach %s: %s", lamp.ip, error)
+                lamp.active = False
+
+    def _schedule(self) -> None:
+        interval = self.duration / self.steps
+        started = time.monotonic()
+        for index in range(self.steps):
+            lamps = [lamp for lamp in self.lamps if lamp.active]
+            if not lamps or self._cancelled.is_set():
+                TRANSITION_FRAMES.inc("cancelled", amount=len(lamps))
+                return
+            final = index == self.steps - 1
+            # Frame `index` is due at the end of its interval. When the next
+            # frame is already due, this one is skipped to catch up.
+            due = started + (index + 1) * interval
+            if not final and time.monotonic() > due + interval:
+                TRANSITION_FRAMES.inc("skipped", amount=len(lamps))
+                continue
+            delay = due - time.monotonic()
+            if delay > 0 and self._cancelled.wait(delay):
+                continue
+
+            run_concurrently(partial(self._send, index=index, final=final), lamps)
+
+    def _send(self, lamp: _LampTransition, index: int, final: bool) -> None:
+        frame = lamp.frames[index]
+        with device_lock(lamp.ip):
+            if not owns_device(lamp.ip, lamp.token):
+                lamp.active = False
+                TRANSITION_FRAMES.inc("cancelled")
+                return
+            try:
+                if final:
+                    # The target goes through the regular apply path, which
+                    # also stores the state read back from the bulb
+                    send_setting(lamp.setting, lamp.bulb)
+                else:
+                    self._send_frame(lamp, frame)
+            except Exception as e:  # pylint: disable=broad-except
+                logger.warning(
+                    "Transition %s stopped for %s: %s", self.transition_id, lamp.ip, e
+                )
+                lamp.active = False
+                TRANSITION_FRAMES.inc("failed")
+                return
+        lamp.last = frame
+        TRANSITION_FRAMES.inc("sent")
+
+    @staticmethod
+    def _send_frame(lamp: _LampTransition, frame: tuple) -> None:
+        """
+        Sends only the parts of the frame that changed since the last one.
+        """
+        last = lamp.last
+        if lamp.turn_on:
+            lamp.bulb.turnOn()
+            lamp.turn_on = False
+        if frame[0] == "temp":
+            if last is None or last[0] != "temp" or last[1] != frame[1]:
+                lamp.bulb.setColorTemperature(frame[1])
+        elif last is None or last[0] != "hsv" or last[1:3] != frame[1:3]:
+            lamp.bulb.setHueSaturation(frame[1], frame[2])
+        if last is None or last[-1] != frame[-1]:
+            lamp.bulb.setBrightness(frame[-1])
+
+
+_active: Dict[str, Transition] = {}
+_active_lock = threading.Lock()
+ACTIVE_TRANSITIONS.set_function(function=lambda: len(_active))
+
+
+def start_transition(
+    assignments: List[Tuple[Any, dict]], duration_ms: int
+) -> Transition:
+    """
+    Starts fading lamps to their settings and returns without waiting.
+    The lamps are claimed before this returns, so a transition or command
+    issued afterwards always wins.
+    Args:
+        assignments (list): (lamp, setting) pairs, lamps as database rows.
+        duration_ms (int): Duration of the transition in milliseconds.
+    Returns:
+        Transition: The running transition.
+    """
+    duration = duration_ms / 1000
+    rate = get_settings().transition_command_rate
+    steps = max(1, int(duration * rate / COMMANDS_PER_FRAME))
+    lamps = [
+        _LampTransition(
+            ip=lamp.ip,
+            setting=setting,
+            frames=plan_frames(lamp, setting, steps),
+            token=claim_device(lamp.ip),
+            turn_on=lamp.state != "On",
+        )
+        for lamp, setting in assignments
+    ]
+    transition = Transition(lamps, duration, steps)
+    logger.info(
+        "Starting transition %s of %s lamps over %s ms in %s frames.",
+        transition.transition_id,
+        len(lamps),
+        duration_ms,
+        steps,
+    )
+    transition.start()
+    return transition
+
+
+def cancel_all(timeout: float = SHUTDOWN_TIMEOUT) -> None:
+    """
+    Stops all transitions running in this process, at shutdown. Frames being
+    sent are finished, so no lamp is left halfway through a command.
+    Args:
+        timeout (float): Seconds to wait for the transitions to stop in total.
+    """
+    with _active_lock:
+        transitions = list(_active.values())
+    for transition in transitions:
+        transition.cancel()
+    deadline = time.monotonic() + timeout
+    for transition in transitions:
+        if not transition.wait(max(0.0, deadline - time.monotonic())):
+            logger.warning(
+                "Transition %s did not stop in time.", transition.transition_id
+            )
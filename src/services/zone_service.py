@@ -0,0 +1,182 @@
+"""
+A module for CRUD operations on the Zone model.
+"""
+
+from sqlalchemy.exc import IntegrityError
+
+from db.models import Lamp, Preset, Schedule, Zone
+from db.session import get_session
+from services.preset_service import ZoneNotFound
+
+
+class ZoneException(Exception):
+    pass
+
+
+class ZoneNameTaken(ZoneException):
+    pass
+
+
+class LampNotFound(ZoneException):
+    pass
+
+
+def create_zone(name):
+    """
+    Creates a new zone object.
+    Args:
+        name (str): The name of the zone.
+    Returns:
+        dict: A dictionary representation of the created zone object.
+    Raises:
+        ZoneNameTaken: When another zone has the name.
+    """
+    session = get_session()
+    try:
+        zone = Zone(name=name)
+        session.add(zone)
+        session.commit()
+        return {**zone.to_dict(), "lamp_ids": []}
+    except IntegrityError as e:
+        session.rollback()
+        raise ZoneNameTaken(f"Zone name taken: {name}") from e
+    finally:
+        session.close()
+
+
+def rename_zone(zone_id, name):
+    """
+    Renames a zone object.
+    Args:
+        zone_id (int): The ID of the zone.
+        name (str): The new name of the zone.
+    Returns:
+        dict: A dictionary representation of the zone, with its lamp IDs.
+    Raises:
+        ZoneNotFound: When the zone does not exist.
+        ZoneNameTaken: When another zone has the name.
+    """
+    session = get_session()
+    try:
+        zone = session.get(Zone, zone_id)
+        if zone is None:
+            raise ZoneNotFound(f"Zone not found: {zone_id}")
+        zone.name = name
+        session.commit()
+        return _with_lamps(session, zone)
+    except IntegrityError as e:
+        session.rollback()
+        raise ZoneNameTaken(f"Zone name taken: {name}") from e
+    finally:
+        session.close()
+
+
+def _with_lamps(session, zone: Zone):
+    lamp_ids = session.query(Lamp.id).filter_by(zone_id=zone.id).order_by(Lamp.id)
+    return {**zone.to_dict(), "lamp_ids": [str(lamp_id) for (lamp_id,) in lamp_ids]}
+
+
+def get_zone_by_id(zone_id):
+    """
+    Retrieves a zone object by its ID.
+    Args:
+        zone_id (int): The ID of the zone.
+    Returns:
+        dict: A dictionary representation of the zone object.
+    """
+    session = get_session()
+    zone = session.query(Zone).filter_by(id=zone_id).first()
+    session.close()
+    return zone.to_dict() if zone else None
+
+
+def get_all_zones():
+    """
+    Retrieves all zone objects, with the IDs of their lamps.
+    Returns:
+        list: A list of dictionary representations of the zone objects.
+    """
+    session = get_session()
+    try:
+        zones = session.query(Zone).order_by(Zone.id).all()
+        return [_with_lamps(session, zone) for zone in zones]
+    finally:
+        session.close()
+
+
+def get_lamps_in_zone(zone_id):
+    """
+    Retrieves the lamps of a zone, ordered by ID.
+    Args:
+        zone_id (int): The ID of the zone.
+    Returns:
+        list: A list of dictionary representations of the lamp objects.
+    """
+    session = get_session()
+    lamps = session.query(Lamp).filter_by(zone_id=zone_id).order_by(Lamp.id).all()
+    session.close()
+    return [lamp.to_dict() for lamp in lamps]
+
+
+def assign_lamps_to_zone(zone_id, lamp_ids):
+    """
+    Moves lamps into a zone.
+    Args:
+        zone_id (int | None): The ID of the zone, None removes the lamps from
+            their zone.
+        lamp_ids (list): The IDs of the lamps.
+    Returns:
+        int: The number of lamps updated.
+    Raises:
+        ZoneNotFound: When the zone does not exist.
+        LampNotFound: When a lamp does not exist.
+    """
+    session = get_session()
+    try:
+        if zone_id is not None and session.get(Zone, zone_id) is None:
+            raise ZoneNotFound(f"Zone not found: {zone_id}")
+        lamp_ids = set(lamp_ids)
+        existing = {
+            lamp_id
+            for (lamp_id,) in session.query(Lamp.id).filter(Lamp.id.in_(lamp_ids))
+        }
+        if lamp_ids - existing:
+            raise LampNotFound(f"Lamp not found: {sorted(lamp_ids - existing)}")
+        updated = (
+            session.query(Lamp)
+            .filter(Lamp.id.in_(lamp_ids))
+            .update({Lamp.zone_id: zone_id}, synchronize_session=False)
+        )
+        session.commit()
+        return updated
+    finally:
+        session.close()
+
+
+def delete_zone(zone_id):
+    """
+    Deletes a zone object. Its lamps and presets are kept without a zone, its
+    schedules are kept disabled, rather than applying to all lamps.
+    Args:
+        zone_id (int): The ID of the zone.
+    Raises:
+        ZoneNotFound: When the zone does not exist.
+    """
+    session = get_session()
+    try:
+        zone = session.query(Zone).filter_by(id=zone_id).first()
+        if zone is None:
+            raise ZoneNotFound(f"Zone not found: {zone_id}")
+        session.query(Lamp).filter_by(zone_id=zone_id).update(
+            {Lamp.zone_id: None}, synchronize_session=False
+        )
+        session.query(Preset).filter_by(zone_id=zone_id).update(
+            {Preset.zone_id: None}, synchronize_session=False
+        )
+        session.query(Schedule).filter_by(zone_id=zone_id).update(
+            {Schedule.zone_id: None, Schedule.enabled: 0}, synchronize_session=False
+        )
+        session.delete(zone)
+        session.commit()
+    finally:
+        session.close()
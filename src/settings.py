@@ -0,0 +1,261 @@
+"""
+Application settings, read once from the environment and the .env file.
+"""
+
+import os
+from dataclasses import dataclass
+from functools import cache
+
+from dotenv import load_dotenv
+
+
+def _env_flag(name: str, default: bool = False) -> bool:
+    """
+    Flags are enabled by their presence, like the existing DEBUG variable,
+    unless they are explicitly set to a false value.
+    """
+    value = os.getenv(name)
+    if value is None:
+        return default
+    return value.strip().lower() not in ("0", "false", "no", "off")
+
+
+def _env_number(name: str, default, convert, minimum=None):
+    """
+    Reads a number, or the default when the variable is not set, raised to
+    the minimum when one is given.
+    """
+    value = os.getenv(name)
+    number = default if value is None else convert(value)
+    return number if minimum is None else max(minimum, number)
+
+
+def _env_int(name: str, default: int, minimum: int | None = None) -> int:
+    return _env_number(name, default, int, minimum)
+
+
+def _env_float(name: str, default: float, minimum: float | None = None) -> float:
+    return _env_number(name, default, float, minimum)
+
+
+@dataclass(frozen=True)
+class Settings:
+    """
+    Typed view of the configuration.
+    Attributes:
+        tapo_username (str): Account used to authenticate with the bulbs.
+        tapo_password (str): Password of the Tapo account.
+        openai_api_key (str): Key for the OpenAI API.
+        newsdata_api_key (str): Key for the newsdata.io API.
+        debug (bool): Enables debug logging and auto reload.
+        database_url (str): SQLAlchemy URL of the database.
+        latitude (float): Latitude used for weather data and sunrise and sunset.
+        longitude (float): Longitude used for weather data and sunrise and sunset.
+        news_country (str): Country code for the local news feed.
+        news_query (str): Search query for the local news feed.
+        port (int): Port the web server listens on.
+        workers (int): Number of worker processes serving the app.
+        device_concurrency (int): Lamps commanded at the same time per worker.
+        transition_command_rate (float): Commands per second a transition may
+            send to one lamp.
+        device_command_rate (float): Sustained commands per second any lamp
+            accepts, across all workers. Only commands that change the lamp's
+            state count, device info reads aren't limited. 0 disables the limit.
+        device_command_burst (int): Commands a lamp accepts at once before
+            the rate limit applies, enough for a few applies in a row.
+        tapo_session_store (bool): Reuses the lamp sessions stored encrypted
+            in db/sessions, also after a restart.
+        tapo_driver (str): Client used for the lamps: "pyp100", one blocking
+            PyP100 client per lamp, or "async", the asyncio driver sharing a
+            pool of connections on one event loop.
+        prompt_max_input_tokens (int): Token budget of the news prompt input.
+        news_description_chars (int): Maximum length of article descriptions
+            sent to the model.
+        preset_generation (str): How presets are generated: "stream" saves
+            them as they stream in, "concurrent" splits the work into
+            parallel requests and "validated" validates the whole set with
+            the model.
+        openai_concurrency (int): Maximum OpenAI requests in flight at once.
+        upstream_max_retries (int): Retries of a weather or news request that
+            failed with a connection error, a 429 or a 5xx.
+        upstream_host_concurrency (int): Requests in flight at once per
+            upstream API host.
+        preset_history (int): Number of generated preset sets kept, including
+            the active one.
+        change_detection (bool): Keeps the active presets when the news and
+            weather did not change materially since they were generated.
+        change_title_similarity (float): Share of the headlines, from 0 to 1,
+            that must be the same for the news to count as unchanged.
+        preset_max_age_hours (float): Age after which presets are generated
+            again even if nothing changed. 0 keeps them until something does.
+        telemetry_enabled (bool): Records the history of the lamp states.
+        telemetry_flush_interval (float): Seconds between two batched writes
+            of lamp state changes.
+        telemetry_sample_days (int): Days the individual state changes are
+            kept.
+        telemetry_hourly_days (int): Days the hourly rollups are kept.
+        telemetry_daily_days (int): Days the daily rollups are kept.
+        health_interval (float): Seconds between two background health
+            checks.
+        health_probe_timeout (float): Seconds to wait for a lamp to accept a
+            connection in the health check.
+        timezone (str): IANA time zone of the schedules, e.g.
+            "Europe/Stockholm".
+        schedules_enabled (bool): Runs the schedules in one of the workers.
+        schedule_grace_minutes (float): How late a run missed during downtime
+            may still be made up. Older missed runs are skipped.
+        log_format (str): "text" or "json" for the log file.
+        log_sampling (str): Per-logger sampling rates, "logger=rate,...".
+        trace_sample_rate (float): Share of traces written to the exporter.
+        trace_export_file (str | None): JSON lines file for sampled traces.
+        profiling_enabled (bool): Allows profiling single requests.
+        profile_dir (str): Folder for request profiles.
+    """
+
+    tapo_username: str | None
+    tapo_password: str | None
+    openai_api_key: str | None
+    newsdata_api_key: str | None
+    debug: bool = False
+    database_url: str = "sqlite:///db/light_control.db"
+    latitude: float = 59.1031
+    longitude: float = 18.0446
+    news_country: str = "se"
+    news_query: str = "Stockholm"
+    port: int = 5173
+    workers: int = 1
+    device_concurrency: int = 16
+    transition_command_rate: float = 4.0
+    device_command_rate: float = 5.0
+    device_command_burst: int = 8
+    tapo_session_store: bool = True
+    tapo_driver: str = "pyp100"
+    prompt_max_input_tokens: int = 2500
+    news_description_chars: int = 300
+    preset_generation: str = "stream"
+    openai_concurrency: int = 4
+    upstream_max_retries: int = 3
+    upstream_host_concurrency: int = 4
+    preset_history: int = 10
+    change_detection: bool = True
+    change_title_similarity: float = 0.8
+    preset_max_age_hours: float = 24.0
+    telemetry_enabled: bool = True
+    telemetry_flush_interval: float = 5.0
+    telemetry_sample_days: int = 14
+    telemetry_hourly_days: int = 90
+    telemetry_daily_days: int = 730
+    health_interval: float = 30.0
+    health_probe_timeout: float = 1.0
+    timezone: str = "Europe/Stockholm"
+    schedules_enabled: bool = True
+    schedule_grace_minutes: float = 60.0
+    log_format: str = "text"
+    log_sampling: str = ""
+    trace_sample_rate: float = 0.0
+    trace_export_file: str | None = None
+    profiling_enabled: bool = False
+    profile_dir: str = "logs/profiles"
+
+    @classmethod
+    def from_env(cls) -> "Settings":
+        return cls(
+            tapo_username=os.getenv("TAPO_USERNAME"),
+            tapo_password=os.getenv("TAPO_PASSWORD"),
+            openai_api_key=os.getenv("OPENAI_API_KEY"),
+            newsdata_api_key=os.getenv("NEWSDATA_API_KEY"),
+            debug="DEBUG" in os.environ,
+            database_url=os.getenv("DATABASE_URL", cls.database_url),
+            latitude=_env_float("LATITUDE", cls.latitude),
+            longitude=_env_float("LONGITUDE", cls.longitude),
+            news_country=os.getenv("NEWS_COUNTRY", cls.news_country),
+            news_query=os.getenv("NEWS_QUERY", cls.news_query),
+            port=_env_int("PORT", cls.port),
+            workers=_env_int(
+                "WORKERS", _env_int("WEB_CONCURRENCY", cls.workers), minimum=1
+            ),
+            device_concurrency=_env_int(
+                "DEVICE_CONCURRENCY", cls.device_concurrency, minimum=1
+            ),
+            transition_command_rate=_env_float(
+                "TRANSITION_COMMAND_RATE", cls.transition_command_rate
+            ),
+            device_command_rate=_env_float(
+                "DEVICE_COMMAND_RATE", cls.device_command_rate, minimum=0.0
+            ),
+            device_command_burst=_env_int(
+                "DEVICE_COMMAND_BURST", cls.device_command_burst, minimum=1
+            ),
+            tapo_session_store=_env_flag("TAPO_SESSION_STORE", True),
+            tapo_driver=os.getenv("TAPO_DRIVER", cls.tapo_driver).lower(),
+            prompt_max_input_tokens=_env_int(
+                "PROMPT_MAX_INPUT_TOKENS", cls.prompt_max_input_tokens
+            ),
+            news_description_chars=_env_int(
+                "NEWS_DESCRIPTION_CHARS", cls.news_description_chars
+            ),
+            preset_generation=(
+                os.getenv("PRESET_GENERATION")
+                # PRESET_STREAMING=false selects the original validated mode
+                or (
+                    cls.preset_generation
+                    if _env_flag("PRESET_STREAMING", True)
+                    else "validated"
+                )
+            ).lower(),
+            openai_concurrency=_env_int(
+                "OPENAI_CONCURRENCY", cls.openai_concurrency, minimum=1
+            ),
+            upstream_max_retries=_env_int(
+                "UPSTREAM_MAX_RETRIES", cls.upstream_max_retries, minimum=0
+            ),
+            upstream_host_concurrency=_env_int(
+                "UPSTREAM_HOST_CONCURRENCY", cls.upstream_host_concurrency, minimum=1
+            ),
+            preset_history=_env_int("PRESET_HISTORY", cls.preset_history, minimum=1),
+            change_detection=_env_flag("CHANGE_DETECTION", True),
+            change_title_similarity=_env_float(
+                "CHANGE_TITLE_SIMILARITY", cls.change_title_similarity
+            ),
+            preset_max_age_hours=_env_float(
+                "PRESET_MAX_AGE_HOURS", cls.preset_max_age_hours, minimum=0.0
+            ),
+            telemetry_enabled=_env_flag("TELEMETRY_ENABLED", True),
+            telemetry_flush_interval=_env_float(
+                "TELEMETRY_FLUSH_INTERVAL", cls.telemetry_flush_interval, minimum=0.1
+            ),
+            telemetry_sample_days=_env_int(
+                "TELEMETRY_SAMPLE_DAYS", cls.telemetry_sample_days, minimum=1
+            ),
+            telemetry_hourly_days=_env_int(
+                "TELEMETRY_HOURLY_DAYS", cls.telemetry_hourly_days, minimum=1
+            ),
+            telemetry_daily_days=_env_int(
+                "TELEMETRY_DAILY_DAYS", cls.telemetry_daily_days, minimum=1
+            ),
+            health_interval=_env_float(
+                "HEALTH_INTERVAL", cls.health_interval, minimum=1.0
+            ),
+            health_probe_timeout=_env_float(
+                "HEALTH_PROBE_TIMEOUT", cls.health_probe_timeout
+            ),
+            timezone=os.getenv("TIMEZONE") or os.getenv("TZ") or cls.timezone,
+            schedules_enabled=_env_flag("SCHEDULES_ENABLED", True),
+            schedule_grace_minutes=_env_float(
+                "SCHEDULE_GRACE_MINUTES", cls.schedule_grace_minutes, minimum=0.0
+            ),
+            log_format=os.getenv("LOG_FORMAT", cls.log_format).lower(),
+            log_sampling=os.getenv("LOG_SAMPLING", cls.log_sampling),
+            trace_sample_rate=_env_float("TRACE_SAMPLE_RATE", cls.trace_sample_rate),
+            trace_export_file=os.getenv("TRACE_EXPORT_FILE") or None,
+            profiling_enabled=_env_flag("PROFILING_ENABLED"),
+            profile_dir=os.getenv("PROFILE_DIR", cls.profile_dir),
+        )
+
+@cache
+def get_settings() -> Settings:
+    """
+    Loads the .env file and the environment once and returns the settings.
+    """
+    load_dotenv()
+    return Settings.from_env()
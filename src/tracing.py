@@ -0,0 +1,299 @@
+"""
+Lightweight request-scoped tracing.
+
+A trace is started for every HTTP request (or by the first `span` opened
+outside of a request) and spans opened inside it form a tree through a
+context variable. Trace and span ids are attached to log records, so log
+lines of one request can be correlated. A sampled subset of traces can be
+written to a local JSON lines file, and a single request can be profiled
+with cProfile on demand.
+"""
+
+import cProfile
+import json
+import logging
+import os
+import random
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Dict, List, Optional
+
+from settings import get_settings
+
+_current_span: ContextVar[Optional["Span"]] = ContextVar("current_span", default=None)
+
+
+class Trace:
+    """
+    The spans belonging to one request.
+    Attributes:
+        trace_id (str): 32 hex character trace id.
+        sampled (bool): Whether the trace is exported when it finishes.
+        spans (list): Finished spans, only collected for sampled traces.
+    """
+
+    __slots__ = ("trace_id", "sampled", "spans")
+
+    def __init__(self, trace_id: str, sampled: bool) -> None:
+        self.trace_id = trace_id
+        self.sampled = sampled
+        self.spans: List[Span] = []
+
+
+class Span:
+    """
+    A timed operation within a trace.
+    """
+
+    __slots__ = (
+        "trace",
+        "span_id",
+        "parent_id",
+        "name",
+        "attributes",
+        "start_time",
+        "_start",
+        "duration",
+        "error",
+    )
+
+    def __init__(
+        self, trace: Trace, name: str, parent_id: Optional[str], attributes: dict
+    ) -> None:
+        self.trace = trace
+        self.span_id = os.urandom(8).hex()
+        self.parent_id = parent_id
+        self.name = name
+        self.attributes = attributes
+        self.start_time = time.time()
+        self._start = time.perf_counter()
+        self.duration: Optional[float] = None
+        self.error: Optional[str] = None
+
+    @property
+    def trace_id(self) -> str:
+        return self.trace.trace_id
+
+    def set_attribute(self, key: str, value: Any) -> None:
+        self.attributes[key] = value
+
+    def finish(self) -> None:
+        self.duration = time.perf_counter() - self._start
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "name": self.name,
+            "start": self.start_time,
+            "duration_ms": round((self.duration or 0) * 1000, 3),
+            "attributes": self.attributes,
+            "error": self.error,
+        }
+
+
+class FileSpanExporter:
+    """
+    Appends every finished sampled trace as one JSON line to a file.
+    """
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self._lock = threading.Lock()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    def export(self, trace: Trace) -> None:
+        line = json.dumps(
+            {
+                "trace_id": trace.trace_id,
+                "spans": [finished.to_dict() for finished in trace.spans],
+            },
+            default=str,
+        )
+        with self._lock:
+            with open(self.path, "a", encoding="utf-8") as handle:
+                handle.write(line + "\n")
+
+
+class _TracingConfig:
+    sample_rate: float = 0.0
+    exporter: Optional[FileSpanExporter] = None
+    profiling_enabled: bool = False
+    profile_dir: str = "logs/profiles"
+
+
+_config = _TracingConfig()
+_profile_lock = threading.Lock()
+logger = logging.getLogger("LuminaSync")
+
+
+def configure_tracing(
+    sample_rate: float | None = None,
+    export_path: str | None = None,
+    profiling_enabled: bool | None = None,
+    profile_dir: str | None = None,
+) -> None:
+    """
+    Configures sampling, the trace exporter and the profiling toggle.
+    Unset arguments fall back to the application settings (TRACE_SAMPLE_RATE,
+    TRACE_EXPORT_FILE, PROFILING_ENABLED and PROFILE_DIR). Without an export
+    file no traces are written, whatever the sample rate.
+    """
+    settings = get_settings()
+    if sample_rate is None:
+        sample_rate = settings.trace_sample_rate
+    if export_path is None:
+        export_path = settings.trace_export_file
+    if profiling_enabled is None:
+        profiling_enabled = settings.profiling_enabled
+    if profile_dir is None:
+        profile_dir = settings.profile_dir
+
+    _config.sample_rate = max(0.0, min(1.0, sample_rate))
+    _config.exporter = FileSpanExporter(export_path) if export_path else None
+    _config.profiling_enabled = profiling_enabled
+    _config.profile_dir = profile_dir
+
+
+def _new_trace(trace_id: str | None = None) -> Trace:
+    sampled = _config.exporter is not None and random.random() < _config.sample_rate
+    return Trace(trace_id or os.urandom(16).hex(), sampled)
+
+
+def current_span() -> Optional[Span]:
+    return _current_span.get()
+
+
+def current_trace_id() -> Optional[str]:
+    active = _current_span.get()
+    return active.trace_id if active else None
+
+
+@contextmanager
+def span(name: str, trace_id: str | None = None, **attributes):
+    """
+    Opens a span as a child of the current one, or starts a new trace when
+    there is no current span. The span records its duration and the error
+    it raised, if any.
+
+    Args:
+        name (str): The name of the operation, e.g. "tapo.get_device_info".
+        trace_id (str): Trace id to continue, only used for new traces.
+        **attributes: Extra attributes stored on the span.
+    """
+    parent = _current_span.get()
+    trace = parent.trace if parent else _new_trace(trace_id)
+    active = Span(trace, name, parent.span_id if parent else None, attributes)
+    token = _current_span.set(active)
+    try:
+        yield active
+    except BaseException as e:
+        active.error = f"{type(e).__name__}: {e}"
+        raise
+    finally:
+        active.finish()
+        _current_span.reset(token)
+        if trace.sampled:
+            trace.spans.append(active)
+            if parent is None:
+                try:
+                    _config.exporter.export(trace)
+                except OSError as e:
+                    logger.warning("Could not export trace %s: %s", trace.trace_id, e)
+
+
+class TraceContextFilter(logging.Filter):
+    """
+    Adds `trace_id` and `span_id` attributes to log records, "-" when the
+    record is logged outside of a trace.
+    """
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        active = _current_span.get()
+        record.trace_id = active.trace_id if active else "-"
+        record.span_id = active.span_id if active else "-"
+        return True
+
+
+def _parse_traceparent(headers) -> Optional[str]:
+    for key, value in headers:
+        if key == b"traceparent":
+            parts = value.decode("latin-1").split("-")
+            if len(parts) == 4 and len(parts[1]) == 32:
+                return parts[1]
+    return None
+
+
+def _profile_requested(scope) -> bool:
+    if not _config.profiling_enabled:
+        return False
+    if b"profile=1" in scope.get("query_string", b""):
+        return True
+    return any(
+        key == b"x-profile" and value == b"1" for key, value in scope["headers"]
+    )
+
+
+class TracingMiddleware:
+    """
+    ASGI middleware that wraps each HTTP request in a root span, returns the
+    trace id in the `X-Trace-Id` header and, when profiling is enabled,
+    profiles requests sent with `X-Profile: 1` or `?profile=1`.
+    """
+
+    def __init__(self, app) -> None:
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        with span(
+            f"{scope['method']} {scope['path']}",
+            trace_id=_parse_traceparent(scope["headers"]),
+            method=scope["method"],
+            path=scope["path"],
+        ) as root:
+
+            async def send_with_trace_id(message):
+                if message["type"] == "http.response.start":
+                    root.set_attribute("status", message["status"])
+                    message.setdefault("headers", [])
+                    message["headers"] = [
+                        *message["headers"],
+                        (b"x-trace-id", root.trace_id.encode()),
+                    ]
+                await send(message)
+
+            if _profile_requested(scope) and _profile_lock.acquire(blocking=False):
+                try:
+                    await self._profiled(scope, receive, send_with_trace_id, root)
+                finally:
+                    _profile_lock.release()
+            else:
+                await self.app(scope, receive, send_with_trace_id)
+
+    async def _profiled(self, scope, receive, send, root: Span):
+        """
+        Runs the request under cProfile and dumps the stats to
+        `<profile_dir>/<trace_id>.prof`. Only one request is profiled at a
+        time; the event loop thread is profiled, so work of other requests
+        interleaved on the loop can show up as well.
+        """
+        profiler = cProfile.Profile()
+        profiler.enable()
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            profiler.disable()
+            os.makedirs(_config.profile_dir, exist_ok=True)
+            path = os.path.join(_config.profile_dir, f"{root.trace_id}.prof")
+            profiler.dump_stats(path)
+            root.set_attribute("profile", path)
+            logger.info("Request profile written to %s", path)
@@ -1,100 +1,325 @@
-import json
+import asyncio
+import contextvars
 import logging
-import os
+import threading
+from datetime import datetime, timedelta, timezone
 
-from dotenv import load_dotenv
+from sqlalchemy.exc import SQLAlchemyError
 
-from db.models import Lamp, Preset
+from db.models import Lamp
 from db.session import get_session
 from interfaces.newsdata_interface import NewsDataInterface
 from interfaces.openai_interface import OpenAIInterface
+from interfaces.openai_interface import Preset as GeneratedPreset
 from interfaces.weather_api_interface import WeatherAPIInterface
-from services.preset_service import create_preset, delete_preset
+from services.preset_service import create_preset
+from services.preset_set_service import (
+    create_preset_set,
+    get_active_preset_set,
+    prune_preset_sets,
+    set_preset_set_inputs,
+)
+from settings import get_settings
+from tracing import span
+from utils.change_detection import ChangeReport, compare_inputs, input_fingerprint
+from utils.prompt_payload import build_news_payload, compact_json
 
 logger = logging.getLogger("LuminaSync")
 
 
-def update_presets():
+def update_presets(force: bool = False):
     """
     Updates the presets based on weather, local and global news.
 
     This function can be called both programmatically and via command-line.
     It fetches weather, local news, and global news, and uses OpenAI to
     generate new lighting presets, which are then saved in the database.
+    When the inputs did not change materially since the active presets were
+    generated, the active presets are kept.
+    Args:
+        force (bool): Generates new presets even if nothing changed.
+    Returns:
+        dict: Whether the presets were "updated", and the "reasons".
+    Raises:
+        Exception: Any error while fetching the inputs or generating and
+            storing the presets, after the session was rolled back.
     """
-    load_dotenv()
+    with span("update_presets"):
+        return _update_presets(force)
 
+
+def _detect_changes(fingerprint: dict) -> ChangeReport:
+    """
+    Compares the inputs with the ones of the active preset set, which is
+    also replaced when it is older than the configured maximum age.
+    """
+    settings = get_settings()
+    active = get_active_preset_set()
+    if active is None:
+        return ChangeReport(True, ["no active preset set"])
+    if settings.preset_max_age_hours > 0 and active["generated_at"]:
+        now = datetime.now(timezone.utc).replace(tzinfo=None)
+        age = now - datetime.fromisoformat(active["generated_at"])
+        if age > timedelta(hours=settings.preset_max_age_hours):
+            hours = age.total_seconds() / 3600
+            return ChangeReport(True, [f"active presets are {hours:.0f} hours old"])
+    return compare_inputs(
+        active["inputs"], fingerprint, settings.change_title_similarity
+    )
+
+
+def _update_presets(force: bool):
+    settings = get_settings()
     session = get_session()
     try:
         # Step 1: Clear non-persistent presets
 
         # Step 2: Fetch weather data
-        weather_interface = WeatherAPIInterface(59.1031, 18.0446)
-        weather = weather_interface.fetch_weather_data()
+        with span("update_presets.fetch_weather"):
+            weather_interface = WeatherAPIInterface(
+                settings.latitude, settings.longitude
+            )
+            weather = weather_interface.fetch_weather_data()
         logger.info("Weather data fetched successfully.")
 
         # Step 3: Fetch local and global news
-        newsdata_interface = NewsDataInterface(os.getenv("NEWSDATA_API_KEY"))
-        newsdata_global = newsdata_interface.fetch_news_data()
-        newsdata_local = newsdata_interface.fetch_news_data(
-            country="se", query="Stockholm"
-        )
+        with span("update_presets.fetch_news"):
+            newsdata_interface = NewsDataInterface(settings.newsdata_api_key)
+            newsdata_global = newsdata_interface.fetch_news_data()
+            newsdata_local = newsdata_interface.fetch_news_data(
+                country=settings.news_country, query=settings.news_query
+            )
         logger.info("News data fetched successfully.")
 
-        # Step 4: Prepare data and get emotional responses from OpenAI
-        data = {
-            "weather": weather,
-            "local_news": newsdata_local,
-            "global_news": newsdata_global,
-        }
-        openai_interface = OpenAIInterface(os.getenv("OPENAI_API_KEY"))
-        emotional_responses = openai_interface.get_emotional_responses(json.dumps(data))
+        # Step 4: Skip the generation when nothing changed materially
+        lamp_count = len(session.query(Lamp).all())
+        fingerprint = input_fingerprint(
+            weather, newsdata_local + newsdata_global, lamp_count
+        )
+        if force or not settings.change_detection:
+            report = ChangeReport(True, ["forced" if force else "change detection off"])
+        else:
+            with span("update_presets.detect_changes") as detect_span:
+                report = _detect_changes(fingerprint)
+                detect_span.set_attribute("changed", report.changed)
+        if not report.changed:
+            logger.info(
+                "Inputs unchanged, keeping the active presets: %s.",
+                "; ".join(report.reasons),
+            )
+            return {"updated": False, "reasons": report.reasons}
+        logger.info("Generating presets: %s.", "; ".join(report.reasons))
+        result = {"updated": True, "reasons": report.reasons}
+
+        # Step 5: Prepare data and get emotional responses from OpenAI
+        # Only the fields the prompt uses are sent, local news first as it is
+        # kept when an article also appears in the global feed
+        data, stats = build_news_payload(
+            weather,
+            newsdata_local,
+            newsdata_global,
+            max_tokens=settings.prompt_max_input_tokens,
+            max_description_chars=settings.news_description_chars,
+        )
+        logger.info(
+            "News payload compacted to %s articles and ~%s tokens "
+            "(%s duplicates, %s dropped, descriptions up to %s characters).",
+            stats["articles"],
+            stats["tokens"],
+            stats["duplicates"],
+            stats["dropped"],
+            stats["description_chars"],
+        )
+        openai_interface = OpenAIInterface(settings.openai_api_key)
+        if settings.preset_generation == "concurrent":
+            _generate_presets_concurrently(
+                openai_interface, data, lamp_count, stats, fingerprint
+            )
+            logger.info("Presets updated successfully.")
+            return result
 
-        # Step 5: Create input for the OpenAI preset prompt
+        with span("update_presets.emotional_responses", **stats):
+            emotional_responses = openai_interface.get_emotional_responses(data)
+
+        # Step 6: Create input for the OpenAI preset prompt
         preset_input = {
-            "lamp_count": len(session.query(Lamp).all()),
+            "lamp_count": lamp_count,
             "descriptions": emotional_responses,
         }
 
-        # Step 6: Fetch presets from OpenAI
-        presets = openai_interface.get_light_presets(json.dumps(preset_input))
-        logger.info("Presets fetched successfully.")
+        # Step 7: Fetch presets from OpenAI and save them to the database
+        if settings.preset_generation == "stream":
+            _stream_presets(
+                openai_interface, compact_json(preset_input), session, fingerprint
+            )
+        else:
+            _generate_presets(openai_interface, compact_json(preset_input), fingerprint)
 
-        old_presets = session.query(Preset).all()
-        for old_preset in old_presets:
-            preset_dict = old_preset.to_dict()
-            if not preset_dict["protected"]:
-                delete_preset(preset_dict["id"])
-        logger.info("Non-persistent presets deleted successfully.")
+        logger.info("Presets updated successfully.")
+        return result
+    except Exception as e:
+        session.rollback()
+        logger.error("An error occurred: %s", e)
+        raise
+    finally:
+        session.close()
 
-        # Step 7: Save presets to the database
-        logger.debug(f"Presets: {presets.model_dump_json()}")
 
-        for preset in presets.presets:
-            preset_data = preset.model_dump()
+def _preset_value(preset: GeneratedPreset) -> list | dict | None:
+    """
+    Returns the value to store for a generated preset, based on its type.
+    """
+    preset_data = preset.model_dump()
 
-            # Determine which value field is populated based on the type
-            if preset_data["type"] == "color":
-                value = preset_data.get("value_color")
-            elif preset_data["type"] == "temp":
-                value = preset_data.get("value_temp")
-            else:
-                logger.error(f"Unknown preset type: {preset_data['type']}")
-                continue  # Skip unknown types
+    # Determine which value field is populated based on the type
+    if preset_data["type"] == "color":
+        return preset_data.get("value_color")
+    if preset_data["type"] == "temp":
+        return preset_data.get("value_temp")
+    logger.error("Unknown preset type: %s", preset_data["type"])
+    return None
 
-            # Save to the database
-            saved_preset = create_preset(preset_data["name"], value)
-            logger.info(f"Preset saved: {json.dumps(saved_preset)}")
 
-        logger.info("Presets updated successfully.")
-        session.close()
+def _prune_preset_sets():
+    pruned = prune_preset_sets(get_settings().preset_history)
+    if pruned:
+        logger.info("Pruned %s old preset sets.", len(pruned))
 
-        return True
-    except Exception as e:
-        session.rollback()
-        logger.error(f"An error occurred: {e}")
-    finally:
-        session.close()
+
+def _save_presets(presets, source: str, inputs: dict):
+    """
+    Stores the presets as a new, active preset set, with the fingerprint of
+    their inputs. The previous sets are kept, up to the configured history,
+    so they can be switched back to.
+    """
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug("Presets: %s", presets.model_dump_json())
+
+    with span("update_presets.save_presets", count=len(presets.presets)):
+        values = [
+            {"name": preset.name, "value": _preset_value(preset)}
+            for preset in presets.presets
+        ]
+        # Skip unknown types
+        values = [value for value in values if value["value"] is not None]
+        preset_set = create_preset_set(source, values, active=True, inputs=inputs)
+    logger.info("Preset set %s saved with %s presets.", preset_set["id"], len(values))
+    _prune_preset_sets()
+
+
+def _generate_presets(
+    openai_interface: OpenAIInterface, preset_input: str, inputs: dict
+):
+    """
+    Generates the whole preset set, validates it with the model and stores it
+    as the new active preset set.
+    """
+    with span("update_presets.generate_presets"):
+        presets = openai_interface.get_light_presets(preset_input)
+    logger.info("Presets fetched successfully.")
+    _save_presets(presets, "validated", inputs)
+
+
+def _run_async(coroutine):
+    """
+    Runs a coroutine to completion from synchronous code. When called from a
+    thread that already runs an event loop, e.g. a request handler, the
+    coroutine runs in its own loop on a separate thread.
+    """
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return asyncio.run(coroutine)
+
+    outcome = {}
+    context = contextvars.copy_context()
+
+    def run():
+        try:
+            outcome["result"] = context.run(asyncio.run, coroutine)
+        except BaseException as e:  # pylint: disable=broad-except
+            outcome["error"] = e
+
+    thread = threading.Thread(target=run, name="update-presets-async")
+    thread.start()
+    thread.join()
+    if "error" in outcome:
+        raise outcome["error"]
+    return outcome["result"]
+
+
+def _generate_presets_concurrently(
+    openai_interface: OpenAIInterface,
+    news_data: str,
+    lamp_count: int,
+    stats: dict,
+    inputs: dict,
+):
+    """
+    Generates the emotional responses and presets with concurrent requests
+    and stores the merged result as the new active preset set.
+    """
+    settings = get_settings()
+    with span("update_presets.generate_presets_concurrently", **stats):
+        _, presets = _run_async(
+            openai_interface.generate_presets_concurrently(
+                news_data,
+                lamp_count,
+                max_concurrency=settings.openai_concurrency,
+            )
+        )
+    logger.info("Presets fetched successfully.")
+    _save_presets(presets, "concurrent", inputs)
+
+
+def _stream_presets(
+    openai_interface: OpenAIInterface, preset_input: str, session, inputs: dict
+):
+    """
+    Streams the preset set and saves every preset as soon as it is complete.
+    A new preset set is created and activated when the first new preset
+    arrives, so a failed generation leaves the active set in place. When the
+    stream breaks off later, the presets saved until then are kept, but the
+    set gets no fingerprint, so the next update generates a complete set.
+    """
+    saved = []
+    preset_set = {}
+
+    def save(preset):
+        value = _preset_value(preset)
+        if value is None:
+            return
+        if not preset_set:
+            preset_set.update(create_preset_set("stream", active=True))
+        try:
+            saved_preset = create_preset(
+                preset.name, value, set_id=int(preset_set["id"])
+            )
+        except SQLAlchemyError as e:
+            # E.g. a name that the model used twice
+            session.rollback()
+            logger.warning("Preset %s not saved: %s", preset.name, e)
+            return
+        saved.append(saved_preset["name"])
+        logger.info("Preset saved: %s", saved_preset["name"])
+
+    try:
+        with span("update_presets.stream_presets") as stream_span:
+            openai_interface.stream_light_presets(preset_input, save)
+            stream_span.set_attribute("count", len(saved))
+    except Exception:
+        if preset_set:
+            set_preset_set_inputs(int(preset_set["id"]), None)
+            logger.warning(
+                "Stream failed after %s presets, preset set %s is incomplete.",
+                len(saved),
+                preset_set["id"],
+            )
+        raise
+    logger.info("Presets streamed successfully, %s saved.", len(saved))
+    if preset_set:
+        set_preset_set_inputs(int(preset_set["id"]), inputs)
+        _prune_preset_sets()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,176 @@
+"""
+Decides whether the inputs of a preset update changed enough to generate
+new presets.
+
+Consecutive updates often see the same headlines, reordered or slightly
+reworded, and nearly the same weather. The inputs are therefore reduced to a
+fingerprint: a MinHash signature of the word shingles of all article titles,
+the daily weather averages and the number of lamps. Comparing two signatures
+estimates the Jaccard similarity of the title sets without keeping the
+titles. The fingerprint is small enough to be stored with the preset set it
+was generated from.
+"""
+
+import hashlib
+import random
+import re
+import unicodedata
+from dataclasses import dataclass, field
+from typing import Any, Dict, Iterable, List, Optional
+
+NUM_PERMUTATIONS = 64
+SHINGLE_WORDS = 2
+# A Mersenne prime larger than the 32 bit shingle hashes
+_PRIME = (1 << 61) - 1
+_MAX_HASH = (1 << 32) - 1
+# Fixed, so signatures stay comparable across processes and restarts
+_rng = random.Random(20240915)
+_PERMUTATIONS = [
+    (_rng.randrange(1, _PRIME), _rng.randrange(0, _PRIME))
+    for _ in range(NUM_PERMUTATIONS)
+]
+
+# The largest weather changes that still count as the same weather
+WEATHER_THRESHOLDS = {
+    "temperature": 2.0,
+    "cloud_cover": 15.0,
+    "rain": 1.0,
+}
+
+
+def normalize_title(title: str) -> List[str]:
+    """
+    The words of a title, case- and accent-folded, without punctuation.
+    """
+    text = unicodedata.normalize("NFKD", title or "").casefold()
+    text = "".join(char for char in text if not unicodedata.combining(char))
+    return re.findall(r"\w+", text)
+
+
+def title_shingles(titles: Iterable[str]) -> set:
+    """
+    The word pairs of all titles. Titles of a single word count as a shingle
+    of their own.
+    """
+    shingles = set()
+    for title in titles:
+        words = normalize_title(title)
+        if len(words) < SHINGLE_WORDS:
+            shingles.update(words)
+        for i in range(len(words) - SHINGLE_WORDS + 1):
+            shingles.add(" ".join(words[i : i + SHINGLE_WORDS]))
+    return shingles
+
+
+def minhash(shingles: Iterable[str]) -> List[int]:
+    """
+    The MinHash signature of a set of shingles. An empty set has a signature
+    of maximal values.
+    """
+    hashes = [
+        int.from_bytes(
+            hashlib.blake2b(shingle.encode("utf-8"), digest_size=4).digest(), "big"
+        )
+        for shingle in shingles
+    ]
+    if not hashes:
+        return [_MAX_HASH] * NUM_PERMUTATIONS
+    return [
+        min((a * value + b) % _PRIME for value in hashes) & _MAX_HASH
+        for a, b in _PERMUTATIONS
+    ]
+
+
+def similarity(first: List[int], second: List[int]) -> float:
+    """
+    Estimates the Jaccard similarity of the sets behind two signatures.
+    """
+    if not first or len(first) != len(second):
+        return 0.0
+    return sum(a == b for a, b in zip(first, second)) / len(first)
+
+
+def input_fingerprint(
+    weather: Dict[str, float], articles: Iterable[dict], lamp_count: int
+) -> Dict[str, Any]:
+    """
+    The fingerprint of the inputs of a preset update, as stored with the
+    preset set.
+    """
+    return {
+        "titles": minhash(title_shingles(a.get("title") or "" for a in articles)),
+        "weather": {name: weather.get(name) for name in WEATHER_THRESHOLDS},
+        "lamp_count": lamp_count,
+    }
+
+
+@dataclass
+class ChangeReport:
+    """
+    Attributes:
+        changed (bool): Whether new presets should be generated.
+        reasons (list): Why, or why not, in words.
+        title_similarity (float): Estimated overlap of the headlines, if
+            there was a previous fingerprint to compare with.
+    """
+
+    changed: bool
+    reasons: List[str] = field(default_factory=list)
+    title_similarity: Optional[float] = None
+
+    def to_dict(self):
+        return {
+            "changed": self.changed,
+            "reasons": self.reasons,
+            "title_similarity": self.title_similarity,
+        }
+
+
+def compare_inputs(
+    previous: Optional[Dict[str, Any]],
+    current: Dict[str, Any],
+    min_title_similarity: float,
+) -> ChangeReport:
+    """
+    Compares the fingerprint of the current inputs with the one the active
+    presets were generated from.
+    Returns:
+        ChangeReport: Changed when any input differs materially.
+    """
+    if not previous:
+        return ChangeReport(True, ["no inputs recorded for the active presets"])
+
+    changes, unchanged = [], []
+    if previous.get("lamp_count") != current["lamp_count"]:
+        changes.append(
+            f"lamp count changed from {previous.get('lamp_count')} "
+            f"to {current['lamp_count']}"
+        )
+
+    title_similarity = similarity(previous.get("titles") or [], current["titles"])
+    overlap = (
+        f"headlines {title_similarity:.0%} similar "
+        f"(threshold {min_title_similarity:.0%})"
+    )
+    if title_similarity < min_title_similarity:
+        changes.append(overlap)
+    else:
+        unchanged.append(overlap)
+
+    previous_weather = previous.get("weather") or {}
+    for name, threshold in WEATHER_THRESHOLDS.items():
+        before, now = previous_weather.get(name), current["weather"].get(name)
+        if before is None or now is None:
+            if before != now:
+                changes.append(f"{name} missing in one of the forecasts")
+            continue
+        delta = abs(now - before)
+        description = f"{name} changed by {delta:.1f} (threshold {threshold:g})"
+        if delta > threshold:
+            changes.append(description)
+        else:
+            unchanged.append(description)
+
+    if changes:
+        return ChangeReport(True, changes, title_similarity)
+    return ChangeReport(False, unchanged, title_similarity)
@@ -1,4 +1,5 @@
 import colorsys
+import math
 
 import webcolors
 
@@ -30,6 +31,48 @@ def rgb_to_hsv(rgb):
     return int(round(h * 360, 2)), int(round(s * 100, 2)), int(round(v * 100, 2))
 
 
+def kelvin_to_rgb(kelvin):
+    """Approximate the RGB color of white light at a color temperature"""
+    temperature = max(1000, min(40000, kelvin)) / 100
+    if temperature <= 66:
+        red = 255
+        green = 99.4708025861 * math.log(temperature) - 161.1195681661
+        blue = (
+            0
+            if temperature <= 19
+            else 138.5177312231 * math.log(temperature - 10) - 305.0447927307
+        )
+    else:
+        red = 329.698727446 * (temperature - 60) ** -0.1332047592
+        green = 288.1221695283 * (temperature - 60) ** -0.0755148492
+        blue = 255
+    return tuple(int(max(0, min(255, round(c)))) for c in (red, green, blue))
+
+
+def interpolate_frames(start, end, steps, hue_index=None):
+    """
+    Compute the frames of a transition from start to end in one go.
+    start and end are equally long tuples of numbers. The steps frames don't
+    include start and the last one is end. The component at hue_index is
+    treated as a hue in degrees and takes the shorter way around the wheel.
+    """
+    deltas = []
+    for index, (a, b) in enumerate(zip(start, end)):
+        delta = b - a
+        if index == hue_index:
+            delta = (delta + 180) % 360 - 180
+        deltas.append(delta)
+    frames = []
+    for step in range(1, steps + 1):
+        fraction = step / steps
+        frame = [round(a + delta * fraction) for a, delta in zip(start, deltas)]
+        if hue_index is not None:
+            frame[hue_index] %= 360
+        frames.append(tuple(frame))
+    frames[-1] = tuple(end)
+    return frames
+
+
 def tuple_to_rgb_string(rgb_tuple):
     return ",".join(map(str, rgb_tuple))
 
@@ -0,0 +1,242 @@
+"""
+Coordination between the worker processes serving the app.
+
+Workers share the SQLite database and the bulbs, but nothing in memory.
+File locks under the database folder serialize device commands per lamp
+across processes, and a generation file lets each worker notice that another
+one changed the data behind its local caches.
+"""
+
+import logging
+import os
+import re
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, NamedTuple, Tuple
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover - Windows development machines
+    fcntl = None
+
+from metrics import histogram
+
+LOCK_DIR = os.path.join("db", "locks")
+GENERATION_FILE = os.path.join("db", "cache.generation")
+
+LOCK_WAIT_DURATION = histogram(
+    "luminasync_lock_wait_seconds",
+    "Time spent waiting for a cross-process lock.",
+    ["lock"],
+)
+
+logger = logging.getLogger("LuminaSync")
+
+
+class LockTimeout(Exception):
+    pass
+
+
+class InterProcessLock:
+    """
+    An exclusive lock held through `flock` on a file, shared by all threads
+    and processes using the same path. Within a process a thread lock is taken
+    first, because `flock` does not exclude threads sharing a file descriptor.
+    """
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self._thread_lock = threading.Lock()
+
+    @contextmanager
+    def acquire(self, timeout: float = 30.0, poll_interval: float = 0.01):
+        start = time.perf_counter()
+        if not self._thread_lock.acquire(timeout=timeout):
+            raise LockTimeout(f"Timed out waiting for {self.path}")
+        handle = None
+        try:
+            if fcntl is not None:
+                os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+                handle = open(self.path, "a+", encoding="utf-8")
+                while True:
+                    try:
+                        fcntl.flock(handle.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+                        break
+                    except BlockingIOError as e:
+                        if time.perf_counter() - start > timeout:
+                            raise LockTimeout(
+                                f"Timed out waiting for {self.path}"
+                            ) from e
+                        time.sleep(poll_interval)
+            LOCK_WAIT_DURATION.observe(
+                time.perf_counter() - start, os.path.basename(self.path)
+            )
+            yield
+        finally:
+            if handle is not None:
+                fcntl.flock(handle.fileno(), fcntl.LOCK_UN)
+                handle.close()
+            self._thread_lock.release()
+
+
+def safe_file_name(name: str) -> str:
+    """
+    Replaces the characters that don't belong in a file name, e.g. in IPv6
+    addresses.
+    """
+    return re.sub(r"[^A-Za-z0-9_.-]", "_", name)
+
+
+_locks: Dict[str, InterProcessLock] = {}
+_locks_guard = threading.Lock()
+
+
+def named_lock(name: str) -> InterProcessLock:
+    """
+    Returns the process-wide lock object for `name`.
+    """
+    safe_name = safe_file_name(name)
+    with _locks_guard:
+        lock = _locks.get(safe_name)
+        if lock is None:
+            lock = _locks[safe_name] = InterProcessLock(
+                os.path.join(LOCK_DIR, f"{safe_name}.lock")
+            )
+        return lock
+
+
+def device_lock(ip: str, timeout: float = 30.0):
+    """
+    Serializes commands to one lamp across all workers. Commands to different
+    lamps don't wait on each other.
+    """
+    return named_lock(f"device-{ip}").acquire(timeout=timeout)
+
+
+def device_file(ip: str, extension: str) -> str:
+    """
+    The path of a file holding shared state of one lamp, next to its lock.
+    """
+    return os.path.join(LOCK_DIR, f"{safe_file_name(f'device-{ip}')}.{extension}")
+
+
+def _owner_path(ip: str) -> str:
+    return device_file(ip, "owner")
+
+
+def claim_device(ip: str) -> str:
+    """
+    Makes the caller the latest owner of a lamp and returns its token.
+    Long running work on a lamp, like a transition, checks `owns_device`
+    before each command and stops once a newer command claimed the lamp,
+    also when that command runs in another worker.
+    """
+    token = uuid.uuid4().hex
+    path = _owner_path(ip)
+    temporary = f"{path}.{os.getpid()}.{threading.get_ident()}"
+    try:
+        os.makedirs(LOCK_DIR, exist_ok=True)
+        with open(temporary, "w", encoding="utf-8") as handle:
+            handle.write(token)
+        os.replace(temporary, path)
+    except OSError as e:
+        logger.warning("Could not claim lamp %s: %s", ip, e)
+    return token
+
+
+def owns_device(ip: str, token: str) -> bool:
+    """
+    Whether `token` is still the latest claim on the lamp.
+    """
+    try:
+        with open(_owner_path(ip), encoding="utf-8") as handle:
+            return handle.read() == token
+    except FileNotFoundError:
+        return False
+
+
+def startup_lock(timeout: float = 60.0):
+    """
+    Serializes schema creation and seeding between workers starting together.
+    """
+    return named_lock("startup").acquire(timeout=timeout)
+
+
+class CacheGeneration:
+    """
+    A counter shared through a file. Writers bump it after changing data,
+    readers compare the file identity (inode and modification time) with the
+    one they cached against, which costs a single `stat` call.
+    """
+
+    def __init__(self, path: str = GENERATION_FILE) -> None:
+        self.path = path
+        self._lock = threading.Lock()
+
+    def current(self) -> Tuple[int, int]:
+        try:
+            stat = os.stat(self.path)
+            return stat.st_ino, stat.st_mtime_ns
+        except FileNotFoundError:
+            return 0, 0
+
+    def bump(self) -> None:
+        """
+        Replaces the generation file, which changes its inode, so every
+        worker sees a new generation even within the same clock tick.
+        """
+        with self._lock:
+            directory = os.path.dirname(self.path) or "."
+            temporary = os.path.join(
+                directory, f".{os.path.basename(self.path)}.{os.getpid()}"
+            )
+            try:
+                with open(temporary, "w", encoding="utf-8") as handle:
+                    handle.write(str(time.time_ns()))
+                os.replace(temporary, self.path)
+            except OSError as e:
+                logger.warning("Could not bump the cache generation: %s", e)
+
+
+cache_generation = CacheGeneration()
+
+
+class CacheInfo(NamedTuple):
+    hits: int
+    misses: int
+
+
+class GenerationCache:
+    """
+    A worker-local cache whose entries are dropped as soon as any worker bumps
+    the shared cache generation.
+    """
+
+    def __init__(self, generation: CacheGeneration = cache_generation) -> None:
+        self.generation = generation
+        self._entries: Dict[Any, Tuple[Tuple[int, int], Any]] = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: Any, loader: Callable[[], Any]) -> Any:
+        generation = self.generation.current()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] == generation:
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+        value = loader()
+        with self._lock:
+            self._entries[key] = (generation, value)
+        return value
+
+    def cache_info(self) -> CacheInfo:
+        return CacheInfo(self.hits, self.misses)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
@@ -0,0 +1,54 @@
+"""
+Deferred module imports for heavy dependencies that are not needed to serve
+the first request.
+"""
+
+import importlib
+import logging
+import threading
+import time
+from types import ModuleType
+
+from metrics import gauge
+
+LAZY_IMPORT_DURATION = gauge(
+    "luminasync_lazy_import_duration_seconds",
+    "Time spent importing a deferred module on first use.",
+    ["module"],
+)
+
+logger = logging.getLogger("LuminaSync")
+
+
+class LazyModule:
+    """
+    Stands in for a module and imports it on first attribute access.
+    """
+
+    def __init__(self, name: str) -> None:
+        self._name = name
+        self._module: ModuleType | None = None
+        self._lock = threading.Lock()
+
+    def _load(self) -> ModuleType:
+        with self._lock:
+            if self._module is None:
+                start = time.perf_counter()
+                self._module = importlib.import_module(self._name)
+                elapsed = time.perf_counter() - start
+                LAZY_IMPORT_DURATION.set(self._name, value=elapsed)
+                logger.info(
+                    "Imported %s on first use in %.0f ms.", self._name, elapsed * 1000
+                )
+            return self._module
+
+    def __getattr__(self, attribute: str):
+        module = self._module or self._load()
+        return getattr(module, attribute)
+
+
+def lazy_import(name: str) -> LazyModule:
+    """
+    Returns a proxy that imports the module `name` when it is first used.
+    """
+    return LazyModule(name)
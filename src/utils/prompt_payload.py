@@ -0,0 +1,138 @@
+"""
+Compacts the weather and news data sent to the language model.
+
+The prompts only use the titles and descriptions of the articles, so other
+fields are dropped, descriptions are truncated, articles repeated across the
+local and global feeds are sent once and the whole payload is trimmed to a
+token budget. Tokens are estimated from the text length, which is close
+enough for budgeting without shipping a tokenizer.
+"""
+
+import json
+import math
+import re
+from typing import Any, Dict, List, Tuple
+
+# Rough average for English and Swedish text with the GPT-4o tokenizer
+CHARS_PER_TOKEN = 4
+MIN_DESCRIPTION_CHARS = 60
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    Estimates the number of tokens of a text.
+    """
+    return math.ceil(len(text) / CHARS_PER_TOKEN)
+
+
+def compact_json(data: Any) -> str:
+    """
+    Serializes data without whitespace, keeping non-ASCII characters as they
+    are instead of escaping them.
+    """
+    return json.dumps(data, separators=(",", ":"), ensure_ascii=False)
+
+
+def _normalize_title(title: str) -> str:
+    return " ".join(re.findall(r"\w+", title.lower()))
+
+
+def truncate_text(text: str | None, max_chars: int) -> str:
+    """
+    Shortens text to at most max_chars characters, cutting at a word boundary.
+    """
+    text = " ".join((text or "").split())
+    if len(text) <= max_chars:
+        return text
+    cut = text[: max_chars - 1].rsplit(" ", 1)[0]
+    return cut.rstrip(",.;:") + "…"
+
+
+def compact_articles(
+    feeds: List[List[Dict[str, Any]]], max_description_chars: int
+) -> List[List[Dict[str, str]]]:
+    """
+    Keeps the title and a truncated description of each article and removes
+    articles whose title already appeared, in the same or an earlier feed.
+    Args:
+        feeds (list): Lists of articles, in order of priority.
+        max_description_chars (int): Maximum length of a description.
+    Returns:
+        list: The compacted feeds, in the same order.
+    """
+    seen = set()
+    compacted = []
+    for feed in feeds:
+        articles = []
+        for article in feed or []:
+            title = " ".join((article.get("title") or "").split())
+            key = _normalize_title(title)
+            if not key or key in seen:
+                continue
+            seen.add(key)
+            description = truncate_text(
+                article.get("description"), max_description_chars
+            )
+            entry = {"title": title}
+            # Descriptions that only repeat the title add nothing
+            if description and _normalize_title(description) != key:
+                entry["description"] = description
+            articles.append(entry)
+        compacted.append(articles)
+    return compacted
+
+
+def build_news_payload(
+    weather: Dict[str, Any],
+    local_news: List[Dict[str, Any]],
+    global_news: List[Dict[str, Any]],
+    max_tokens: int,
+    max_description_chars: int = 300,
+) -> Tuple[str, Dict[str, int]]:
+    """
+    Builds the compact JSON input of the emotional responses prompt.
+    Descriptions are shortened first and articles dropped from the end of the
+    longer feed after that, until the payload fits in max_tokens.
+    Args:
+        weather (dict): The daily weather summary.
+        local_news (list): Local articles.
+        global_news (list): Global articles.
+        max_tokens (int): Token budget of the payload.
+        max_description_chars (int): Starting maximum length of descriptions.
+    Returns:
+        tuple: The payload and statistics on what was removed.
+    """
+    weather = {
+        key: round(value, 1) if isinstance(value, float) else value
+        for key, value in (weather or {}).items()
+    }
+    original_count = len(local_news or []) + len(global_news or [])
+    description_chars = max_description_chars
+
+    while True:
+        local, global_ = compact_articles([local_news, global_news], description_chars)
+        articles = len(local) + len(global_)
+        payload = compact_json(
+            {"weather": weather, "local_news": local, "global_news": global_}
+        )
+        if (
+            estimate_tokens(payload) <= max_tokens
+            or description_chars <= MIN_DESCRIPTION_CHARS
+        ):
+            break
+        description_chars = max(MIN_DESCRIPTION_CHARS, description_chars // 2)
+
+    duplicates = original_count - articles
+    while estimate_tokens(payload) > max_tokens and (local or global_):
+        (local if len(local) > len(global_) else global_).pop()
+        payload = compact_json(
+            {"weather": weather, "local_news": local, "global_news": global_}
+        )
+
+    return payload, {
+        "articles": len(local) + len(global_),
+        "duplicates": duplicates,
+        "dropped": articles - len(local) - len(global_),
+        "description_chars": description_chars,
+        "tokens": estimate_tokens(payload),
+    }
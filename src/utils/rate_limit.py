@@ -0,0 +1,146 @@
+"""
+Per-lamp rate limiting of device commands.
+
+A Tapo bulb drops its session when it gets more commands than it can handle,
+which costs a new handshake. Every command that changes the lamp's state
+therefore takes a token from the lamp's token bucket first. The bucket refills
+at a steady rate up to a burst size, so a single apply goes out at once while
+sustained traffic, e.g. from transitions, retries and several clients, is
+spread out to the rate the lamp keeps up with. Reads of the device info, as
+on every connect, are cheap for the lamp and not limited, so they don't use up
+the burst an apply needs.
+
+The bucket of a lamp is kept in a file next to its device lock, so all
+workers share it. A caller reserves its token under a short lock and sleeps
+outside of it, which keeps the commands in the order they were reserved.
+"""
+
+import asyncio
+import logging
+import os
+import time
+from dataclasses import dataclass
+from typing import Tuple
+
+from metrics import counter, histogram
+from utils.coordination import device_file, named_lock
+
+THROTTLE_DELAY = histogram(
+    "luminasync_device_throttle_delay_seconds",
+    "Time a device command waited for its lamp's rate limit.",
+    ["ip"],
+)
+THROTTLED_COMMANDS = counter(
+    "luminasync_device_throttled_commands_total",
+    "Device commands delayed by the rate limit of their lamp.",
+    ["ip"],
+)
+
+# Operations that only read the lamp's state and skip the rate limit
+READ_OPERATIONS = frozenset({"get_device_info", "get_device_name"})
+
+logger = logging.getLogger("LuminaSync")
+
+
+@dataclass(frozen=True)
+class TokenBucket:
+    """
+    Attributes:
+        rate (float): Tokens added per second.
+        burst (float): Maximum number of tokens in the bucket.
+    """
+
+    rate: float
+    burst: float
+
+    def reserve(self, tokens: float, updated: float, now: float) -> Tuple[float, float]:
+        """
+        Takes one token from a bucket that held `tokens` at `updated`.
+        An empty bucket goes into debt, so later callers wait behind earlier
+        ones.
+        Returns:
+            tuple: The tokens left at `now` and the seconds to wait before
+                the token may be used.
+        """
+        tokens = min(self.burst, tokens + max(0.0, now - updated) * self.rate)
+        tokens -= 1
+        wait = -tokens / self.rate if tokens < 0 else 0.0
+        return tokens, wait
+
+
+class DeviceRateLimiter:
+    """
+    Token buckets per lamp IP, shared by all workers through files under the
+    lock folder. A rate of 0 disables the limit.
+    """
+
+    def __init__(self, rate: float, burst: float):
+        self.bucket = TokenBucket(rate, max(1.0, burst))
+
+    @property
+    def enabled(self) -> bool:
+        return self.bucket.rate > 0
+
+    def _load(self, path: str) -> Tuple[float, float]:
+        try:
+            with open(path, encoding="utf-8") as handle:
+                tokens, updated = handle.read().split()
+            return float(tokens), float(updated)
+        except (OSError, ValueError):
+            # A missing or unreadable bucket starts full
+            return self.bucket.burst, 0.0
+
+    def _save(self, path: str, tokens: float, updated: float) -> None:
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, "w", encoding="utf-8") as handle:
+                handle.write(f"{tokens!r} {updated!r}")
+        except OSError as e:
+            logger.warning("Could not store the rate limit of %s: %s", path, e)
+
+    def reserve(self, ip: str) -> float:
+        """
+        Takes a token for one command to the lamp.
+        Returns:
+            float: The seconds the command has to wait.
+        """
+        if not self.enabled:
+            return 0.0
+        path = device_file(ip, "bucket")
+        with named_lock(f"bucket-{ip}").acquire():
+            tokens, updated = self._load(path)
+            now = time.time()
+            tokens, wait = self.bucket.reserve(tokens, updated, now)
+            self._save(path, tokens, now)
+        return wait
+
+    def _observe(self, ip: str, wait: float) -> None:
+        if wait > 0:
+            THROTTLED_COMMANDS.inc(ip)
+            logger.debug("Throttling command to %s for %.3f s", ip, wait)
+        if self.enabled:
+            THROTTLE_DELAY.observe(wait, ip)
+
+    def throttle(self, ip: str) -> float:
+        """
+        Waits until a command may be sent to the lamp.
+        Returns:
+            float: The seconds waited.
+        """
+        wait = self.reserve(ip)
+        self._observe(ip, wait)
+        if wait > 0:
+            time.sleep(wait)
+        return wait
+
+    async def throttle_async(self, ip: str) -> float:
+        """
+        Like `throttle`, without blocking the event loop. The reservation
+        takes a file lock and reads and writes the bucket, so it runs in a
+        worker thread.
+        """
+        wait = await asyncio.to_thread(self.reserve, ip) if self.enabled else 0.0
+        self._observe(ip, wait)
+        if wait > 0:
+            await asyncio.sleep(wait)
+        return wait
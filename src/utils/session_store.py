@@ -0,0 +1,160 @@
+"""
+An encrypted store for device session material under db/sessions.
+
+Each entry is a small JSON document kept in its own file, encrypted with
+AES-GCM. The key is derived from a secret, the Tapo password, with PBKDF2 and
+a random salt stored next to the entries, so the files are useless without
+the configuration of the app. The entry name is bound to the ciphertext as
+associated data, so an entry can't be passed off as another lamp's.
+
+An entry that can't be read or decrypted, e.g. after the password changed,
+is treated as missing. The key derivation is slow on purpose, so it is
+started in the background when the app starts, see `prepare_session_store`.
+"""
+
+import base64
+import hashlib
+import json
+import logging
+import os
+import threading
+from functools import cache
+from typing import Any, Dict, Optional
+
+from Crypto.Cipher import AES
+
+from settings import get_settings
+from utils.coordination import safe_file_name
+
+SESSION_DIR = os.path.join("db", "sessions")
+SALT_FILE = "store.salt"
+KDF_ITERATIONS = 200_000
+NONCE_BYTES = 12
+TAG_BYTES = 16
+
+logger = logging.getLogger("LuminaSync")
+
+
+def encode_bytes(value: bytes) -> str:
+    return base64.b64encode(value).decode("ascii")
+
+
+def decode_bytes(value: str) -> bytes:
+    return base64.b64decode(value.encode("ascii"))
+
+
+class SessionStore:
+    """
+    Encrypted JSON entries by name, shared by all processes using the same
+    directory and secret.
+    """
+
+    def __init__(self, secret: str, directory: str = SESSION_DIR) -> None:
+        self.directory = directory
+        self._secret = secret.encode("utf-8")
+        self._key: Optional[bytes] = None
+        self._key_lock = threading.Lock()
+
+    def _path(self, name: str) -> str:
+        return os.path.join(self.directory, f"{safe_file_name(name)}.session")
+
+    def _salt(self) -> bytes:
+        path = os.path.join(self.directory, SALT_FILE)
+        try:
+            os.makedirs(self.directory, mode=0o700, exist_ok=True)
+            # Exclusive creation, so workers starting together agree on a salt
+            descriptor = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+            with os.fdopen(descriptor, "wb") as handle:
+                handle.write(os.urandom(16))
+        except FileExistsError:
+            pass
+        with open(path, "rb") as handle:
+            return handle.read()
+
+    def _cipher_key(self) -> bytes:
+        # Derived once per process; the derivation is slow on purpose
+        with self._key_lock:
+            if self._key is None:
+                self._key = hashlib.pbkdf2_hmac(
+                    "sha256", self._secret, self._salt(), KDF_ITERATIONS, dklen=32
+                )
+            return self._key
+
+    def prepare(self) -> None:
+        """
+        Derives the key now instead of on the first load or save.
+        """
+        self._cipher_key()
+
+    def load(self, name: str) -> Optional[Dict[str, Any]]:
+        """
+        Returns the entry stored under `name`, or None.
+        """
+        try:
+            with open(self._path(name), "rb") as handle:
+                data = handle.read()
+        except FileNotFoundError:
+            return None
+        except OSError as e:
+            logger.warning("Could not read the stored session %s: %s", name, e)
+            return None
+        try:
+            nonce = data[:NONCE_BYTES]
+            ciphertext, tag = data[NONCE_BYTES:-TAG_BYTES], data[-TAG_BYTES:]
+            cipher = AES.new(self._cipher_key(), AES.MODE_GCM, nonce=nonce)
+            cipher.update(name.encode("utf-8"))
+            return json.loads(cipher.decrypt_and_verify(ciphertext, tag))
+        except (ValueError, KeyError, OSError) as e:
+            logger.info("Discarding the unreadable stored session %s: %s", name, e)
+            self.delete(name)
+            return None
+
+    def save(self, name: str, entry: Dict[str, Any]) -> None:
+        """
+        Encrypts and stores an entry, replacing the previous one atomically.
+        """
+        path = self._path(name)
+        try:
+            nonce = os.urandom(NONCE_BYTES)
+            cipher = AES.new(self._cipher_key(), AES.MODE_GCM, nonce=nonce)
+            cipher.update(name.encode("utf-8"))
+            ciphertext, tag = cipher.encrypt_and_digest(
+                json.dumps(entry).encode("utf-8")
+            )
+            temporary = f"{path}.{os.getpid()}.{threading.get_ident()}"
+            descriptor = os.open(
+                temporary, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600
+            )
+            with os.fdopen(descriptor, "wb") as handle:
+                handle.write(nonce + ciphertext + tag)
+            os.replace(temporary, path)
+        except OSError as e:
+            logger.warning("Could not store the session %s: %s", name, e)
+
+    def delete(self, name: str) -> None:
+        try:
+            os.remove(self._path(name))
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            logger.warning("Could not delete the stored session %s: %s", name, e)
+
+
+@cache
+def session_store() -> SessionStore | None:
+    settings = get_settings()
+    if not settings.tapo_session_store or not settings.tapo_password:
+        return None
+    return SessionStore(settings.tapo_password)
+
+
+def prepare_session_store() -> None:
+    """
+    Derives the key of the session store in a daemon thread, so the first
+    lamp command doesn't wait for it.
+    """
+    store = session_store()
+    if store is not None:
+        threading.Thread(
+            target=store.prepare, name="session-store-key", daemon=True
+        ).start()
@@ -0,0 +1,118 @@
+"""
+Sunrise and sunset, computed locally with the NOAA solar equations.
+
+The equations of the NOAA solar calculator give the times within a minute
+for latitudes between the polar circles, which is plenty for switching
+lights. Each event is computed twice, the second time with the position of
+the sun at the first estimate.
+"""
+
+import math
+from datetime import date, datetime, time, timedelta, timezone
+from typing import Optional, Tuple
+
+# The sun's upper edge on the horizon, with the atmospheric refraction
+SUNRISE_ZENITH = 90.833
+_JULIAN_ORDINAL_OFFSET = 1721424.5
+_J2000 = 2451545.0
+
+
+def _julian_century(julian_day: float) -> float:
+    return (julian_day - _J2000) / 36525.0
+
+
+def _sun_position(julian_day: float) -> Tuple[float, float]:
+    """
+    The equation of time and the declination of the sun.
+    Returns:
+        tuple: The equation of time in minutes and the declination in
+            radians.
+    """
+    t = _julian_century(julian_day)
+    mean_longitude = math.radians((280.46646 + t * (36000.76983 + t * 0.0003032)) % 360)
+    mean_anomaly = math.radians(357.52911 + t * (35999.05029 - 0.0001537 * t))
+    eccentricity = 0.016708634 - t * (0.000042037 + 0.0000001267 * t)
+    center = (
+        math.sin(mean_anomaly) * (1.914602 - t * (0.004817 + 0.000014 * t))
+        + math.sin(2 * mean_anomaly) * (0.019993 - 0.000101 * t)
+        + math.sin(3 * mean_anomaly) * 0.000289
+    )
+    omega = math.radians(125.04 - 1934.136 * t)
+    apparent_longitude = math.radians(
+        math.degrees(mean_longitude) + center - 0.00569 - 0.00478 * math.sin(omega)
+    )
+    seconds = 21.448 - t * (46.815 + t * (0.00059 - t * 0.001813))
+    mean_obliquity = 23 + (26 + seconds / 60) / 60
+    obliquity = math.radians(mean_obliquity + 0.00256 * math.cos(omega))
+    declination = math.asin(math.sin(obliquity) * math.sin(apparent_longitude))
+
+    y = math.tan(obliquity / 2) ** 2
+    equation_of_time = 4 * math.degrees(
+        y * math.sin(2 * mean_longitude)
+        - 2 * eccentricity * math.sin(mean_anomaly)
+        + 4 * eccentricity * y * math.sin(mean_anomaly) * math.cos(2 * mean_longitude)
+        - 0.5 * y * y * math.sin(4 * mean_longitude)
+        - 1.25 * eccentricity * eccentricity * math.sin(2 * mean_anomaly)
+    )
+    return equation_of_time, declination
+
+
+def _event_minutes(
+    julian_day: float, latitude: float, longitude: float, rising: bool
+) -> Optional[float]:
+    """
+    Minutes after midnight UTC of sunrise or sunset around `julian_day`, or
+    None when the sun doesn't cross the horizon that day.
+    """
+    equation_of_time, declination = _sun_position(julian_day)
+    phi = math.radians(latitude)
+    cos_hour_angle = math.cos(math.radians(SUNRISE_ZENITH)) / (
+        math.cos(phi) * math.cos(declination)
+    ) - math.tan(phi) * math.tan(declination)
+    if not -1 <= cos_hour_angle <= 1:
+        return None
+    hour_angle = math.degrees(math.acos(cos_hour_angle))
+    solar_noon = 720 - 4 * longitude - equation_of_time
+    return solar_noon - 4 * hour_angle if rising else solar_noon + 4 * hour_angle
+
+
+def sun_event(
+    day: date, latitude: float, longitude: float, rising: bool
+) -> Optional[datetime]:
+    """
+    The time of sunrise or sunset on a day, in UTC.
+    Args:
+        day (date): The UTC date of the event.
+        latitude (float): Latitude in degrees, north positive.
+        longitude (float): Longitude in degrees, east positive.
+        rising (bool): True for sunrise, False for sunset.
+    Returns:
+        datetime: The time of the event, None during the polar day or night.
+    """
+    midnight = day.toordinal() + _JULIAN_ORDINAL_OFFSET
+    # First with the sun at local noon
+    noon = midnight + 0.5 - longitude / 360
+    minutes = _event_minutes(noon, latitude, longitude, rising)
+    if minutes is None:
+        return None
+    # Again with the sun at the estimated time of the event
+    minutes = _event_minutes(midnight + minutes / 1440, latitude, longitude, rising)
+    if minutes is None:
+        return None
+    start = datetime.combine(day, time(0), tzinfo=timezone.utc)
+    return start + timedelta(seconds=round(minutes * 60))
+
+
+def sun_times(
+    day: date, latitude: float, longitude: float
+) -> Tuple[Optional[datetime], Optional[datetime]]:
+    """
+    Sunrise and sunset on a day, in UTC.
+    Returns:
+        tuple: Sunrise and sunset, either None when the sun doesn't rise or
+            set that day.
+    """
+    return (
+        sun_event(day, latitude, longitude, rising=True),
+        sun_event(day, latitude, longitude, rising=False),
+    )
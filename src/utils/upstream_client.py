@@ -0,0 +1,175 @@
+"""
+The HTTP client shared by the calls to the upstream APIs.
+
+All calls go through one `requests.Session`, so connections to open-meteo
+and newsdata are kept alive and reused from a pool instead of being set up
+for every request. On top of that, the client:
+
+- retries GET requests that failed with a connection error, a 429 or a 5xx,
+  up to a bounded number of times, with exponential backoff and full jitter.
+  A `Retry-After` header is honoured when it is shorter than the cap.
+- limits the requests in flight per host, so concurrent regenerations don't
+  trip the rate limits of the APIs.
+- revalidates responses that came with an `ETag` or `Last-Modified` header.
+  A 304 returns the cached response, without downloading the body again.
+- copies the parameters of every call, so callers can't leak parameters
+  from one call into the next.
+"""
+
+import logging
+import random
+import threading
+import time
+from collections import OrderedDict
+from functools import cache
+from typing import Any, Dict, Mapping, Optional, Tuple
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from metrics import counter
+from settings import get_settings
+
+RETRY_STATUSES = frozenset({429, 500, 502, 503, 504})
+BACKOFF_BASE = 0.5
+BACKOFF_CAP = 8.0
+# Revalidated responses kept per client
+CACHE_SIZE = 64
+
+UPSTREAM_RETRIES = counter(
+    "luminasync_upstream_retries_total",
+    "Upstream requests repeated after a connection error or a retryable status.",
+    ["host", "reason"],
+)
+UPSTREAM_NOT_MODIFIED = counter(
+    "luminasync_upstream_not_modified_total",
+    "Upstream requests answered from the cache after a 304.",
+    ["host"],
+)
+
+logger = logging.getLogger("LuminaSync")
+
+_CacheKey = Tuple[str, Tuple[Tuple[str, str], ...]]
+
+
+def backoff_delay(attempt: int, retry_after: Optional[float] = None) -> float:
+    """
+    The pause before retry number `attempt`, starting at 0.
+    """
+    delay = random.uniform(0, min(BACKOFF_CAP, BACKOFF_BASE * 2**attempt))
+    if retry_after is not None:
+        delay = max(delay, min(retry_after, BACKOFF_CAP))
+    return delay
+
+
+def _retry_after(response: requests.Response) -> Optional[float]:
+    # Only the seconds form; an HTTP date falls back to the backoff
+    try:
+        return max(0.0, float(response.headers["Retry-After"]))
+    except (KeyError, ValueError):
+        return None
+
+
+class UpstreamClient:
+    """
+    A pooled session with retries, per-host limits and revalidation.
+    """
+
+    def __init__(self, max_retries: int = 3, host_concurrency: int = 4) -> None:
+        self.max_retries = max(0, max_retries)
+        self.host_concurrency = max(1, host_concurrency)
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=8, pool_maxsize=self.host_concurrency)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self._hosts: Dict[str, threading.BoundedSemaphore] = {}
+        self._cache: "OrderedDict[_CacheKey, requests.Response]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _host_slot(self, host: str) -> threading.BoundedSemaphore:
+        with self._lock:
+            if host not in self._hosts:
+                self._hosts[host] = threading.BoundedSemaphore(self.host_concurrency)
+            return self._hosts[host]
+
+    def _cached(self, key: _CacheKey) -> Optional[requests.Response]:
+        with self._lock:
+            return self._cache.get(key)
+
+    def _store(self, key: _CacheKey, response: requests.Response) -> None:
+        if not (response.headers.get("ETag") or response.headers.get("Last-Modified")):
+            return
+        with self._lock:
+            self._cache[key] = response
+            self._cache.move_to_end(key)
+            while len(self._cache) > CACHE_SIZE:
+                self._cache.popitem(last=False)
+
+    def get(
+        self,
+        url: str,
+        params: Optional[Mapping[str, Any]] = None,
+        timeout: float = 30,
+    ) -> requests.Response:
+        """
+        Sends a GET request, retrying it when that may help.
+        Returns:
+            requests.Response: The final response, which may still be an
+                error. Connection errors of the last attempt are raised.
+        """
+        params = dict(params or {})
+        key = (url, tuple(sorted((str(k), str(v)) for k, v in params.items())))
+        host = urlsplit(url).netloc
+        cached = self._cached(key)
+        headers = {}
+        if cached is not None:
+            if cached.headers.get("ETag"):
+                headers["If-None-Match"] = cached.headers["ETag"]
+            if cached.headers.get("Last-Modified"):
+                headers["If-Modified-Since"] = cached.headers["Last-Modified"]
+
+        attempt = 0
+        while True:
+            try:
+                with self._host_slot(host):
+                    response = self.session.get(
+                        url, params=params, headers=headers, timeout=timeout
+                    )
+            except (requests.ConnectionError, requests.Timeout) as e:
+                if attempt >= self.max_retries:
+                    raise
+                reason, delay = type(e).__name__, backoff_delay(attempt)
+            else:
+                if response.status_code == 304 and cached is not None:
+                    UPSTREAM_NOT_MODIFIED.inc(host)
+                    return cached
+                if (
+                    response.status_code not in RETRY_STATUSES
+                    or attempt >= self.max_retries
+                ):
+                    if response.status_code == 200:
+                        self._store(key, response)
+                    return response
+                reason = str(response.status_code)
+                delay = backoff_delay(attempt, _retry_after(response))
+                response.close()
+            UPSTREAM_RETRIES.inc(host, reason)
+            logger.info(
+                "Retrying %s in %.2f s after %s (attempt %s of %s).",
+                host,
+                delay,
+                reason,
+                attempt + 1,
+                self.max_retries,
+            )
+            time.sleep(delay)
+            attempt += 1
+
+
+@cache
+def upstream_client() -> UpstreamClient:
+    settings = get_settings()
+    return UpstreamClient(
+        settings.upstream_max_retries, settings.upstream_host_concurrency
+    )
@@ -0,0 +1,44 @@
+"""
+Last success times of the external APIs, shared by all processes.
+
+A successful call touches a stamp file under db/health, so the health check
+of any worker also sees calls made by another worker or by the scheduled
+`update_presets.py` run. Only the standard library is used, because
+`metrics.track_upstream` records the stamps.
+"""
+
+import logging
+import os
+
+STATUS_DIR = os.path.join("db", "health")
+
+logger = logging.getLogger("LuminaSync")
+
+
+def _stamp_path(upstream: str) -> str:
+    return os.path.join(STATUS_DIR, f"{upstream}.success")
+
+
+def record_success(upstream: str) -> None:
+    """
+    Stores the current time as the last success of an upstream.
+    """
+    path = _stamp_path(upstream)
+    try:
+        os.makedirs(STATUS_DIR, exist_ok=True)
+        with open(path, "a", encoding="utf-8"):
+            pass
+        os.utime(path)
+    except OSError as e:
+        logger.warning("Could not record the success of %s: %s", upstream, e)
+
+
+def last_success(upstream: str) -> float | None:
+    """
+    Returns the time of the last successful call as a Unix timestamp, or None
+    when the upstream never succeeded.
+    """
+    try:
+        return os.stat(_stamp_path(upstream)).st_mtime
+    except FileNotFoundError:
+        return None